@@ -1,22 +1,31 @@
 import logging
 import pprint
 
+import attr
+from concurrent import futures
+
+from ansible_galaxy import artifact_cache
 from ansible_galaxy import collection_artifact
 from ansible_galaxy import collections_lockfile
 from ansible_galaxy import display
 from ansible_galaxy import download
 from ansible_galaxy import exceptions
+from ansible_galaxy import http_session
+from ansible_galaxy import http_transfer
 from ansible_galaxy import install
 from ansible_galaxy import installed_repository_db
 from ansible_galaxy import matchers
-from ansible_galaxy import repository
 from ansible_galaxy import repository_spec_parse
 from ansible_galaxy import requirements
+from ansible_galaxy import resolver
+from ansible_galaxy.config import defaults
 from ansible_galaxy.fetch import fetch_factory
 from ansible_galaxy.models.collections_lock import CollectionsLock
-from ansible_galaxy.models.repository_spec import FetchMethods
+from ansible_galaxy.models.install_plan import InstallPlan
+from ansible_galaxy.models.repository_spec import FetchMethods, RepositorySpec
 from ansible_galaxy.models.requirement import Requirement, RequirementOps
 from ansible_galaxy.models.requirement_spec import RequirementSpec
+from ansible_galaxy.rest_api import GalaxyAPI
 
 log = logging.getLogger(__name__)
 
@@ -59,7 +68,9 @@ def install_repositories_matching_repository_specs(galaxy_context,
                                                    # TODO: error handling callback ?
                                                    ignore_errors=False,
                                                    no_deps=False,
-                                                   force_overwrite=False):
+                                                   force_overwrite=False,
+                                                   installed_index=None,
+                                                   galaxy_api=None):
     '''Install a set of repositories specified by repository_specs if they are not already installed'''
 
     # log.debug('editable: %s', editable)
@@ -73,8 +84,8 @@ def install_repositories_matching_repository_specs(galaxy_context,
     requested_repository_specs = [x.requirement_spec for x in requirements_list]
     repository_spec_match_filter = matchers.MatchRepositorySpecNamespaceName(requested_repository_specs)
 
-    irdb = installed_repository_db.InstalledRepositoryDatabase(galaxy_context)
-    already_installed_generator = irdb.select(repository_spec_match_filter=repository_spec_match_filter)
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+    already_installed_generator = installed_index.select(repository_spec_match_filter=repository_spec_match_filter)
 
     # FIXME: if/when GalaxyContent and InstalledGalaxyContent are attr.ib based and frozen and hashable
     #        we can simplify this filter with set ops
@@ -96,7 +107,9 @@ def install_repositories_matching_repository_specs(galaxy_context,
                                 display_callback=display_callback,
                                 ignore_errors=ignore_errors,
                                 no_deps=no_deps,
-                                force_overwrite=force_overwrite)
+                                force_overwrite=force_overwrite,
+                                installed_index=installed_index,
+                                galaxy_api=galaxy_api)
 
 
 def load_collections_lockfile(lockfile_path):
@@ -126,10 +139,20 @@ def install_repository_specs_loop(galaxy_context,
                                   # TODO: error handling callback ?
                                   ignore_errors=False,
                                   no_deps=False,
-                                  force_overwrite=False):
+                                  force_overwrite=False,
+                                  frozen=False):
+    '''Install repository_spec_strings, requirements_list and the collections in collections_lockfile_path
+
+    If frozen is True, the collections lockfile must be a frozen lockfile (with a version
+    and download_url for every collection, ie from 'mazer list --lockfile --freeze') and
+    the collections in it are downloaded (or found in the artifact cache) without any Galaxy
+    API requests. Any dependencies of those collections must be in the lockfile as well.'''
 
     requirements_list = requirements_list or []
 
+    if frozen and not collections_lockfile_path:
+        raise exceptions.GalaxyClientError('A collections lockfile is required for a frozen install')
+
     for repository_spec_string in repository_spec_strings:
         fetch_method = \
             repository_spec_parse.choose_repository_fetch_method(repository_spec_string,
@@ -149,11 +172,7 @@ def install_repository_specs_loop(galaxy_context,
             # rest of the repo_spec data
             log.debug('repository_spec_string: %s', repository_spec_string)
 
-            tmp_downloaded_path = download.fetch_url(repository_spec_string,
-                                                     # Note: ignore_certs is meant for galaxy server,
-                                                     # overloaded to apply for arbitrary http[s] downloads here
-                                                     validate_certs=not galaxy_context.server['ignore_certs'])
-            spec_data = collection_artifact.load_data_from_collection_artifact(tmp_downloaded_path)
+            spec_data = _fetch_remote_url_spec_data(galaxy_context, repository_spec_string)
 
             # pretend like this is a local_file install now
             spec_data['fetch_method'] = FetchMethods.LOCAL_FILE
@@ -176,9 +195,13 @@ def install_repository_specs_loop(galaxy_context,
 
     if collections_lockfile_path:
         # load collections lockfile as if the 'dependencies' dict from a collection_info
-        collections_lockfile = load_collections_lockfile(collections_lockfile_path)
+        collections_lockfile_ = load_collections_lockfile(collections_lockfile_path)
 
-        dependencies_list = requirements.from_dependencies_dict(collections_lockfile.dependencies)
+        if frozen:
+            dependencies_list = collections_lockfile.frozen_requirements(collections_lockfile_)
+        else:
+            dependencies_list = \
+                requirements.from_dependencies_dict(collections_lockfile.dependencies_dict(collections_lockfile_))
 
         # Create the CollectionsLock for the validators
         collections_lock = CollectionsLock(dependencies=dependencies_list)
@@ -187,6 +210,22 @@ def install_repository_specs_loop(galaxy_context,
 
     log.debug('requirements_list: %s', requirements_list)
 
+    # The one view of what is installed for the rest of this install run
+    installed_index = installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+
+    # The one GalaxyAPI for this install run, so the same lookups are only made once
+    galaxy_api = GalaxyAPI(galaxy_context)
+
+    # A frozen lockfile was already resolved when it was created
+    if not frozen and not no_deps:
+        requirements_list = resolve_requirements(galaxy_context,
+                                                 requirements_list,
+                                                 display_callback=display_callback,
+                                                 ignore_errors=ignore_errors,
+                                                 force_overwrite=force_overwrite,
+                                                 installed_index=installed_index,
+                                                 galaxy_api=galaxy_api)
+
     while True:
         if not requirements_list:
             break
@@ -209,7 +248,9 @@ def install_repository_specs_loop(galaxy_context,
                                                            display_callback=display_callback,
                                                            ignore_errors=ignore_errors,
                                                            no_deps=no_deps,
-                                                           force_overwrite=force_overwrite)
+                                                           force_overwrite=force_overwrite,
+                                                           installed_index=installed_index,
+                                                           galaxy_api=galaxy_api)
 
         for just_installed_repo in just_installed_repositories:
             display_callback('  Installed: %s (to %s)' %
@@ -221,16 +262,199 @@ def install_repository_specs_loop(galaxy_context,
         # requirements_list = new_requirements_list
         requirements_list = find_new_deps_from_installed(galaxy_context,
                                                          just_installed_repositories,
-                                                         no_deps=no_deps)
+                                                         no_deps=no_deps,
+                                                         installed_index=installed_index)
+
+        # Everything in a frozen lockfile was just installed, so anything still needed is missing from it
+        if frozen and requirements_list:
+            raise exceptions.GalaxyClientError('Dependencies not found in the frozen collections lockfile %s: %s' %
+                                               (collections_lockfile_path,
+                                                ', '.join(sorted([req.requirement_spec.label for req in requirements_list]))))
 
     # FIXME: what results to return?
     return 0
 
 
-def find_new_deps_from_installed(galaxy_context, installed_repos, no_deps=False):
+def resolve_requirements(galaxy_context,
+                         requirements_list,
+                         display_callback=None,
+                         ignore_errors=False,
+                         force_overwrite=False,
+                         installed_index=None,
+                         galaxy_api=None):
+    '''Pin the Galaxy requirements in requirements_list, and all of their dependencies, to resolved versions
+
+    The versions are chosen by resolver.resolve() so that every version spec that requires
+    a collection is satisfied. The returned list has an exact version ('==1.2.3') requirement for
+    each of those collections that needs to be installed, plus the requirements for anything not
+    from Galaxy (local artifacts, editable installs, remote urls) as is.
+
+    An installed collection is kept as is. Without force_overwrite, the installed version is the
+    only one that can be chosen for it, so a requirement it doesn't satisfy is a conflict instead
+    of a collection that is silently left unchanged. With force_overwrite, the requested
+    collections are resolved (and reinstalled) as if they were not installed, but the installed
+    versions of their dependencies are still tried first.
+
+    If the requirements can not all be satisfied, GalaxyResolutionError explains why, and nothing
+    is installed (or with ignore_errors, requirements_list is returned to be installed as before).'''
+
+    display_callback = display_callback or display.display_callback
+
+    galaxy_requirements = [req for req in requirements_list
+                           if req.requirement_spec.fetch_method == FetchMethods.GALAXY_URL and req.requirement_spec.namespace]
+
+    if not galaxy_requirements:
+        return requirements_list
+
+    other_requirements = [req for req in requirements_list if req not in galaxy_requirements]
+
+    provided = set([(req.requirement_spec.namespace, req.requirement_spec.name) for req in other_requirements])
+
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+    galaxy_api = galaxy_api or GalaxyAPI(galaxy_context)
+
+    requested_requirement_specs = dict(((req.requirement_spec.namespace, req.requirement_spec.name), req.requirement_spec)
+                                       for req in reversed(galaxy_requirements))
+
+    # Without --force, what is installed stays installed. With --force, the requested
+    # collections are replaced, but what they depend on is only replaced if it has to be.
+    preferred_versions = {}
+    pinned_versions = {}
+
+    # The installed versions are candidates too, even if Galaxy doesn't have them (anymore)
+    installed = {}
+
+    for installed_repository in installed_index.select():
+        installed_repository_spec = installed_repository.repository_spec
+        key = (installed_repository_spec.namespace, installed_repository_spec.name)
+
+        installed[key] = (installed_repository_spec.version,
+                          dict(('%s.%s' % (req.requirement_spec.namespace, req.requirement_spec.name),
+                                str(req.requirement_spec.version_spec))
+                               for req in installed_repository.requirements))
+
+        if not force_overwrite:
+            pinned_versions[key] = installed_repository_spec.version
+        elif key not in requested_requirement_specs:
+            preferred_versions[key] = installed_repository_spec.version
+
+    display_callback('', level='info')
+    display_callback('Resolving collection dependencies...', level='info')
+
+    candidates = resolver.GalaxyCandidates(galaxy_api,
+                                           concurrency=_get_api_concurrency(galaxy_context),
+                                           installed=installed)
+
+    try:
+        resolved = resolver.resolve(galaxy_requirements,
+                                    candidates,
+                                    preferred_versions=preferred_versions,
+                                    pinned_versions=pinned_versions,
+                                    provided=provided)
+    except exceptions.GalaxyError as e:
+        log.warning('Unable to resolve the collection dependencies: %s', e)
+        raise_without_ignore(ignore_errors, e)
+        return requirements_list
+
+    resolved_requirements = []
+
+    for key, resolution in sorted(resolved.items()):
+        installed_version = installed.get(key, (None, None))[0]
+        reinstall = force_overwrite and key in requested_requirement_specs and \
+            not candidates.installed_only(key[0], key[1], resolution['version'])
+
+        # Nothing to install (and find() would not find it on Galaxy if it is installed_only)
+        if resolution['version'] == installed_version and not reinstall:
+            log.debug('Using the installed %s.%s,%s', key[0], key[1], installed_version)
+
+            if key in requested_requirement_specs:
+                display_callback('  %s.%s,%s is already installed' % (key[0], key[1], installed_version), level='info')
+            continue
+
+        version_spec = '==%s' % resolution['version']
+
+        required_by = next((dependent for dependent in resolution['required_by'] if dependent), None)
+
+        repository_spec = None
+        if key in requested_requirement_specs:
+            requirement_spec = attr.evolve(requested_requirement_specs[key], version_spec=version_spec)
+        else:
+            requirement_spec = RequirementSpec(namespace=key[0], name=key[1],
+                                               version_spec=version_spec,
+                                               fetch_method=FetchMethods.GALAXY_URL)
+            repository_spec = RepositorySpec(namespace=required_by[0], name=required_by[1], version=required_by[2])
+
+        resolved_requirements.append(Requirement(repository_spec=repository_spec,
+                                                 op=RequirementOps.EQ,
+                                                 requirement_spec=requirement_spec))
+
+    return resolved_requirements + other_requirements
+
+
+def _fetch_remote_url_spec_data(galaxy_context, remote_url):
+    '''Download the collection artifact at remote_url (or find it in the artifact cache) and return its spec_data
+
+    Only urls to artifacts with a 'namespace-name-version.tar.gz' file name are looked up in
+    the artifact cache, since an arbitrary url ('http://myci.example.com/somebuildjob/latest') can
+    point to a different artifact each time. Even then, the artifact at the url may have been
+    rebuilt since it was cached, so the cached copy is only used if it was downloaded from
+    remote_url and the server says it has not changed since (see download.not_modified()).'''
+
+    cache = artifact_cache.get(galaxy_context)
+
+    artifact_ns_n_v = artifact_cache.parse_artifact_filename(remote_url)
+
+    fetch_kwargs = {
+        # Note: ignore_certs is meant for galaxy server,
+        # overloaded to apply for arbitrary http[s] downloads here
+        'validate_certs': not galaxy_context.server['ignore_certs'],
+        'pool_size': http_session.pool_size(galaxy_context),
+        'transfer_policy': http_transfer.policy(galaxy_context),
+    }
+
+    if cache and artifact_ns_n_v:
+        cached_path = cache.get(*artifact_ns_n_v)
+        source = cached_path and cache.source(cached_path)
+
+        if source and source.get('url', None) == remote_url and \
+                download.not_modified(remote_url, source, **fetch_kwargs):
+            log.debug('Using %s from the artifact cache instead of downloading %s', cached_path, remote_url)
+            return collection_artifact.load_data_from_collection_artifact(cached_path)
+
+        if cached_path:
+            log.debug('The cached %s may not be the artifact at %s now, downloading it', cached_path, remote_url)
+
+    download_results = download.fetch_artifact(remote_url, **fetch_kwargs)
+    downloaded_path = download_results['archive_path']
+
+    spec_data = collection_artifact.load_data_from_collection_artifact(downloaded_path)
+
+    if not cache:
+        return spec_data
+
+    source = {'url': remote_url}
+    source.update(download_results['validators'])
+
+    cached_path = cache.put(downloaded_path,
+                            spec_data['namespace'],
+                            spec_data['name'],
+                            spec_data['version'],
+                            sha256=download_results['sha256'],
+                            source=source)
+
+    # The artifact was moved into the cache, so point the spec at its new location
+    spec_data['src'] = cached_path
+    spec_data['spec_string'] = cached_path
+
+    return spec_data
+
+
+def find_new_deps_from_installed(galaxy_context, installed_repos, no_deps=False, installed_index=None):
     if no_deps:
         return []
 
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+
     # FIXME: Just return the single item list installed_repositories here
     deps_and_reqs_set = set()
 
@@ -261,8 +485,7 @@ def find_new_deps_from_installed(galaxy_context, installed_repos, no_deps=False)
         log.debug('Checking if %s is provided by something installed', str(dep_req))
 
         # Search for an exact ns_n_v match
-        irdb = installed_repository_db.InstalledRepositoryDatabase(galaxy_context)
-        already_installed_iter = irdb.by_requirement(dep_req)
+        already_installed_iter = installed_index.by_requirement(dep_req)
         already_installed = list(already_installed_iter)
 
         log.debug('already_installed: %s', already_installed)
@@ -283,58 +506,343 @@ def find_new_deps_from_installed(galaxy_context, installed_repos, no_deps=False)
     return unsolved_deps_reqs
 
 
-# TODO: split into resolve, find/get metadata, resolve deps, download, install transaction
 def install_repositories(galaxy_context,
                          requirements_to_install,
                          display_callback=None,
                          # TODO: error handling callback ?
                          ignore_errors=False,
                          no_deps=False,
-                         force_overwrite=False):
+                         force_overwrite=False,
+                         installed_index=None,
+                         galaxy_api=None):
+    '''Find, fetch and install requirements_to_install
+
+    This is done in two phases. First every requirement is found (resolved to a RepositorySpec
+    via the fetcher's find()) by a pool of api_concurrency workers. If find() knows the dependencies
+    of what it found (ie, from the Galaxy API), those are found as well, and so on until all of the
+    dependencies are found. Then the artifacts for everything that was found are fetched by a pool of
+    download_concurrency workers, and each artifact is installed (dependencies first) as soon as it and
+    all the artifacts ahead of it have been fetched.
+
+    Dependencies that are only known once the artifact is installed are left for the caller to find
+    with find_new_deps_from_installed().'''
 
     display_callback = display_callback or display.display_callback
     log.debug('requirements_to_install: %s', requirements_to_install)
     # log.debug('no_deps: %s', no_deps)
     # log.debug('force_overwrite: %s', force_overwrite)
 
-    # dep_requirements = []
-    most_installed_repositories = []
-
-    # TODO: this should be adding the content/self.args/content_left to
-    #       a list of needed deps
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
 
     # Remove any dupe repository_specs
     requirements_to_install_uniq = set(requirements_to_install)
 
+    # FIND/RESOLVE phase
     # TODO: if the default ordering of repository_specs isnt useful, may need to tweak it
-    for requirement_to_install in sorted(requirements_to_install_uniq):
-        log.debug('requirement_to_install: %s', requirement_to_install)
-        installed_repositories = install_repository(galaxy_context,
-                                                    requirement_to_install,
-                                                    display_callback=display_callback,
-                                                    ignore_errors=ignore_errors,
-                                                    no_deps=no_deps,
-                                                    force_overwrite=force_overwrite)
-
-        # log.debug('dep_requirement_repository_specs1: %s', dep_requirements)
-
-        if not installed_repositories:
-            log.debug('install_repository() returned None for requirement_to_install: %s', requirement_to_install)
-            continue
+    install_plans = _find_install_plans(galaxy_context,
+                                        sorted(requirements_to_install_uniq),
+                                        display_callback=display_callback,
+                                        ignore_errors=ignore_errors,
+                                        force_overwrite=force_overwrite,
+                                        installed_index=installed_index,
+                                        galaxy_api=galaxy_api)
+
+    if not no_deps:
+        install_plans = _find_dependency_install_plans(galaxy_context,
+                                                       install_plans,
+                                                       display_callback=display_callback,
+                                                       ignore_errors=ignore_errors,
+                                                       force_overwrite=force_overwrite,
+                                                       installed_index=installed_index,
+                                                       galaxy_api=galaxy_api)
+
+    if not install_plans:
+        return []
+
+    # FETCH and INSTALL phase
+    return _fetch_and_install_plans(galaxy_context,
+                                    install_plans,
+                                    display_callback=display_callback,
+                                    ignore_errors=ignore_errors,
+                                    force_overwrite=force_overwrite,
+                                    installed_index=installed_index)
+
+
+class _BufferedDisplay(object):
+    '''A display_callback that saves the messages from a worker thread so they can be shown in order'''
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, *args, **kwargs):
+        self.calls.append((args, kwargs))
+
+    def replay(self, display_callback):
+        for args, kwargs in self.calls:
+            display_callback(*args, **kwargs)
+
+
+def _get_api_concurrency(galaxy_context):
+    api_concurrency = galaxy_context.options.get('api_concurrency', None) or defaults.DEFAULT_API_CONCURRENCY
+
+    return max(1, int(api_concurrency))
+
+
+def _find_install_plans(galaxy_context,
+                        requirements_to_install,
+                        display_callback=None,
+                        ignore_errors=False,
+                        force_overwrite=False,
+                        installed_index=None,
+                        galaxy_api=None):
+    '''find_repository() for each of requirements_to_install at the same time
+
+    Returns the InstallPlans in the same order as requirements_to_install. Messages
+    and errors are also shown/raised in that order.'''
+    api_concurrency = _get_api_concurrency(galaxy_context)
+
+    log.debug('Finding %s requirements with %s workers', len(requirements_to_install), api_concurrency)
+
+    executor = futures.ThreadPoolExecutor(max_workers=api_concurrency)
+
+    find_futures = []
+
+    try:
+        for requirement_to_install in requirements_to_install:
+            buffered_display = _BufferedDisplay()
+
+            find_future = executor.submit(find_repository,
+                                          galaxy_context,
+                                          requirement_to_install,
+                                          display_callback=buffered_display,
+                                          ignore_errors=ignore_errors,
+                                          force_overwrite=force_overwrite,
+                                          installed_index=installed_index,
+                                          galaxy_api=galaxy_api)
+
+            find_futures.append((requirement_to_install, buffered_display, find_future))
+
+        install_plans = []
+
+        for requirement_to_install, buffered_display, find_future in find_futures:
+            log.debug('requirement_to_install: %s', requirement_to_install)
+
+            try:
+                install_plan = find_future.result()
+            finally:
+                buffered_display.replay(display_callback)
+
+            if not install_plan:
+                log.debug('find_repository() returned None for requirement_to_install: %s', requirement_to_install)
+                continue
+
+            install_plans.append(install_plan)
+    finally:
+        # If something failed, don't bother finding the rest
+        for _requirement, _buffered_display, find_future in find_futures:
+            find_future.cancel()
+
+        executor.shutdown(wait=True)
+
+    return install_plans
+
+
+def _dependency_requirements(install_plan):
+    '''The Requirements for the dependencies of install_plan that find() knew about, if any'''
+    dependencies = install_plan.find_results.get('custom', {}).get('dependencies', None)
+
+    if not dependencies:
+        return []
+
+    return requirements.from_dependencies_dict(dependencies, repository_spec=install_plan.repository_spec)
+
+
+def _plan_key(install_plan):
+    return (install_plan.repository_spec.namespace, install_plan.repository_spec.name)
+
+
+def _find_dependency_install_plans(galaxy_context,
+                                   install_plans,
+                                   display_callback=None,
+                                   ignore_errors=False,
+                                   force_overwrite=False,
+                                   installed_index=None,
+                                   galaxy_api=None):
+    '''Find InstallPlans for the dependencies of install_plans, and their dependencies, before anything is fetched
+
+    Each level of dependencies is found at the same time with _find_install_plans(). Dependencies
+    that are already installed or already planned are skipped. Only one version of a collection
+    is planned. If a dependency needs a different version than the one planned, that is left for
+    find_new_deps_from_installed() to complain about after the install.
 
-        for installed_repo in installed_repositories:
-            required_by_blurb = ''
-            if requirement_to_install.repository_spec:
-                required_by_blurb = ' (required by %s)' % requirement_to_install.repository_spec.label
+    Returns all of the InstallPlans in dependency order (a collection after its dependencies).'''
 
-            log.info('Installed %s,%s to %s%s',
-                     installed_repo.label,
-                     installed_repo.repository_spec.version,
-                     installed_repo.path,
-                     required_by_blurb)
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
 
-        most_installed_repositories.extend(installed_repositories)
-        # dep_requirements.extend(new_dep_requirements)
+    install_plans = list(install_plans)
+    planned = dict((_plan_key(install_plan), install_plan) for install_plan in install_plans)
+
+    new_install_plans = install_plans
+
+    while new_install_plans:
+        dep_reqs = set()
+
+        for install_plan in new_install_plans:
+            for dep_req in _dependency_requirements(install_plan):
+                dep_req_spec = dep_req.requirement_spec
+                planned_install_plan = planned.get((dep_req_spec.namespace, dep_req_spec.name), None)
+
+                if planned_install_plan:
+                    if not dep_req_spec.version_spec.match(planned_install_plan.repository_spec.version):
+                        log.debug('The dep_req %s does not match the planned %s',
+                                  dep_req, planned_install_plan.repository_spec)
+                    continue
+
+                if list(installed_index.by_requirement(dep_req)):
+                    log.debug('The dep_req %s is already provided by something installed', dep_req)
+                    continue
+
+                dep_reqs.add(dep_req)
+
+        if not dep_reqs:
+            break
+
+        display_callback('', level='info')
+        display_callback('Dependencies to install:', level='info')
+
+        for dep_req in sorted(dep_reqs):
+            display_callback('  %s (required by %s)' % (dep_req.requirement_spec.label, dep_req.repository_spec),
+                             level='info')
+
+        new_install_plans = []
+
+        for install_plan in _find_install_plans(galaxy_context,
+                                                sorted(dep_reqs),
+                                                display_callback=display_callback,
+                                                ignore_errors=ignore_errors,
+                                                force_overwrite=force_overwrite,
+                                                installed_index=installed_index,
+                                                galaxy_api=galaxy_api):
+            # Two requirements for the same collection may have been found at the same time
+            if _plan_key(install_plan) in planned:
+                continue
+
+            planned[_plan_key(install_plan)] = install_plan
+            new_install_plans.append(install_plan)
+
+        install_plans.extend(new_install_plans)
+
+    return _dependency_order(install_plans)
+
+
+def _dependency_order(install_plans):
+    '''Sort install_plans so every plan comes after the plans for its dependencies
+
+    Otherwise, the order of install_plans is kept. Dependency cycles are broken
+    at the first plan in the cycle.'''
+    planned = dict((_plan_key(install_plan), install_plan) for install_plan in install_plans)
+
+    ordered_install_plans = []
+    visited = set()
+
+    def visit(install_plan):
+        if _plan_key(install_plan) in visited:
+            return
+
+        visited.add(_plan_key(install_plan))
+
+        for dep_req in _dependency_requirements(install_plan):
+            dep_install_plan = planned.get((dep_req.requirement_spec.namespace, dep_req.requirement_spec.name), None)
+
+            if dep_install_plan:
+                visit(dep_install_plan)
+
+        ordered_install_plans.append(install_plan)
+
+    for install_plan in install_plans:
+        visit(install_plan)
+
+    return ordered_install_plans
+
+
+def _get_download_concurrency(galaxy_context):
+    download_concurrency = galaxy_context.options.get('download_concurrency', None) or defaults.DEFAULT_DOWNLOAD_CONCURRENCY
+
+    return max(1, int(download_concurrency))
+
+
+def _fetch_and_install_plans(galaxy_context,
+                             install_plans,
+                             display_callback=None,
+                             ignore_errors=False,
+                             force_overwrite=False,
+                             installed_index=None):
+    most_installed_repositories = []
+
+    download_concurrency = _get_download_concurrency(galaxy_context)
+
+    log.debug('Fetching %s collection artifacts with %s workers', len(install_plans), download_concurrency)
+
+    executor = futures.ThreadPoolExecutor(max_workers=download_concurrency)
+
+    # All of the fetches are submitted up front, but installed in the same order as install_plans
+    # so the output and install order are stable.
+    fetch_futures = [(install_plan, executor.submit(fetch_repository, install_plan, galaxy_context))
+                     for install_plan in install_plans]
+
+    installed_plans = set()
+
+    try:
+        for install_plan, fetch_future in fetch_futures:
+            try:
+                fetch_results = fetch_future.result()
+                log.debug('fetch_results: %s', fetch_results)
+            except exceptions.GalaxyError as e:
+                # fetch error probably should just go to a FAILED state, at least until
+                # we have to implement retries
+                installed_plans.add(install_plan)
+                log.warning('Unable to fetch %s: %s', install_plan.repository_spec.name, e)
+                raise_without_ignore(ignore_errors, e)
+                continue
+
+            installed_plans.add(install_plan)
+
+            installed_repositories = install_fetched_repository(galaxy_context,
+                                                                install_plan,
+                                                                fetch_results,
+                                                                display_callback=display_callback,
+                                                                ignore_errors=ignore_errors,
+                                                                force_overwrite=force_overwrite,
+                                                                installed_index=installed_index)
+
+            if not installed_repositories:
+                continue
+
+            for installed_repo in installed_repositories:
+                required_by_blurb = ''
+                if install_plan.requirement.repository_spec:
+                    required_by_blurb = ' (required by %s)' % install_plan.requirement.repository_spec.label
+
+                log.info('Installed %s,%s to %s%s',
+                         installed_repo.label,
+                         installed_repo.repository_spec.version,
+                         installed_repo.path,
+                         required_by_blurb)
+
+            most_installed_repositories.extend(installed_repositories)
+    finally:
+        # If we bailed early, dont start any more downloads and clean up the
+        # ones that finished but were never installed.
+        for install_plan, fetch_future in fetch_futures:
+            fetch_future.cancel()
+
+        executor.shutdown(wait=True)
+
+        for install_plan, fetch_future in fetch_futures:
+            if install_plan in installed_plans or fetch_future.cancelled() or fetch_future.exception():
+                continue
+
+            install.discard(install_plan.fetcher, fetch_future.result())
 
     return most_installed_repositories
 
@@ -345,25 +853,70 @@ def install_repository(galaxy_context,
                        # TODO: error handling callback ?
                        ignore_errors=False,
                        no_deps=False,
-                       force_overwrite=False):
+                       force_overwrite=False,
+                       installed_index=None,
+                       galaxy_api=None):
     '''This installs a single package by finding it, fetching it, verifying it and installing it.'''
 
     display_callback = display_callback or display.display_callback
 
-    # INITIAL state
-    # dep_requirements = []
+    install_plan = find_repository(galaxy_context,
+                                   requirement_to_install,
+                                   display_callback=display_callback,
+                                   ignore_errors=ignore_errors,
+                                   force_overwrite=force_overwrite,
+                                   installed_index=installed_index,
+                                   galaxy_api=galaxy_api)
+
+    if not install_plan:
+        return None
 
-    # TODO: we could do all the downloads first, then install them. Likely
-    #       less error prone mid 'transaction'
+    # FETCH state
+    try:
+        fetch_results = fetch_repository(install_plan, galaxy_context)
+        log.debug('fetch_results: %s', fetch_results)
+        # fetch_results will include a 'archive_path' pointing to where the artifact
+        # was saved to locally.
+    except exceptions.GalaxyError as e:
+        # fetch error probably should just go to a FAILED state, at least until
+        # we have to implement retries
+        log.warning('Unable to fetch %s: %s', install_plan.repository_spec.name, e)
+        raise_without_ignore(ignore_errors, e)
+        # continue
+        # FIXME: raise ?
+        return None
+
+    return install_fetched_repository(galaxy_context,
+                                      install_plan,
+                                      fetch_results,
+                                      display_callback=display_callback,
+                                      ignore_errors=ignore_errors,
+                                      force_overwrite=force_overwrite,
+                                      installed_index=installed_index)
+
+
+def find_repository(galaxy_context,
+                    requirement_to_install,
+                    display_callback=None,
+                    # TODO: error handling callback ?
+                    ignore_errors=False,
+                    force_overwrite=False,
+                    installed_index=None,
+                    galaxy_api=None):
+    '''Find the collection that satisfies requirement_to_install and return an InstallPlan for it.
+
+    Returns None if nothing was found, or if the found collection is already installed
+    and we are not overwriting it.'''
+
+    display_callback = display_callback or display.display_callback
+
+    # INITIAL state
     log.debug('Processing %r', requirement_to_install)
 
-    repository_spec_to_install = requirement_to_install.requirement_spec
     requirement_spec_to_install = requirement_to_install.requirement_spec
 
     # else trans to ... FIND_FETCHER?
 
-    # TODO: check if already installed and move to approriate state
-
     log.debug('About to find() requested requirement_spec_to_install: %s', requirement_spec_to_install)
 
     display_callback('', level='info')
@@ -371,7 +924,8 @@ def install_repository(galaxy_context,
 
     # We dont have anything that matches the RequirementSpec installed
     fetcher = fetch_factory.get(galaxy_context=galaxy_context,
-                                requirement_spec=requirement_spec_to_install)
+                                requirement_spec=requirement_spec_to_install,
+                                galaxy_api=galaxy_api)
 
     # if we fail to get a fetcher here, then to... FIND_FETCHER_FAILURE ?
     # could also move some of the logic in fetcher_factory to be driven from here
@@ -392,21 +946,12 @@ def install_repository(galaxy_context,
         # continue
         return None
 
-    # TODO: make sure repository_spec version is correct and set
-
-    # TODO: state transition, if find_results -> INSTALL
-    #       if not, then FIND_FAILED
-
-    # TODO/FIXME: We give find() a RequirementSpec, but find_results should have enough
-    #             info to create a concrete RepositorySpec
-
     # TODO: if we want client side content whitelist/blacklist, or pinned versions,
     #       or rules to only update within some semver range (ie, only 'patch' level),
     #       we could hook rule validation stuff here.
 
-    # TODO: build a new repository_spec based on what we actually fetched to feed to
-    #       install etc. The fetcher.fetch() could return a datastructure needed to build
-    #       the new one instead of doing it in verify()
+    # TODO/FIXME: We give find() a RequirementSpec, but find_results should have enough
+    #             info to create a concrete RepositorySpec
     found_repository_spec = install.repository_spec_from_find_results(find_results,
                                                                       requirement_spec_to_install)
 
@@ -419,93 +964,101 @@ def install_repository(galaxy_context,
 
     # cheap 'update' is to consider anything already installed that matches the request repo_spec
     # as 'installed' and let force override that.
-
-    # potential_repository_spec is a repo spec for the install candidate we potentially found.
-    irdb = installed_repository_db.InstalledRepositoryDatabase(galaxy_context)
-    # log.debug('Checking to see if %s is already installed', requirement_spec_to_install)
+    installed_index = installed_index or installed_repository_db.InstalledRepositoryIndex(galaxy_context)
     log.debug('Checking to see if a collection named %s is already installed', found_repository_spec.label)
 
-    repository_spec_match_filter = matchers.MatchRepositorySpecNamespaceName([found_repository_spec])
+    already_installed_repository = installed_index.get(found_repository_spec.namespace,
+                                                       found_repository_spec.name)
 
-    # already_installed_iter = irdb.by_requirement_spec(requirement_spec_to_install)
-    already_installed_iter = irdb.select(repository_spec_match_filter=repository_spec_match_filter)
-    already_installed = sorted(list(already_installed_iter))
+    already_installed = []
+    if already_installed_repository:
+        already_installed.append(already_installed_repository)
 
     log.debug('already_installed: %s', already_installed)
 
-    # TODO: The already installed check above verifies that nothing that matches the requirement spec is installed,
-    #       but just because the name+version required wasn't installed, that doesn't mean that name at a different
-    #       version isn't installed.
-    #       To catch that, also need to check if the irdb by name to see if anything with that name is installed.
-    #
+    # bail if we are not overwriting already installed content. Since this is known
+    # before the artifact is fetched, there is no need to download it.
+    if already_installed and not force_overwrite:
+        for already_installed_repository in already_installed:
+            display_callback('  %s is already installed at %s' %
+                             (_repository_label(already_installed_repository),
+                              already_installed_repository.path),
+                             level='warning')
+
+        log.debug('A collection providing %s was already installed. In %s', requirement_spec_to_install, already_installed)
 
-    repository_spec_to_install = found_repository_spec
-    log.debug('About to download repository requested by %s: %s', requirement_spec_to_install, repository_spec_to_install)
+        return None
 
     if find_results['custom'].get('collection_is_deprecated', False):
         display_callback("The collection '%s' is deprecated." % (found_repository_spec.label),
                          level='warning')
 
-    # FETCH state
-    try:
-        fetch_results = install.fetch(fetcher,
-                                      repository_spec=repository_spec_to_install,
-                                      find_results=find_results)
-        log.debug('fetch_results: %s', fetch_results)
-        # fetch_results will include a 'archive_path' pointing to where the artifact
-        # was saved to locally.
-    except exceptions.GalaxyError as e:
-        # fetch error probably should just go to a FAILED state, at least until
-        # we have to implement retries
-        log.warning('Unable to fetch %s: %s', repository_spec_to_install.name, e)
-        raise_without_ignore(ignore_errors, e)
-        # continue
-        # FIXME: raise ?
-        return None
+    return InstallPlan(requirement=requirement_to_install,
+                       repository_spec=found_repository_spec,
+                       fetcher=fetcher,
+                       find_results=find_results,
+                       already_installed=already_installed)
 
-    # FIXME: seems like we want to resolve deps before trying install
-    #        We need the role (or other content) deps from meta before installing
-    #        though, and sometimes (for galaxy case) we dont know that until we've downloaded
-    #        the file, which we dont do until somewhere in the begin of content.install (fetch).
-    #        We can get that from the galaxy API though.
-    #
-    # FIXME: exc handling
 
-    # Remove the already installed version, via --force
+def fetch_repository(install_plan, galaxy_context=None):
+    '''Fetch the artifact for install_plan and return the fetch results
 
-    for already_installed_repository in already_installed:
-        repo_label = '%s,%s' % (already_installed_repository.repository_spec.label,
-                                already_installed_repository.repository_spec.version)
+    For a streaming fetch (stream_downloads) and a galaxy_context, the artifact is also
+    downloaded and extracted to a staging dir here, so that happens in the fetch workers
+    too, and installing only has to move it into place.
 
-        # bail if we are not overwriting already installed content
-        if not force_overwrite:
-            display_callback('  %s is already installed at %s' %
-                             (repo_label,
-                              already_installed_repository.path),
-                             level='warning')
+    This may be called from a worker thread, so it should only touch the fetcher and
+    its own staging dir.'''
+
+    log.debug('About to download repository requested by %s: %s',
+              install_plan.requirement.requirement_spec, install_plan.repository_spec)
+
+    fetch_results = install.fetch(install_plan.fetcher,
+                                  repository_spec=install_plan.repository_spec,
+                                  find_results=install_plan.find_results)
+
+    if galaxy_context:
+        fetch_results = install.stage(galaxy_context, fetch_results, install_plan.repository_spec)
 
-            log.debug('A collection providing %s was already installed. In %s', requirement_spec_to_install, already_installed)
+    return fetch_results
 
-            return None
 
-        display_callback('  Removing: %s (previously installed to %s)' %
-                         (repo_label,
+def install_fetched_repository(galaxy_context,
+                               install_plan,
+                               fetch_results,
+                               display_callback=None,
+                               # TODO: error handling callback ?
+                               ignore_errors=False,
+                               force_overwrite=False,
+                               installed_index=None):
+    '''Install the already fetched artifact for install_plan, replacing any already installed version'''
+
+    display_callback = display_callback or display.display_callback
+
+    found_repository_spec = install_plan.repository_spec
+
+    # FIXME: exc handling
+
+    # The already installed version (via --force) is replaced by the install, which
+    # swaps the new version into place and removes the old one afterwards.
+    for already_installed_repository in install_plan.already_installed:
+        display_callback('  Replacing: %s (previously installed to %s)' %
+                         (_repository_label(already_installed_repository),
                           already_installed_repository.path),
                          level='info')
 
-        log.debug('Removing already_installed %s', already_installed_repository)
-
-        repository.remove(already_installed_repository)
+        log.debug('Replacing already_installed %s', already_installed_repository)
 
     installed_repositories = []
 
     try:
         installed_repositories = install.install(galaxy_context,
-                                                 fetcher,
+                                                 install_plan.fetcher,
                                                  fetch_results,
                                                  repository_spec=found_repository_spec,
                                                  force_overwrite=force_overwrite,
-                                                 display_callback=display_callback)
+                                                 display_callback=display_callback,
+                                                 installed_index=installed_index)
     except exceptions.GalaxyError as e:
         msg = "- %s was NOT installed successfully: %s "
         display_callback(msg % (found_repository_spec, e), level='warning')
@@ -518,3 +1071,8 @@ def install_repository(galaxy_context,
         raise_without_ignore(ignore_errors)
 
     return installed_repositories
+
+
+def _repository_label(installed_repository):
+    return '%s,%s' % (installed_repository.repository_spec.label,
+                      installed_repository.repository_spec.version)
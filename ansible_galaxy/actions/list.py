@@ -1,10 +1,16 @@
 import collections
 import logging
+import os
 
+import six
+
+from ansible_galaxy import collections_lockfile
+from ansible_galaxy import install_info
 from ansible_galaxy import installed_content_item_db
 from ansible_galaxy import installed_repository_db
 from ansible_galaxy import matchers
 from ansible_galaxy import yaml_persist
+from ansible_galaxy.models.install_destination import INSTALL_RECORD
 
 log = logging.getLogger(__name__)
 
@@ -16,8 +22,21 @@ class OutputFormat(object):
     FULLY_QUALIFIED = 'fully_qualified'
 
 
+def _load_install_info(installed_repository):
+    path = getattr(installed_repository, 'path', None)
+
+    if not isinstance(path, six.string_types):
+        return None
+
+    return install_info.load_from_filename(os.path.join(path, 'meta', INSTALL_RECORD)) or None
+
+
 def format_as_lockfile(repo_list, lockfile_freeze=False):
-    '''For a given repo_list, return the string content of the lockfile that matches'''
+    '''For a given repo_list, return the string content of the lockfile that matches
+
+    If lockfile_freeze is True, the exact versions are used. For collections installed
+    from Galaxy, the download_url and sha256 of the installed artifact are included as well,
+    so 'mazer install --frozen' can install them without any Galaxy API requests.'''
 
     if not repo_list:
         return ''
@@ -28,7 +47,12 @@ def format_as_lockfile(repo_list, lockfile_freeze=False):
         version_spec = '*'
 
         if lockfile_freeze:
-            version_spec = "=={installed_repository.repository_spec.version}".format(**repo_item)
+            install_info_ = _load_install_info(repo_item['installed_repository'])
+
+            version_spec = \
+                collections_lockfile.frozen_entry(repo_item['installed_repository'].repository_spec.version,
+                                                  download_url=getattr(install_info_, 'download_url', None),
+                                                  sha256=getattr(install_info_, 'artifact_sha256', None))
 
         collections_deps[label] = version_spec
 
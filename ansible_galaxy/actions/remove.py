@@ -2,6 +2,7 @@ import logging
 
 from ansible_galaxy import repository
 from ansible_galaxy import installed_repository_db
+from ansible_galaxy import installed_repository_index_file
 from ansible_galaxy import matchers
 from ansible_galaxy_cli import exceptions as cli_exceptions
 
@@ -36,10 +37,15 @@ def remove(galaxy_context,
 
     irdb = installed_repository_db.InstalledRepositoryDatabase(galaxy_context)
 
-    for matched_repository in irdb.select(repository_spec_match_filter=repository_spec_match_filter):
+    # Find them all first, since removing them changes the installed repository index
+    matched_repositories = list(irdb.select(repository_spec_match_filter=repository_spec_match_filter))
+
+    for matched_repository in matched_repositories:
         log.debug('removing %s', matched_repository)
         # content_info['content_data'].remove()
         remove_repository(matched_repository,
                           display_callback=display_callback)
 
+        installed_repository_index_file.remove(galaxy_context, matched_repository)
+
     return 0
@@ -0,0 +1,129 @@
+'''A cache of the API version of each Galaxy server
+
+Before the first request a GalaxyAPI makes, it checks the API version of the
+server (GET /api/). The version found is cached here by server url, so that check
+is only made once per process no matter how many GalaxyAPI's are created.
+
+If the 'cache_path' option is set, the versions are also saved to 'api_versions.json'
+in the 'http' sub directory of cache_path and used by later runs for up to
+'api_version_cache_ttl' seconds:
+
+    {"https://galaxy.ansible.com": {"version": "v1", "stored_at": 1559143431.0}}
+
+A cached version is invalidated if a request fails in a way that suggests the
+API version of the server has changed.
+'''
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from ansible_galaxy import http_cache
+
+log = logging.getLogger(__name__)
+
+API_VERSIONS_FILENAME = 'api_versions.json'
+
+DEFAULT_TTL = 24 * 60 * 60
+
+# server url -> api version, for the life of the process
+_versions = {}
+_versions_lock = threading.Lock()
+
+
+def _versions_path(galaxy_context):
+    cache_path = galaxy_context.options.get('cache_path', None)
+
+    if not cache_path:
+        return None
+
+    return os.path.join(os.path.expanduser(cache_path), http_cache.HTTP_CACHE_DIR, API_VERSIONS_FILENAME)
+
+
+def _load(versions_path):
+    try:
+        with open(versions_path, 'r') as versions_fd:
+            versions_data = json.load(versions_fd)
+    except (EnvironmentError, ValueError) as e:
+        log.debug('No usable api version cache at %s: %s', versions_path, e)
+        return {}
+
+    if not isinstance(versions_data, dict):
+        return {}
+
+    return versions_data
+
+
+def _save(versions_path, versions_data):
+    versions_dir = os.path.dirname(versions_path)
+
+    try:
+        if not os.path.isdir(versions_dir):
+            os.makedirs(versions_dir)
+
+        versions_fd, tmp_path = tempfile.mkstemp(dir=versions_dir, prefix='.tmp-')
+        with os.fdopen(versions_fd, 'w') as versions_fo:
+            json.dump(versions_data, versions_fo)
+        os.rename(tmp_path, versions_path)
+    except (EnvironmentError, TypeError, ValueError) as e:
+        # Failing to cache the api version should never fail anything else
+        log.warning('Unable to save the api version cache to %s: %s', versions_path, e)
+
+
+def get(galaxy_context, server_url):
+    '''Return the cached API version of server_url or None'''
+    with _versions_lock:
+        if server_url in _versions:
+            return _versions[server_url]
+
+        versions_path = _versions_path(galaxy_context)
+        if not versions_path:
+            return None
+
+        entry = _load(versions_path).get(server_url, None)
+        if not isinstance(entry, dict) or not entry.get('version', None):
+            return None
+
+        ttl = galaxy_context.options.get('api_version_cache_ttl', None)
+        if ttl is None:
+            ttl = DEFAULT_TTL
+
+        if time.time() - entry.get('stored_at', 0) >= ttl:
+            log.debug('The cached api version of %s has expired', server_url)
+            return None
+
+        _versions[server_url] = entry['version']
+
+        return entry['version']
+
+
+def put(galaxy_context, server_url, version):
+    '''Cache the API version of server_url'''
+    with _versions_lock:
+        _versions[server_url] = version
+
+        versions_path = _versions_path(galaxy_context)
+        if not versions_path:
+            return
+
+        versions_data = _load(versions_path)
+        versions_data[server_url] = {'version': version,
+                                     'stored_at': time.time()}
+        _save(versions_path, versions_data)
+
+
+def invalidate(galaxy_context, server_url):
+    '''Forget the cached API version of server_url'''
+    with _versions_lock:
+        _versions.pop(server_url, None)
+
+        versions_path = _versions_path(galaxy_context)
+        if not versions_path:
+            return
+
+        versions_data = _load(versions_path)
+        if versions_data.pop(server_url, None) is not None:
+            _save(versions_path, versions_data)
@@ -5,6 +5,7 @@
 
 import logging
 import os
+import shutil
 
 from ansible_galaxy import exceptions
 
@@ -64,3 +65,189 @@ def extract_files(tar_file, files_to_extract):
         res = extract_file(tar_file, file_to_extract)
         if res:
             yield res
+
+
+def member_dest_path(archive_member, dest_dir):
+    '''Return the path archive_member extracts to in dest_dir
+
+    Raises a GalaxyArchiveError if the member would end up outside of dest_dir, ie an
+    absolute path, a path with enough '..' to escape, or a symlink pointing outside.
+
+    This only checks the member name and link text. Earlier members may be symlinks that
+    change where a path really goes, so _check_real_path() is also used as each member is
+    extracted.'''
+    member_path = os.path.normpath(archive_member.name)
+
+    if os.path.isabs(member_path) or member_path == os.pardir or member_path.startswith(os.pardir + os.sep):
+        raise exceptions.GalaxyArchiveError('The archive member "%s" would be extracted outside of %s' %
+                                            (archive_member.name, dest_dir))
+
+    if archive_member.issym():
+        link_target = os.path.normpath(os.path.join(os.path.dirname(member_path), archive_member.linkname))
+
+        if os.path.isabs(archive_member.linkname) or link_target == os.pardir or link_target.startswith(os.pardir + os.sep):
+            raise exceptions.GalaxyArchiveError('The archive member "%s" is a symlink to "%s" which is outside of %s' %
+                                                (archive_member.name, archive_member.linkname, dest_dir))
+
+    return os.path.join(dest_dir, member_path)
+
+
+def _is_within(path, real_dest_dir):
+    return path == real_dest_dir or path.startswith(real_dest_dir + os.sep)
+
+
+def _check_real_path(archive_member, dest_path, real_dest_dir):
+    '''Raise a GalaxyArchiveError if dest_path, with any symlinks already extracted resolved, is outside real_dest_dir
+
+    real_dest_dir is os.path.realpath() of the dir being extracted to.'''
+    real_parent = os.path.realpath(os.path.dirname(dest_path))
+
+    if not _is_within(real_parent, real_dest_dir):
+        raise exceptions.GalaxyArchiveError('The archive member "%s" would be extracted outside of %s (to %s)' %
+                                            (archive_member.name, real_dest_dir, real_parent))
+
+    if archive_member.issym():
+        real_target = os.path.realpath(os.path.join(real_parent, archive_member.linkname))
+
+        if not _is_within(real_target, real_dest_dir):
+            raise exceptions.GalaxyArchiveError('The archive member "%s" is a symlink to "%s" which is outside of %s' %
+                                                (archive_member.name, archive_member.linkname, real_dest_dir))
+
+
+def _check_duplicate(archive_member, dest_path, seen_dest_paths):
+    # A second member with the same name could replace a checked file with a symlink, or
+    # write through a symlink extracted by the first one
+    if dest_path in seen_dest_paths:
+        raise exceptions.GalaxyArchiveError('The archive has more than one member named "%s"' % archive_member.name)
+
+    seen_dest_paths.add(dest_path)
+
+
+def _check_symlinks(members, dest_paths, real_dest_dir):
+    '''Check that the extracted symlinks still point inside real_dest_dir
+
+    A symlink can point through another symlink that was only extracted after it.'''
+    for member, dest_path in zip(members, dest_paths):
+        if not member.issym():
+            continue
+
+        real_target = os.path.realpath(dest_path)
+
+        if not _is_within(real_target, real_dest_dir):
+            raise exceptions.GalaxyArchiveError('The archive member "%s" is a symlink to "%s" which is outside of %s' %
+                                                (member.name, member.linkname, real_dest_dir))
+
+
+# Don't follow a symlink that is already at the path of a file being written
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+
+
+def _extract_member(tar_file, archive_member, dest_path):
+    if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+        raise exceptions.GalaxyArchiveError('The archive member "%s" would replace the directory %s' %
+                                            (archive_member.name, dest_path))
+
+    if os.path.lexists(dest_path):
+        os.unlink(dest_path)
+
+    if archive_member.issym():
+        os.symlink(archive_member.linkname, dest_path)
+        return dest_path
+
+    member_fo = tar_file.extractfile(archive_member)
+
+    with os.fdopen(os.open(dest_path, _WRITE_FLAGS, 0o600), 'wb') as dest_fo:
+        shutil.copyfileobj(member_fo, dest_fo)
+
+    os.chmod(dest_path, archive_member.mode & 0o777)
+    os.utime(dest_path, (archive_member.mtime, archive_member.mtime))
+
+    return dest_path
+
+
+def _make_dirs(dest_paths):
+    made_dirs = set()
+
+    # sorted means parents are made before their children
+    for dir_path in sorted(set([os.path.dirname(x) for x in dest_paths])):
+        if dir_path in made_dirs:
+            continue
+
+        if not os.path.isdir(dir_path):
+            os.makedirs(dir_path)
+
+        made_dirs.add(dir_path)
+
+
+def extract_members(tar_file, dest_dir, force_overwrite=False):
+    '''Extract the files and symlinks in tar_file to dest_dir, yielding each extracted path
+
+    Unlike extract_files(), this reads the list of archive members once, validates all of
+    their paths before extracting anything, creates all the needed dirs at once, and then
+    writes the files in archive order, so a compressed archive is read front to back once.
+
+    Archives with more than one member with the same name are refused.'''
+    members = [x for x in tar_file.getmembers() if x.isreg() or x.issym()]
+
+    dest_paths = [member_dest_path(member, dest_dir) for member in members]
+
+    seen_dest_paths = set()
+    for member, dest_path in zip(members, dest_paths):
+        _check_duplicate(member, dest_path, seen_dest_paths)
+
+    # Typically, dest_dir is a new staging dir so there is nothing to conflict with
+    if not force_overwrite and os.path.isdir(dest_dir) and os.listdir(dest_dir):
+        for dest_path in dest_paths:
+            if os.path.lexists(dest_path):
+                message = "The Galaxy content %s appears to already exist." % dest_path
+                raise exceptions.GalaxyClientError(message)
+
+    real_dest_dir = os.path.realpath(dest_dir)
+
+    _make_dirs(dest_paths)
+
+    for member, dest_path in zip(members, dest_paths):
+        # symlinks extracted by earlier members can change where this really goes
+        _check_real_path(member, dest_path, real_dest_dir)
+
+        yield _extract_member(tar_file, member, dest_path)
+
+    _check_symlinks(members, dest_paths, real_dest_dir)
+
+
+def extract_stream_files(tar_file, dest_dir, force_overwrite=False):
+    '''Extract the members of a tar_file opened in stream mode ('r|gz') as they are read
+
+    A tar stream can only be read forward, so unlike extract_members() the members are
+    validated and extracted one at a time as they come.'''
+
+    real_dest_dir = os.path.realpath(dest_dir)
+    seen_dest_paths = set()
+    symlinks = []
+
+    for archive_member in tar_file:
+        if not archive_member.isreg() and not archive_member.issym():
+            continue
+
+        dest_path = member_dest_path(archive_member, dest_dir)
+
+        _check_duplicate(archive_member, dest_path, seen_dest_paths)
+
+        if os.path.lexists(dest_path):
+            if not force_overwrite:
+                message = "The Galaxy content %s appears to already exist." % dest_path
+                raise exceptions.GalaxyClientError(message)
+
+        # Before making any dirs, since a parent dir may be a symlink extracted earlier
+        _check_real_path(archive_member, dest_path, real_dest_dir)
+
+        dest_parent = os.path.dirname(dest_path)
+        if not os.path.isdir(dest_parent):
+            os.makedirs(dest_parent)
+
+        if archive_member.issym():
+            symlinks.append((archive_member, dest_path))
+
+        yield _extract_member(tar_file, archive_member, dest_path)
+
+    _check_symlinks([x[0] for x in symlinks], [x[1] for x in symlinks], real_dest_dir)
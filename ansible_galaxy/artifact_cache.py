@@ -0,0 +1,176 @@
+'''A persistent local cache of downloaded collection artifacts
+
+Artifacts are stored by namespace, name and version, for ex:
+
+    ~/.ansible/cache/artifacts/alikins/some_collection/alikins-some_collection-1.2.3.tar.gz
+
+along with a 'alikins-some_collection-1.2.3.tar.gz.sha256' file that records the
+sha256 of the artifact when it was added to the cache. Galaxy artifacts are immutable
+once published, so an artifact in the cache can be used instead of downloading it again.
+
+An artifact downloaded from some other url can change without its version changing (ie, a
+rebuilt artifact uploaded again), so it is cached with a '.source' record of the url and
+its ETag / Last-Modified (see ArtifactCache.source()), to check with the url before using it.
+'''
+
+import errno
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+
+from ansible_galaxy import build
+from ansible_galaxy.utils import chksums
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_CACHE_DIR = 'artifacts'
+SHA256_SUFFIX = '.sha256'
+SOURCE_SUFFIX = '.source'
+
+# 'alikins-some_collection-1.2.3.tar.gz' etc. Namespace and name can not include a '-'
+ARTIFACT_FILENAME_RE = re.compile(r'^(?P<namespace>[^-/]+)-(?P<name>[^-/]+)-(?P<version>[^/]+)\.tar\.gz$')
+
+
+def artifact_filename(namespace, name, version):
+    return build.ARCHIVE_FILENAME_TEMPLATE.format(namespace=namespace,
+                                                  name=name,
+                                                  version=version,
+                                                  extension=build.ARCHIVE_FILENAME_EXTENSION)
+
+
+def parse_artifact_filename(filename):
+    '''Return (namespace, name, version) from a 'namespace-name-version.tar.gz' file name or None'''
+    match = ARTIFACT_FILENAME_RE.match(os.path.basename(filename or ''))
+
+    if not match:
+        return None
+
+    return match.group('namespace'), match.group('name'), match.group('version')
+
+
+def get(galaxy_context):
+    '''Return the ArtifactCache configured for galaxy_context or None if the cache is not enabled'''
+    cache_path = galaxy_context.options.get('cache_path', None)
+
+    if not cache_path:
+        return None
+
+    return ArtifactCache(os.path.join(os.path.expanduser(cache_path), ARTIFACT_CACHE_DIR))
+
+
+class ArtifactCache(object):
+    def __init__(self, path):
+        self.path = path
+
+    def artifact_path(self, namespace, name, version):
+        return os.path.join(self.path, namespace, name,
+                            artifact_filename(namespace, name, version))
+
+    def _read_sha256(self, artifact_path):
+        try:
+            with open(artifact_path + SHA256_SUFFIX, 'r') as sha_fd:
+                return sha_fd.read().strip()
+        except EnvironmentError:
+            return None
+
+    def source(self, artifact_path):
+        '''The source dict (ie, {'url': ..., 'etag': ..., 'last_modified': ...}) put() recorded for artifact_path, or None'''
+        try:
+            with open(artifact_path + SOURCE_SUFFIX, 'r') as source_fd:
+                return json.load(source_fd)
+        except (EnvironmentError, ValueError):
+            return None
+
+    def get(self, namespace, name, version, sha256=None):
+        '''Return the path to the cached artifact for namespace.name,version or None if not cached
+
+        If sha256 is provided, a cached artifact whose recorded sha256 does not match is ignored.'''
+        artifact_path = self.artifact_path(namespace, name, version)
+
+        if not os.path.isfile(artifact_path):
+            log.debug('Artifact cache miss for %s.%s,%s', namespace, name, version)
+            return None
+
+        cached_sha256 = self._read_sha256(artifact_path)
+
+        # No record of the sha256, so we can't trust it
+        if not cached_sha256:
+            log.debug('Artifact cache entry %s has no sha256 record, ignoring it', artifact_path)
+            return None
+
+        if sha256 and sha256 != cached_sha256:
+            log.warning('The cached artifact %s has sha256 %s but %s was expected, ignoring it',
+                        artifact_path, cached_sha256, sha256)
+            return None
+
+        log.debug('Artifact cache hit for %s.%s,%s: %s', namespace, name, version, artifact_path)
+
+        return artifact_path
+
+    def put(self, src_path, namespace, name, version, sha256=None, source=None):
+        '''Move the artifact at src_path into the cache and return the path to the cached artifact
+
+        If the sha256 of the artifact is already known, it can be provided as sha256 to avoid
+        reading the artifact again.
+
+        source is a dict about where the artifact came from (see source()), if it was not
+        from Galaxy.
+
+        The artifact and the sha256 record are first written next to their final path and
+        then renamed into place, so concurrent readers never see a partial artifact. The old
+        records are removed before the artifact is replaced, and the new ones are written
+        after, so a reader (or the next run, if this one is interrupted) sees either no
+        sha256 record, which get() treats as a miss, or the record of the artifact it is next to.'''
+        artifact_path = self.artifact_path(namespace, name, version)
+        artifact_dir = os.path.dirname(artifact_path)
+
+        if not os.path.isdir(artifact_dir):
+            try:
+                os.makedirs(artifact_dir)
+            except OSError:
+                # Another process may have created it
+                if not os.path.isdir(artifact_dir):
+                    raise
+
+        sha256 = sha256 or chksums.sha256sum_from_path(src_path)
+
+        # Not trusted until the new records are written
+        for record_path in (artifact_path + SHA256_SUFFIX, artifact_path + SOURCE_SUFFIX):
+            try:
+                os.unlink(record_path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+        artifact_fd, artifact_tmp_path = tempfile.mkstemp(dir=artifact_dir, prefix='.tmp-')
+        os.close(artifact_fd)
+
+        # src_path is usually in the system tmp dir and may be on a different
+        # filesystem than the cache, so move it next to the cached path first
+        # so the final rename is atomic.
+        try:
+            os.rename(src_path, artifact_tmp_path)
+        except OSError:
+            shutil.move(src_path, artifact_tmp_path)
+
+        os.chmod(artifact_tmp_path, 0o644)
+        os.rename(artifact_tmp_path, artifact_path)
+
+        if source:
+            source_fd, source_tmp_path = tempfile.mkstemp(dir=artifact_dir, prefix='.tmp-', suffix=SOURCE_SUFFIX)
+            with os.fdopen(source_fd, 'w') as source_fo:
+                json.dump(source, source_fo)
+            os.rename(source_tmp_path, artifact_path + SOURCE_SUFFIX)
+
+        # last, since get() only uses an artifact with a sha256 record
+        sha_fd, sha_tmp_path = tempfile.mkstemp(dir=artifact_dir, prefix='.tmp-', suffix=SHA256_SUFFIX)
+        with os.fdopen(sha_fd, 'w') as sha_fo:
+            sha_fo.write(sha256)
+        os.rename(sha_tmp_path, artifact_path + SHA256_SUFFIX)
+
+        log.debug('Added %s to the artifact cache as %s', src_path, artifact_path)
+
+        return artifact_path
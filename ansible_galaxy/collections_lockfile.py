@@ -1,12 +1,25 @@
 import logging
 
+import semantic_version
 import yaml
 
 from ansible_galaxy import exceptions
 from ansible_galaxy.models.collections_lockfile import CollectionsLockfile
+from ansible_galaxy.models.repository_spec import FetchMethods
+from ansible_galaxy.models.requirement import Requirement, RequirementOps, RequirementScopes
+from ansible_galaxy.models.requirement_spec import RequirementSpec
+from ansible_galaxy.repository_spec_parse import spec_data_from_string
 
 log = logging.getLogger(__name__)
 
+# The keys of a frozen lockfile entry. ie:
+#
+#   alikins.collection_inspect:
+#     version: 1.0.0
+#     download_url: https://galaxy.ansible.com/download/alikins-collection_inspect-1.0.0.tar.gz
+#     sha256: 4a2e9b1e...
+FROZEN_ENTRY_KEYS = ('version', 'download_url', 'sha256')
+
 
 # TODO: replace with a generic version for cases
 #       where SomeClass(**dict_from_yaml) works
@@ -24,3 +37,64 @@ def load(data_or_file_object):
         raise exceptions.GalaxyClientError("Error parsing collections lockfile: %s" % str(exc))
 
     return collections_lockfile
+
+
+def frozen_entry(version, download_url=None, sha256=None):
+    '''Build the lockfile entry for an exact version and, if known, where to download it from'''
+    if not download_url:
+        return '==%s' % version
+
+    return {'version': str(version),
+            'download_url': download_url,
+            'sha256': sha256}
+
+
+def dependencies_dict(collections_lockfile):
+    '''Return the lockfile dependencies as a 'dependencies' dict of version spec strings
+
+    Frozen entries become an exact version spec ('==1.0.0')'''
+    deps = {}
+    for label, entry in collections_lockfile.dependencies.items():
+        if isinstance(entry, dict):
+            entry = '==%s' % entry.get('version', None)
+        deps[label] = entry
+
+    return deps
+
+
+def frozen_requirements(collections_lockfile):
+    '''Build a list of Requirements that can be installed without any Galaxy API requests
+
+    Every entry must be a frozen entry with a version and a download_url or a
+    GalaxyClientError is raised.'''
+    reqs = []
+    for label, entry in collections_lockfile.dependencies.items():
+        if not isinstance(entry, dict) or not entry.get('version', None) or not entry.get('download_url', None):
+            raise exceptions.GalaxyClientError('The collections lockfile entry for %s is not frozen (%s). '
+                                               'Frozen entries need a "version" and a "download_url".' % (label, entry))
+
+        unknown_keys = set(entry.keys()) - set(FROZEN_ENTRY_KEYS)
+        if unknown_keys:
+            log.warning('Ignoring unknown keys in the collections lockfile entry for %s: %s',
+                        label, ', '.join(sorted(unknown_keys)))
+
+        try:
+            frozen_version = semantic_version.Version(str(entry['version']))
+        except ValueError as e:
+            raise exceptions.GalaxyClientError('The collections lockfile entry for %s has an invalid "version": %s' %
+                                               (label, e))
+
+        req_spec_data = spec_data_from_string(label)
+        req_spec_data.update({'version_spec': '==%s' % frozen_version,
+                              'frozen_version': frozen_version,
+                              'fetch_method': FetchMethods.GALAXY_FROZEN,
+                              'src': entry['download_url'],
+                              'artifact_sha256': entry.get('sha256', None)})
+
+        req_spec = RequirementSpec.from_dict(req_spec_data)
+
+        reqs.append(Requirement(repository_spec=None, op=RequirementOps.EQ,
+                                scope=RequirementScopes.INSTALL,
+                                requirement_spec=req_spec))
+
+    return reqs
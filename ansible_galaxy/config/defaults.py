@@ -4,6 +4,48 @@ MAZER_HOME = os.environ.get('MAZER_HOME', None) or '~/.ansible'
 DEFAULT_CONFIG_FILE = '~/.ansible/mazer.yml'
 COLLECTIONS_PYTHON_NAMESPACE = 'ansible_collections'
 
+# The max number of collection artifacts to download at the same time
+DEFAULT_DOWNLOAD_CONCURRENCY = 4
+
+# The max number of requests to make to a Galaxy API server at the same time
+DEFAULT_API_CONCURRENCY = 4
+
+# The page size requested for paginated Galaxy API lists (ie, the versions of a collection)
+DEFAULT_API_PAGE_SIZE = 100
+
+# The number of connections to each http server that are kept open to be reused
+DEFAULT_HTTP_POOL_SIZE = 10
+
+# Seconds to wait for a connection to a http server, and for the server to send something
+DEFAULT_HTTP_CONNECT_TIMEOUT = 10
+DEFAULT_HTTP_READ_TIMEOUT = 60
+
+# The max number of times a failed http request is retried, and the backoff between retries
+DEFAULT_HTTP_RETRIES = 3
+DEFAULT_HTTP_RETRY_BACKOFF = 0.5
+DEFAULT_HTTP_MAX_RETRY_BACKOFF = 30
+
+# The most seconds to spend on a http request including retries (0 for no limit)
+DEFAULT_HTTP_DEADLINE = 300
+
+# The max requests per second to a Galaxy API server (0 for no limit), and how many can be made at once
+DEFAULT_API_RATE_LIMIT = 0
+DEFAULT_API_RATE_LIMIT_BURST = 10
+
+# The max bytes per second for all artifact downloads together, and the max downloads from
+# each host at the same time (0 for no limit). See 'download_hosts' for per host limits.
+DEFAULT_DOWNLOAD_RATE_LIMIT = 0
+DEFAULT_DOWNLOAD_MAX_CONNECTIONS = 0
+
+# Artifacts of at least download_segment_min_size bytes are downloaded as this many byte
+# ranges at the same time, if the server supports it (1 to always use one connection)
+DEFAULT_DOWNLOAD_SEGMENTS = 1
+DEFAULT_DOWNLOAD_SEGMENT_MIN_SIZE = 32 * 1024 * 1024
+
+# Artifacts up to this many bytes are downloaded into memory instead of a temp file
+# when they are not going into the artifact cache (0 to always use a temp file)
+DEFAULT_DOWNLOAD_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
 
 def get_config_path():
     paths = [
@@ -32,7 +74,37 @@ DEFAULTS = [
     # runtime options
     ('options',
      {
-         # TODO: no other options, rm 'options'
+         'download_concurrency': DEFAULT_DOWNLOAD_CONCURRENCY,
+         'api_concurrency': DEFAULT_API_CONCURRENCY,
+         'api_page_size': DEFAULT_API_PAGE_SIZE,
+         'http_pool_size': DEFAULT_HTTP_POOL_SIZE,
+         'http_connect_timeout': DEFAULT_HTTP_CONNECT_TIMEOUT,
+         'http_read_timeout': DEFAULT_HTTP_READ_TIMEOUT,
+         'http_retries': DEFAULT_HTTP_RETRIES,
+         'http_retry_backoff': DEFAULT_HTTP_RETRY_BACKOFF,
+         'http_max_retry_backoff': DEFAULT_HTTP_MAX_RETRY_BACKOFF,
+         'http_deadline': DEFAULT_HTTP_DEADLINE,
+         'api_rate_limit': DEFAULT_API_RATE_LIMIT,
+         'api_rate_limit_burst': DEFAULT_API_RATE_LIMIT_BURST,
+         # Downloaded artifacts and other cached data are kept here
+         'cache_path': os.path.join(MAZER_HOME, 'cache'),
+         # Seconds a cached Galaxy API response is used without revalidating it
+         'http_cache_ttl': 0,
+         # Seconds past http_cache_ttl a cached response is used while it is revalidated
+         'http_cache_stale_while_revalidate': 0,
+         # Seconds the API version of a Galaxy server is cached
+         'api_version_cache_ttl': 24 * 60 * 60,
+         # Extract artifacts from Galaxy while they download instead of saving them first
+         'stream_downloads': False,
+         'download_segments': DEFAULT_DOWNLOAD_SEGMENTS,
+         'download_segment_min_size': DEFAULT_DOWNLOAD_SEGMENT_MIN_SIZE,
+         'download_spool_max_size': DEFAULT_DOWNLOAD_SPOOL_MAX_SIZE,
+         'download_rate_limit': DEFAULT_DOWNLOAD_RATE_LIMIT,
+         'download_max_connections': DEFAULT_DOWNLOAD_MAX_CONNECTIONS,
+         # host -> {'rate_limit': bytes per second, 'max_connections': N} for downloads from that host
+         'download_hosts': {},
+         # download url prefix -> the mirror url prefix to download from instead
+         'download_mirrors': {},
      }
 
      ),
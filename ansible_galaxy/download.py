@@ -1,19 +1,119 @@
+"""Downloading collection artifacts
+
+Artifacts are downloaded to a temp file. If the connection drops part way through and
+the server supports http Range requests, the download is resumed from where it stopped
+(at most transfer_policy.retries times) instead of starting over. The resumed request
+includes an If-Range with the ETag (or Last-Modified) of the first response, so if the
+artifact changed in the meantime the server sends all of it again.
+
+Large artifacts can also be downloaded as several byte ranges at the same time into a
+preallocated file ('segments'), which is much faster than a single connection on high
+latency links.
+
+Download URLs can be rewritten to a mirror with the 'download_mirrors' rules (see
+mirror_url()). If the mirror doesn't have the artifact or can't be reached, the
+original URL is used instead (see mirror_missed()).
+"""
+
+import hashlib
 import logging
+import os
+import re
 import tempfile
 import uuid
 
+from concurrent import futures
 import requests
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
 
 from ansible_galaxy import exceptions
+from ansible_galaxy import http_session
+from ansible_galaxy import http_transfer
 from ansible_galaxy import user_agent
+from ansible_galaxy.config import defaults
+from ansible_galaxy.utils import chksums
 
 log = logging.getLogger(__name__)
 
+# The errors that can happen part way through reading a response, after which a download can be resumed
+RESUMABLE_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.Timeout)
 
-# FIXME: let the archive_url be passed in
-def fetch_url(archive_url, validate_certs=True):
+# Reading response.raw directly (ie, as a tar stream) raises the urllib3 errors instead
+RAW_READ_ERRORS = RESUMABLE_ERRORS + (urllib3_exceptions.HTTPError,)
+
+# 'bytes 100-199/1000'
+CONTENT_RANGE_RE = re.compile(r'^bytes\s+(?P<start>\d+)-(?P<end>\d+)/(?P<total>\d+|\*)$')
+
+# The bytes of a read that is cut short by a dropped connection are lost, so a download
+# resumes from the end of the last complete chunk
+CHUNK_SIZE = 16 * 1024
+
+
+def segments(galaxy_context):
+    '''The (download_segments, download_segment_min_size) configured for galaxy_context'''
+    options = galaxy_context.options
+
+    return (max(1, int(options.get('download_segments', None) or defaults.DEFAULT_DOWNLOAD_SEGMENTS)),
+            int(options.get('download_segment_min_size', None) or defaults.DEFAULT_DOWNLOAD_SEGMENT_MIN_SIZE))
+
+
+def spool_max_size(galaxy_context):
+    '''The download_spool_max_size configured for galaxy_context, 0 to always download to a file'''
+    spool_size = galaxy_context.options.get('download_spool_max_size', None)
+
+    if spool_size is None:
+        return defaults.DEFAULT_DOWNLOAD_SPOOL_MAX_SIZE
+
+    return max(0, int(spool_size))
+
+
+def mirror_url(archive_url, galaxy_context):
+    '''The archive_url rewritten by the configured 'download_mirrors', or None if no rule matches
+
+    download_mirrors maps a url prefix to the prefix to replace it with. If more
+    than one prefix matches, the longest one is used.'''
+    mirrors = galaxy_context.options.get('download_mirrors', None) or {}
+
+    matches = [prefix for prefix in mirrors if prefix and archive_url.startswith(prefix)]
+    if not matches:
+        return None
+
+    prefix = max(matches, key=len)
+
+    return mirrors[prefix] + archive_url[len(prefix):]
+
+
+def mirror_missed(download_error):
+    '''True if the GalaxyDownloadError was a 404 or a failure to connect
+
+    These are the errors from a mirror that mean the original url should be tried instead.
+    Anything else (ie, a sha256 mismatch) is a real error.'''
+    cause = download_error.args[0] if download_error.args else None
+
+    if isinstance(cause, requests.HTTPError):
+        return cause.response is not None and cause.response.status_code == 404
+
+    return isinstance(cause, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def open_url(archive_url, validate_certs=True, pool_size=None, transfer_policy=None, headers=None, slot=None):
     """
-    Downloads the archived content from github to a temp location
+    Start downloading archive_url and return the streaming requests.Response
+
+    The response body has not been read yet. The caller is responsible for
+    closing the response.
+
+    The download uses the requests.Session shared by all requests to the
+    archive_url host, so an open connection to the host is reused if there is one.
+
+    Failures to connect or 429/5xx responses are retried as transfer_policy says.
+
+    headers are any extra request headers, ie 'Range'.
+
+    slot is the connection slot (see http_transfer.DownloadLimits.connection()) held for
+    the download, if any. It is given up while waiting to retry.
     """
 
     # TODO: should probably be based on/shared with rest API client code, so that
@@ -25,31 +125,426 @@ def fetch_url(archive_url, validate_certs=True):
     request_id = uuid.uuid4().hex
     request_headers['X-Request-ID'] = request_id
     request_headers['User-Agent'] = user_agent.user_agent()
+    request_headers.update(headers or {})
+
+    session = http_session.get(archive_url, pool_size=pool_size)
+
+    log.debug('Downloading archive_url: %s (%s)', archive_url, request_headers.get('Range', 'all'))
+    resp = http_transfer.request(session, 'GET', archive_url,
+                                 transfer_policy=transfer_policy,
+                                 slot=slot,
+                                 verify=validate_certs,
+                                 headers=request_headers,
+                                 stream=True)
 
     try:
-        log.debug('Downloading archive_url: %s', archive_url)
-        resp = requests.get(archive_url, verify=validate_certs,
-                            headers=request_headers, stream=True)
+        resp.raise_for_status()
+    except requests.HTTPError:
+        # return the connection to the pool
+        resp.close()
+        raise
+
+    if resp.history:
+        for redirect in resp.history:
+            log.debug('Original request for %s redirected. %s is redirected to %s',
+                      archive_url, redirect.url, redirect.headers['Location'])
+
+    # If the server used a Content-Encoding for the transfer, read the artifact not the encoded bytes
+    resp.raw.decode_content = True
+
+    return resp
+
+
+def _range_headers(start, end=None, validator=None):
+    '''The request headers for bytes start-end (inclusive, or to the end if end is None)'''
+    headers = {'Range': 'bytes=%s-%s' % (start, '' if end is None else end),
+               # byte ranges of a Content-Encoding'ed response are not byte ranges of the artifact
+               'Accept-Encoding': 'identity'}
+
+    if validator:
+        headers['If-Range'] = validator
+
+    return headers
+
+
+def _validator(resp):
+    '''The If-Range validator for resuming the download of resp, or None if it can not be resumed'''
+    if resp.status_code != 206 and resp.headers.get('Accept-Ranges', '').lower() != 'bytes':
+        return None
+
+    etag = resp.headers.get('ETag', None)
+
+    # A weak ETag can not be used with If-Range
+    if etag and not etag.startswith('W/'):
+        return etag
+
+    return resp.headers.get('Last-Modified', None)
+
+
+def _content_range(resp):
+    '''(start, end, total) from the Content-Range of a 206 response, or None. total is None if unknown'''
+    if resp.status_code != 206:
+        return None
+
+    match = CONTENT_RANGE_RE.match(resp.headers.get('Content-Range', '').strip())
+    if not match:
+        return None
+
+    total = match.group('total')
+    return (int(match.group('start')), int(match.group('end')),
+            None if total == '*' else int(total))
+
+
+class _HashingWriter(object):
+    '''Write to a file object while computing the sha256 and size of what was written'''
+
+    def __init__(self, fileobj, max_size=None, url=None):
+        self.fileobj = fileobj
+        self.max_size = max_size
+        self.url = url
+        self.reset()
+
+    def reset(self):
+        self.fileobj.seek(0)
+        self.fileobj.truncate()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.size += len(chunk)
+
+        if self.max_size is not None and self.size > self.max_size:
+            raise exceptions.GalaxyDownloadError('The artifact is larger than the expected %s bytes' % self.max_size,
+                                                 url=self.url)
+
+        self.sha256.update(chunk)
+        self.fileobj.write(chunk)
+
+
+class ThrottledReader(object):
+    '''Wrap a readable file object (ie, a streaming response) and read it no faster than limits allow
+
+    limits is a http_transfer.DownloadLimits'''
+
+    def __init__(self, fileobj, limits):
+        self.fileobj = fileobj
+        self.limits = limits
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.limits.throttle(len(data))
+        return data
+
+
+def _download(archive_url, writer, resp, open_kwargs, retries, limits, slot=None):
+    '''Write the body of resp (and the rest of archive_url if the connection drops) to writer'''
+    validator = _validator(resp)
+    resumes = 0
+
+    while True:
+        try:
+            for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                limits.throttle(len(chunk))
+                writer.write(chunk)
+            return
+        except RESUMABLE_ERRORS as exc:
+            if not validator or resumes >= retries:
+                raise
+
+            resumes += 1
+            log.info('Resuming the download of %s at byte %s after %r (resume %s of %s)',
+                     archive_url, writer.size, exc, resumes, retries)
+        finally:
+            resp.close()
+
+        resp = open_url(archive_url, headers=_range_headers(writer.size, validator=validator), slot=slot, **open_kwargs)
+
+        content_range = _content_range(resp)
+        if not content_range or content_range[0] != writer.size:
+            # The server ignored the Range, or the artifact changed (If-Range), so it is sending all of it
+            log.info('Unable to resume the download of %s, downloading all of it again', archive_url)
+            writer.reset()
+            validator = _validator(resp)
+
+
+def _download_segment(archive_url, path, start, end, validator, open_kwargs, retries, limits, resp=None, slot=None):
+    '''Write bytes start-end (inclusive) of archive_url into the file at path, resuming if the connection drops
+
+    If resp is the already open response for the segment, slot is its connection slot.'''
+    offset = start
+    resumes = 0
 
-        temp_file = tempfile.NamedTemporaryFile(delete=False,
-                                                prefix='tmp-ansible-galaxy-content-archive-',
-                                                suffix='.tar.gz')
+    slot = slot or limits.connection()
 
-        if resp.history:
-            for redirect in resp.history:
-                log.debug('Original request for %s redirected. %s is redirected to %s',
-                          archive_url, redirect.url, redirect.headers['Location'])
+    with slot, open(path, 'r+b') as segment_fo:
+        segment_fo.seek(start)
 
-        # TODO: test for short reads
-        for chunk in resp.iter_content(chunk_size=None):
-            temp_file.write(chunk)
+        while offset <= end:
+            if resp is None:
+                resp = open_url(archive_url, headers=_range_headers(offset, end, validator=validator), slot=slot,
+                                **open_kwargs)
 
-        temp_file.close()
+                content_range = _content_range(resp)
+                if not content_range or content_range[0] != offset:
+                    resp.close()
+                    raise exceptions.GalaxyDownloadError('The artifact changed while it was being downloaded', url=archive_url)
 
-        return temp_file.name
+            try:
+                for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                    limits.throttle(len(chunk))
+
+                    # don't trust the server to stop at end
+                    chunk = chunk[:end + 1 - offset]
+                    segment_fo.write(chunk)
+                    offset += len(chunk)
+
+                    if offset > end:
+                        break
+            except RESUMABLE_ERRORS as exc:
+                if resumes >= retries:
+                    raise
+
+                resumes += 1
+                log.info('Resuming bytes %s-%s of %s after %r (resume %s of %s)',
+                         offset, end, archive_url, exc, resumes, retries)
+                continue
+            finally:
+                resp.close()
+                resp = None
+
+            if offset <= end:
+                raise exceptions.GalaxyDownloadError('The artifact was shorter than expected', url=archive_url)
+
+    return offset - start
+
+
+def _download_segmented(archive_url, path, resp, size, segment_count, open_kwargs, retries, limits, slot):
+    '''Download archive_url into path (size bytes) as segment_count ranges at the same time
+
+    resp is the already open response for the first range, and slot its connection slot.
+    The slot is released once the first range is downloaded, so the other ranges never
+    wait for a connection held by a download that is waiting for them.'''
+    validator = _validator(resp)
+    segment_size = resp_end = _content_range(resp)[1] + 1
+
+    ranges = [(start, min(size, start + segment_size) - 1) for start in range(resp_end, size, segment_size)]
+
+    log.debug('Downloading %s (%s bytes) as %s ranges of %s bytes', archive_url, size, len(ranges) + 1, segment_size)
+
+    # preallocate the whole file so each segment can write into its part
+    with open(path, 'r+b') as artifact_fo:
+        artifact_fo.truncate(size)
+
+    executor = futures.ThreadPoolExecutor(max_workers=max(1, min(segment_count - 1, len(ranges))))
+    segment_futures = []
+
+    try:
+        segment_futures = [executor.submit(_download_segment, archive_url, path, start, end, validator, open_kwargs, retries, limits)
+                           for start, end in ranges]
+
+        downloaded = _download_segment(archive_url, path, 0, resp_end - 1, validator, open_kwargs, retries, limits,
+                                       resp=resp, slot=slot)
+
+        for segment_future in segment_futures:
+            downloaded += segment_future.result()
+    finally:
+        for segment_future in segment_futures:
+            segment_future.cancel()
+        executor.shutdown(wait=True)
+
+    return downloaded
+
+
+def fetch_artifact(archive_url, validate_certs=True, pool_size=None, transfer_policy=None,
+                   expected_sha256=None, expected_size=None, segment_count=1, segment_min_size=None,
+                   spool_max_size=0):
+    """
+    Download archive_url to a temp file and return a dict with its 'archive_path' and 'sha256'
+
+    The sha256 is computed from the chunks as they are written, so the artifact does not
+    need to be read again to verify it. If expected_sha256 is provided and does not match,
+    or the download is larger than expected_size (bytes), the temp file is removed and a
+    GalaxyArtifactChksumError or GalaxyDownloadError is raised before anything uses the
+    artifact. An oversized download is given up on as soon as it goes over expected_size.
+
+    If expected_size is at least segment_min_size, the artifact is downloaded as
+    segment_count ranges at the same time (if the server supports Range requests). The
+    segments arrive out of order, so the sha256 of a segmented download is computed
+    from the (freshly written, so likely still cached) file once it is complete.
+
+    If spool_max_size is set, the artifact is downloaded to a tempfile.SpooledTemporaryFile
+    that is only written to disk if the artifact is larger than spool_max_size bytes. The
+    results then have an 'archive_fileobj' (positioned at the start of the artifact) instead
+    of an 'archive_path'. The caller is responsible for closing it.
+
+    The download waits for a connection to the host and is throttled as the download
+    limits of transfer_policy say (see http_transfer.download_limits()). A segmented
+    download uses a connection for each segment.
+    """
+
+    transfer_policy = transfer_policy or http_transfer.TransferPolicy()
+    open_kwargs = {'validate_certs': validate_certs,
+                   'pool_size': pool_size,
+                   'transfer_policy': transfer_policy}
+
+    limits = http_transfer.download_limits(archive_url, transfer_policy)
+
+    if limits.max_connections:
+        segment_count = min(segment_count, limits.max_connections)
+
+    segmented = segment_count > 1 and expected_size and expected_size >= (segment_min_size or 0)
+
+    # No point starting in memory if it is known to be too big
+    spooled = spool_max_size and not segmented and (expected_size is None or expected_size <= spool_max_size)
+
+    temp_file = None
+
+    # wait for a connection to the host to be allowed
+    slot = limits.connection()
+
+    try:
+        if spooled:
+            temp_file = tempfile.SpooledTemporaryFile(max_size=spool_max_size,
+                                                      prefix='tmp-ansible-galaxy-content-archive-',
+                                                      suffix='.tar.gz')
+        else:
+            temp_file = tempfile.NamedTemporaryFile(delete=False,
+                                                    prefix='tmp-ansible-galaxy-content-archive-',
+                                                    suffix='.tar.gz')
+
+        if segmented:
+            # Ask for the first segment. If the server doesn't support ranges, it sends everything.
+            first_segment_size = -(-expected_size // segment_count)
+            resp = open_url(archive_url, headers=_range_headers(0, first_segment_size - 1), slot=slot, **open_kwargs)
+
+            content_range = _content_range(resp)
+            if content_range and content_range[2] not in (None, expected_size):
+                resp.close()
+                raise exceptions.GalaxyDownloadError('The artifact was %s bytes but %s bytes were expected' %
+                                                     (content_range[2], expected_size),
+                                                     url=archive_url)
+
+            if not content_range or content_range[0] != 0 or content_range[2] is None:
+                log.debug('%s does not support range requests, not downloading it in segments', archive_url)
+                segmented = False
+
+                # A partial response that is no use here, so start over with all of it
+                if resp.status_code == 206:
+                    resp.close()
+                    resp = open_url(archive_url, slot=slot, **open_kwargs)
+        else:
+            resp = open_url(archive_url, slot=slot, **open_kwargs)
+
+        # For revalidating a cached copy later, see not_modified()
+        validators = {'etag': resp.headers.get('ETag', None),
+                      'last_modified': resp.headers.get('Last-Modified', None)}
+
+        if segmented:
+            temp_file.close()
+
+            size = _download_segmented(archive_url, temp_file.name, resp, expected_size, segment_count,
+                                       open_kwargs, transfer_policy.retries, limits, slot)
+            artifact_sha256 = chksums.sha256sum_from_path(temp_file.name)
+        else:
+            writer = _HashingWriter(temp_file, max_size=expected_size, url=archive_url)
+
+            _download(archive_url, writer, resp, open_kwargs, transfer_policy.retries, limits, slot=slot)
+
+            if spooled:
+                temp_file.seek(0)
+            else:
+                temp_file.close()
+
+            size = writer.size
+            artifact_sha256 = writer.sha256.hexdigest()
+
+        log.debug('Downloaded %s bytes from %s to %s (sha256: %s)', size, archive_url,
+                  'memory' if spooled else temp_file.name, artifact_sha256)
+
+        if expected_size is not None and size != expected_size:
+            raise exceptions.GalaxyDownloadError('The artifact was %s bytes but %s bytes were expected' % (size, expected_size),
+                                                 url=archive_url)
+
+        if expected_sha256 and artifact_sha256 != expected_sha256:
+            msg = 'The sha256 of the artifact was %s but %s was expected' % (artifact_sha256, expected_sha256)
+            raise exceptions.GalaxyArtifactChksumError(msg,
+                                                       url=archive_url,
+                                                       expected=expected_sha256,
+                                                       actual=artifact_sha256)
+
+        if spooled:
+            return {'archive_path': None,
+                    'archive_fileobj': temp_file,
+                    'sha256': artifact_sha256,
+                    'size': size,
+                    'validators': validators}
+
+        return {'archive_path': temp_file.name,
+                'sha256': artifact_sha256,
+                'size': size,
+                'validators': validators}
     except Exception as e:
+        if spooled and temp_file:
+            temp_file.close()
+        elif temp_file:
+            _remove_temp_file(temp_file)
+
+        if isinstance(e, exceptions.GalaxyDownloadError):
+            raise
+
         # FIXME: there is a ton of reasons a download and save could fail so could likely provided better errors here
         log.exception(e)
         raise exceptions.GalaxyDownloadError(e, url=archive_url)
+    finally:
+        slot.release()
+
+
+def _remove_temp_file(temp_file):
+    temp_file.close()
+
+    try:
+        os.unlink(temp_file.name)
+    except OSError as exc:
+        log.warning('Unable to remove the partial download %s: %s', temp_file.name, exc)
+
+
+# FIXME: let the archive_url be passed in
+def not_modified(archive_url, validators, validate_certs=True, pool_size=None, transfer_policy=None):
+    '''True if the artifact at archive_url is still the one with validators (the 'validators' from fetch_artifact())
+
+    This is a conditional request (If-None-Match / If-Modified-Since), so the artifact is
+    not downloaded again if it is unchanged. Returns False if it changed, if there are no
+    validators to check, or if the request fails.'''
+    validators = validators or {}
+
+    headers = {}
+    if validators.get('etag', None):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified', None):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    if not headers:
+        return False
+
+    try:
+        resp = open_url(archive_url, validate_certs=validate_certs, pool_size=pool_size,
+                        transfer_policy=transfer_policy, headers=headers)
+    except requests.RequestException as e:
+        log.debug('Unable to check if %s changed: %s', archive_url, e)
+        return False
+
+    # Don't read the body if it did change, it will be downloaded again
+    resp.close()
+
+    return resp.status_code == 304
+
+
+def fetch_url(archive_url, validate_certs=True, pool_size=None, transfer_policy=None, expected_sha256=None):
+    """
+    Downloads the archived content from github to a temp location
+
+    See fetch_artifact() for expected_sha256
+    """
 
-    return False
+    return fetch_artifact(archive_url, validate_certs=validate_certs, pool_size=pool_size,
+                          transfer_policy=transfer_policy, expected_sha256=expected_sha256)['archive_path']
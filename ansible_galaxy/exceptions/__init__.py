@@ -40,6 +40,17 @@ class GalaxyDownloadError(GalaxyError):
         return '%s(url=%s, %s)' % (self.__class__.__name__, self.url, self.args)
 
 
+class GalaxyArtifactChksumError(GalaxyDownloadError):
+    '''Raised if the sha256 of a downloaded artifact does not match the expected sha256'''
+
+    def __init__(self, *args, **kwargs):
+        expected = kwargs.pop('expected', None)
+        actual = kwargs.pop('actual', None)
+        super(GalaxyArtifactChksumError, self).__init__(*args, **kwargs)
+        self.expected = expected
+        self.actual = actual
+
+
 class GalaxyRepositorySpecError(GalaxyClientError):
     '''Raised if the repository_spec was invalid'''
     def __init__(self, *args, **kwargs):
@@ -56,6 +67,16 @@ class GalaxyCouldNotFindAnswerForRequirement(GalaxyClientError):
         self.requirement_spec = requirement_spec
 
 
+class GalaxyResolutionError(GalaxyClientError):
+    '''Raised if no set of collection versions satisfies all of the requirements
+
+    conflicts is a list of the reasons (as text) that the versions tried did not work.'''
+    def __init__(self, *args, **kwargs):
+        conflicts = kwargs.pop('conflicts', None) or []
+        super(GalaxyResolutionError, self).__init__(*args, **kwargs)
+        self.conflicts = conflicts
+
+
 class GalaxyRequestsError(GalaxyError):
     """Base exception for ansible_galaxy exceptions that wrap requests.RequestException"""
     pass
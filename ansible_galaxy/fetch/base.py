@@ -9,6 +9,8 @@ class BaseFetch(object):
 
     def __init__(self):
         self.local_path = None
+        # An artifact fetched into a file object (ie, in memory) instead of local_path
+        self.local_fileobj = None
         self.cleanup_tmp_files = True
 
         # remote_resource is whatever was fetched, ie a url or galaxy content spec
@@ -27,6 +29,14 @@ class BaseFetch(object):
         raise NotImplementedError
 
     def cleanup(self):
+        if self.local_fileobj:
+            log.debug("Closing the file object fetched from %s", self.remote_resource)
+            self.local_fileobj.close()
+            self.local_fileobj = None
+
+        if not self.local_path:
+            return
+
         if not self.cleanup_tmp_files:
             log.info("cleanup_tmp_files is false, Not removing the tmp file %s fetched from %s",
                      self.local_path, self.remote_resource)
@@ -1,6 +1,7 @@
 import logging
 
 from ansible_galaxy import exceptions
+from ansible_galaxy.fetch import galaxy_frozen
 from ansible_galaxy.fetch import galaxy_url
 from ansible_galaxy.fetch import local_file
 from ansible_galaxy.fetch import remote_url
@@ -11,8 +12,11 @@ from ansible_galaxy.models.repository_spec import FetchMethods
 log = logging.getLogger(__name__)
 
 
-def get(galaxy_context, requirement_spec):
-    """determine how to download a repo, builds a fetch instance, and returns the instance"""
+def get(galaxy_context, requirement_spec, galaxy_api=None):
+    """determine how to download a repo, builds a fetch instance, and returns the instance
+
+    If a GalaxyAPI is provided as galaxy_api, fetchers that use the Galaxy API use it
+    instead of creating their own, so lookups already made with it are not repeated."""
 
     fetcher = None
 
@@ -32,10 +36,15 @@ def get(galaxy_context, requirement_spec):
         fetcher = local_file.LocalFileFetch(requirement_spec)
     elif requirement_spec.fetch_method == FetchMethods.REMOTE_URL:
         fetcher = remote_url.RemoteUrlFetch(requirement_spec=requirement_spec,
-                                            validate_certs=not galaxy_context.server['ignore_certs'])
+                                            validate_certs=not galaxy_context.server['ignore_certs'],
+                                            galaxy_context=galaxy_context)
     elif requirement_spec.fetch_method == FetchMethods.GALAXY_URL:
         fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=requirement_spec,
-                                            galaxy_context=galaxy_context)
+                                            galaxy_context=galaxy_context,
+                                            galaxy_api=galaxy_api)
+    elif requirement_spec.fetch_method == FetchMethods.GALAXY_FROZEN:
+        fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=requirement_spec,
+                                                  galaxy_context=galaxy_context)
     else:
         raise exceptions.GalaxyError('No approriate content fetcher found for %s %s',
                                      requirement_spec.scm, requirement_spec.src)
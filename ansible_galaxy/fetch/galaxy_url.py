@@ -1,14 +1,19 @@
 import logging
 
-import semantic_version
+from concurrent import futures
+
 from six.moves.urllib.parse import quote as urlquote
 
 # mv details of this here
+from ansible_galaxy import artifact_cache
 from ansible_galaxy import exceptions
 from ansible_galaxy import download
+from ansible_galaxy import http_session
+from ansible_galaxy import http_transfer
 from ansible_galaxy.fetch import base
 # from ansible_galaxy.models.repository_spec import RepositorySpec
 from ansible_galaxy.rest_api import GalaxyAPI
+from ansible_galaxy.utils.version import VersionIndex
 
 log = logging.getLogger(__name__)
 
@@ -42,12 +47,15 @@ def select_repository_version(repoversions, version):
 class GalaxyUrlFetch(base.BaseFetch):
     fetch_method = 'galaxy_url'
 
-    def __init__(self, galaxy_context, requirement_spec):
+    def __init__(self, galaxy_context, requirement_spec, galaxy_api=None):
         super(GalaxyUrlFetch, self).__init__()
 
         self.requirement_spec = requirement_spec
         self.galaxy_context = galaxy_context
 
+        # A GalaxyAPI shared with other fetchers, if any
+        self.galaxy_api = galaxy_api
+
         self.validate_certs = not self.galaxy_context.server['ignore_certs']
 
         log.debug('requirement_spec: %s', requirement_spec)
@@ -64,9 +72,15 @@ class GalaxyUrlFetch(base.BaseFetch):
             3. Get the details of the CollectionVersion including 'download_url' (GET /api/v2/collections/{namespace}/{names}/versions/{version}/,
                available as the 'href' in each CollectionVersion)
 
-        It then returns the info about the Collection and CollectionVersion including download_url to be used by fetch()'''
+        Since the url of the versions list can be derived from the namespace and name, 1 and 2
+        are requested at the same time. If the Collection detail has a different 'versions_url',
+        the versions are requested again from that. If the CollectionVersion in the versions list
+        already includes the 'download_url', 3 is skipped.
+
+        It then returns the info about the Collection and CollectionVersion including download_url to be used by fetch()
+        and the 'dependencies' from the CollectionVersion metadata.'''
 
-        api = GalaxyAPI(self.galaxy_context)
+        api = self.galaxy_api or GalaxyAPI(self.galaxy_context)
 
         namespace = self.requirement_spec.namespace
         collection_name = self.requirement_spec.name
@@ -80,15 +94,34 @@ class GalaxyUrlFetch(base.BaseFetch):
                                                                                            namespace=urlquote(namespace),
                                                                                            name=urlquote(collection_name))
 
+        derived_versions_list_url = '%sversions/' % collection_detail_url
+
         log.debug('collection_detail_url: %s', collection_detail_url)
 
-        collection_detail_data = api.get_object(href=collection_detail_url)
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+
+        try:
+            collection_detail_future = executor.submit(api.get_object, href=collection_detail_url)
+
+            # The versions list is requested while the Collection detail request is in flight
+            collection_version_list_data = None
+            versions_list_exc = None
+
+            try:
+                collection_version_list_data = api.get_object(derived_versions_list_url, page_size=api.page_size)
+            except exceptions.GalaxyRequestsError as exc:
+                # The detail may point somewhere else, so only an error if it doesn't
+                versions_list_exc = exc
+
+            collection_detail_data = collection_detail_future.result()
+        finally:
+            executor.shutdown(wait=True)
 
         if not collection_detail_data:
             raise exceptions.GalaxyClientError("- sorry, %s was not found on %s." % (self.requirement_spec.label,
                                                                                      api.api_server))
 
-        versions_list_url = collection_detail_data.get('versions_url', None)
+        versions_list_url = collection_detail_data.get('versions_url', None) or derived_versions_list_url
 
         collection_is_deprecated = collection_detail_data.get('deprecated', False)
 
@@ -103,10 +136,13 @@ class GalaxyUrlFetch(base.BaseFetch):
         #   "version": "1.2.3",
         #   "href": "/api/v2/collections/ansible/k8s/versions/1.2.3/",
         #  }]
-        log.debug('Getting collectionversions for %s.%s from %s',
-                  namespace, collection_name, versions_list_url)
+        if versions_list_url != derived_versions_list_url:
+            log.debug('Getting collectionversions for %s.%s from %s (instead of %s)',
+                      namespace, collection_name, versions_list_url, derived_versions_list_url)
 
-        collection_version_list_data = api.get_object(versions_list_url)
+            collection_version_list_data = api.get_object(versions_list_url, page_size=api.page_size)
+        elif versions_list_exc:
+            raise versions_list_exc
 
         log.debug('collectionvertlist data:\n%s', collection_version_list_data)
 
@@ -115,21 +151,16 @@ class GalaxyUrlFetch(base.BaseFetch):
                                                (self.requirement_spec.label,
                                                 api.api_server))
 
-        collection_version_strings = [a.get('version') for a in collection_version_list_data if a.get('version', None)]
-
-        # a Version() component of the CollectionVersion
-        collection_versions_versions = [semantic_version.Version(ver) for ver in collection_version_strings]
+        # The Version() of each CollectionVersion, with the rest of the CollectionVersion info
+        collection_version_index = VersionIndex()
+        for collection_version in collection_version_list_data:
+            if collection_version.get('version', None):
+                collection_version_index.add(collection_version['version'], data=collection_version)
 
         # No match returns None
-        best_version = self.requirement_spec.version_spec.select(collection_versions_versions)
+        best_version = collection_version_index.select(self.requirement_spec.version_spec)
 
-        # Find the rest of the info for the collectionversion that is the best version
-        # linear search
-        best_collectionversion = next(
-            (cv for cv in collection_version_list_data
-             # build a Version of both to for full semver matching
-             if semantic_version.Version(cv['version']) == best_version),
-            {})
+        best_collectionversion = collection_version_index.data(best_version) or {}
 
         log.debug('best_collectionversion: %s', best_collectionversion)
 
@@ -142,7 +173,11 @@ class GalaxyUrlFetch(base.BaseFetch):
                                                                     self.requirement_spec.label,
                                                                     requirement_spec=self.requirement_spec)
 
-        best_collectionversion_detail_data = api.get_object(href=best_collectionversion.get('href', None))
+        # Some servers include the detail in the versions list, so don't request it again
+        if best_collectionversion.get('download_url', None):
+            best_collectionversion_detail_data = best_collectionversion
+        else:
+            best_collectionversion_detail_data = api.get_object(href=best_collectionversion.get('href', None))
 
         download_url = best_collectionversion_detail_data.get('download_url', None)
 
@@ -151,8 +186,19 @@ class GalaxyUrlFetch(base.BaseFetch):
         if not download_url:
             raise exceptions.GalaxyError('no external_url info on the Repository object from %s' % self.requirement_spec.label)
 
-        # collectionversion_metadata = best_collectionversion_detail_data.get('metadata', None)
-        # log.debug('collectionversion_metadata: %s', collectionversion_metadata)
+        # The 'artifact' info includes the sha256 and size of the artifact that download_url points to
+        artifact_info = best_collectionversion_detail_data.get('artifact', None) or {}
+        artifact_sha256 = artifact_info.get('sha256', None)
+        artifact_size = artifact_info.get('size', None)
+
+        # The 'metadata' includes the 'dependencies' of the CollectionVersion (from its galaxy.yml), so they
+        # can be resolved before the artifact is downloaded. None if the server didn't say.
+        collectionversion_metadata = best_collectionversion_detail_data.get('metadata', None)
+        dependencies = None
+        if collectionversion_metadata is not None:
+            dependencies = collectionversion_metadata.get('dependencies', None) or {}
+
+        log.debug('dependencies for %s.%s %s: %s', namespace, collection_name, best_version, dependencies)
 
         # TODO: raise exceptions if API requests are empty
 
@@ -160,6 +206,9 @@ class GalaxyUrlFetch(base.BaseFetch):
                                'repo_name': collection_name,
                                'version': best_version},
                    'custom': {'download_url': download_url,
+                              'artifact_sha256': artifact_sha256,
+                              'artifact_size': artifact_size,
+                              'dependencies': dependencies,
                               'collection_is_deprecated': collection_is_deprecated},
                    }
 
@@ -181,9 +230,92 @@ class GalaxyUrlFetch(base.BaseFetch):
         # for including in any error messages or logging for this fetch
         self.remote_resource = download_url
 
-        # can raise GalaxyDownloadError
-        repository_archive_path = download.fetch_url(download_url,
-                                                     validate_certs=self.validate_certs)
+        content = find_results['content']
+        artifact_sha256 = find_results['custom'].get('artifact_sha256', None)
+
+        cache = artifact_cache.get(self.galaxy_context)
+
+        repository_archive_path = None
+        if cache:
+            repository_archive_path = cache.get(content['galaxy_namespace'],
+                                                content['repo_name'],
+                                                content['version'],
+                                                sha256=artifact_sha256)
+
+        if repository_archive_path:
+            log.debug('Using %s from the artifact cache instead of downloading %s',
+                      repository_archive_path, download_url)
+        elif self.galaxy_context.options.get('stream_downloads', False):
+            # Nothing is downloaded yet, install.stage() extracts the artifact as it downloads
+            log.debug('Streaming %s at install time', download_url)
+
+            self.cleanup_tmp_files = False
+
+            # From the mirror if there is one, falling back to download_url
+            mirror_url = download.mirror_url(download_url, self.galaxy_context)
+
+            results = {'archive_path': None,
+                       'stream_url': mirror_url or download_url,
+                       'stream_fallback_url': download_url if mirror_url else None,
+                       'validate_certs': self.validate_certs,
+                       'pool_size': http_session.pool_size(self.galaxy_context),
+                       'transfer_policy': http_transfer.policy(self.galaxy_context),
+                       'fetch_method': self.fetch_method,
+                       'custom': find_results['custom'],
+                       'content': find_results['content']}
+
+            return results
+        else:
+            segment_count, segment_min_size = download.segments(self.galaxy_context)
+
+            # If the artifact isn't going to be cached, a small one doesn't need to touch the disk at all
+            spool_max_size = 0
+            if not cache:
+                spool_max_size = download.spool_max_size(self.galaxy_context)
+
+            # The download is checked against the published sha256 and size as it is written,
+            # so a bad artifact is never extracted or cached.
+            # can raise GalaxyDownloadError or GalaxyArtifactChksumError
+            fetch_kwargs = {'validate_certs': self.validate_certs,
+                            'pool_size': http_session.pool_size(self.galaxy_context),
+                            'transfer_policy': http_transfer.policy(self.galaxy_context),
+                            'expected_sha256': artifact_sha256,
+                            'expected_size': find_results['custom'].get('artifact_size', None),
+                            'segment_count': segment_count,
+                            'segment_min_size': segment_min_size,
+                            'spool_max_size': spool_max_size}
+
+            download_results = None
+
+            mirror_url = download.mirror_url(download_url, self.galaxy_context)
+            if mirror_url:
+                log.debug('Downloading %s from the mirror %s', download_url, mirror_url)
+
+                try:
+                    download_results = download.fetch_artifact(mirror_url, **fetch_kwargs)
+                except exceptions.GalaxyDownloadError as e:
+                    if not download.mirror_missed(e):
+                        raise
+
+                    log.warning('Could not download %s from the mirror (%s), downloading %s instead',
+                                mirror_url, e, download_url)
+
+            if download_results is None:
+                download_results = download.fetch_artifact(download_url, **fetch_kwargs)
+
+            repository_archive_path = download_results['archive_path']
+            self.local_fileobj = download_results.get('archive_fileobj', None)
+
+            if cache:
+                repository_archive_path = cache.put(repository_archive_path,
+                                                    content['galaxy_namespace'],
+                                                    content['repo_name'],
+                                                    content['version'],
+                                                    sha256=download_results['sha256'])
+
+        # Leave the artifact in place if it lives in the artifact cache
+        if cache:
+            self.cleanup_tmp_files = False
 
         self.local_path = repository_archive_path
 
@@ -198,6 +330,10 @@ class GalaxyUrlFetch(base.BaseFetch):
         results = {'archive_path': repository_archive_path,
                    'fetch_method': self.fetch_method}
 
+        # A small artifact downloaded into memory
+        if self.local_fileobj:
+            results['archive_fileobj'] = self.local_fileobj
+
         # So fetch_results has the download url, if we follow redirects
         # we could also add a 'final_download_url' or 'downloaded_url' so
         # we know the original and the final url after redirects
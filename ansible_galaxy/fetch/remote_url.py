@@ -2,6 +2,8 @@
 import logging
 
 from ansible_galaxy import download
+from ansible_galaxy import http_session
+from ansible_galaxy import http_transfer
 from ansible_galaxy.fetch import base
 
 log = logging.getLogger(__name__)
@@ -10,12 +12,15 @@ log = logging.getLogger(__name__)
 class RemoteUrlFetch(base.BaseFetch):
     fetch_method = 'remote_url'
 
-    def __init__(self, requirement_spec, validate_certs=True):
+    def __init__(self, requirement_spec, validate_certs=True, galaxy_context=None):
         super(RemoteUrlFetch, self).__init__()
 
         self.requirement_spec = requirement_spec
         self.remote_url = requirement_spec.src
 
+        # for the http pool size and transfer policy (timeouts, retries and download limits)
+        self.galaxy_context = galaxy_context
+
         self.validate_certs = validate_certs
         log.debug('Validate TLS certificates: %s', self.validate_certs)
 
@@ -35,8 +40,17 @@ class RemoteUrlFetch(base.BaseFetch):
 
         find_results = find_results or {}
 
+        pool_size = None
+        transfer_policy = None
+        if self.galaxy_context:
+            pool_size = http_session.pool_size(self.galaxy_context)
+            transfer_policy = http_transfer.policy(self.galaxy_context)
+
         # NOTE: could move download.fetch_url here instead of splitting it
-        repository_archive_path = download.fetch_url(self.remote_url, validate_certs=self.validate_certs)
+        repository_archive_path = download.fetch_url(self.remote_url,
+                                                     validate_certs=self.validate_certs,
+                                                     pool_size=pool_size,
+                                                     transfer_policy=transfer_policy)
         self.local_path = repository_archive_path
 
         log.debug('repository_archive_path=%s', repository_archive_path)
@@ -0,0 +1,131 @@
+'''An on disk cache of Galaxy REST API responses
+
+Each cached response is a json file (named by the sha256 of the url) that stores the
+deserialized response data, the ETag and Last-Modified response headers, and when the
+response was stored.
+
+By default every cached response is revalidated with a conditional request (If-None-Match /
+If-Modified-Since) and the cached data is used if the server replies with a '304 Not Modified'.
+
+If a ttl (in seconds) is configured, entries younger than the ttl are used without contacting
+the server at all. If stale_while_revalidate (in seconds) is also configured, entries up to
+ttl + stale_while_revalidate old are used right away and revalidated in the background.
+'''
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+log = logging.getLogger(__name__)
+
+HTTP_CACHE_DIR = 'http'
+
+DEFAULT_TTL = 0
+DEFAULT_STALE_WHILE_REVALIDATE = 0
+
+
+def get(galaxy_context):
+    '''Return the HttpCache configured for galaxy_context or None if caching is not enabled'''
+    cache_path = galaxy_context.options.get('cache_path', None)
+
+    if not cache_path:
+        return None
+
+    ttl = galaxy_context.options.get('http_cache_ttl', None) or DEFAULT_TTL
+    stale_while_revalidate = \
+        galaxy_context.options.get('http_cache_stale_while_revalidate', None) or DEFAULT_STALE_WHILE_REVALIDATE
+
+    return HttpCache(os.path.join(os.path.expanduser(cache_path), HTTP_CACHE_DIR),
+                     ttl=ttl,
+                     stale_while_revalidate=stale_while_revalidate)
+
+
+class HttpCache(object):
+    def __init__(self, path, ttl=None, stale_while_revalidate=None):
+        self.path = path
+        self.ttl = ttl or DEFAULT_TTL
+        self.stale_while_revalidate = stale_while_revalidate or DEFAULT_STALE_WHILE_REVALIDATE
+
+    def entry_path(self, url):
+        url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, '%s.json' % url_hash)
+
+    def load(self, url):
+        '''Return the cache entry dict for url or None'''
+        try:
+            with open(self.entry_path(url), 'r') as entry_fd:
+                entry = json.load(entry_fd)
+        except (EnvironmentError, ValueError) as e:
+            log.debug('No usable http cache entry for %s: %s', url, e)
+            return None
+
+        # sha256 collisions aside, make sure the entry is really for this url
+        if entry.get('url', None) != url:
+            return None
+
+        return entry
+
+    def save(self, url, data, headers=None):
+        '''Store the response data for url along with its ETag and Last-Modified headers'''
+        headers = headers or {}
+
+        entry = {'url': url,
+                 'etag': headers.get('ETag', None),
+                 'last_modified': headers.get('Last-Modified', None),
+                 'stored_at': time.time(),
+                 'data': data}
+
+        self._write(url, entry)
+
+        return entry
+
+    def refresh(self, url, entry):
+        '''Mark entry as just validated (ie, after a '304 Not Modified')'''
+        entry['stored_at'] = time.time()
+
+        self._write(url, entry)
+
+        return entry
+
+    def _write(self, url, entry):
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                if not os.path.isdir(self.path):
+                    raise
+
+        try:
+            entry_fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp-')
+            with os.fdopen(entry_fd, 'w') as entry_fo:
+                json.dump(entry, entry_fo)
+            os.rename(tmp_path, self.entry_path(url))
+        except (EnvironmentError, TypeError, ValueError) as e:
+            # A failure to cache a response should never fail the request
+            log.warning('Unable to save the http cache entry for %s: %s', url, e)
+
+    def age(self, entry):
+        return time.time() - entry.get('stored_at', 0)
+
+    def is_fresh(self, entry):
+        '''True if entry can be used without contacting the server'''
+        return self.age(entry) < self.ttl
+
+    def is_usable_while_revalidating(self, entry):
+        '''True if entry is stale, but can be used while it is revalidated in the background'''
+        return self.stale_while_revalidate > 0 and \
+            self.age(entry) < self.ttl + self.stale_while_revalidate
+
+    def conditional_headers(self, entry):
+        headers = {}
+
+        if entry.get('etag', None):
+            headers['If-None-Match'] = entry['etag']
+
+        if entry.get('last_modified', None):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
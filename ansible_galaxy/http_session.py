@@ -0,0 +1,75 @@
+'''Process wide, per host requests.Session's with pooled connections
+
+Each requests.Session keeps a pool of connections that are reused (keep-alive) for
+later requests to the same host, avoiding a new TCP connection and TLS handshake for
+every request. To get the most out of that, every request mazer makes to a host
+(Galaxy API requests, artifact downloads, publishing) uses the same Session.
+
+The first caller for a host decides the size of its connection pool. The pool size is
+the number of connections to a host that are kept around to be reused, so it should be
+at least the number of requests made to that host at the same time.
+
+Sessions are shared between threads, so nothing request specific (ie, headers) should
+be set on a session. Pass those to each request instead.
+'''
+
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from six.moves.urllib.parse import urlparse
+
+from ansible_galaxy.config import defaults
+
+log = logging.getLogger(__name__)
+
+# (scheme, host[:port]) -> requests.Session
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def pool_size(galaxy_context):
+    '''The http connection pool size configured for galaxy_context'''
+    return galaxy_context.options.get('http_pool_size', None) or defaults.DEFAULT_HTTP_POOL_SIZE
+
+
+def session_key(url):
+    parsed_url = urlparse(url or '')
+    return (parsed_url.scheme.lower(), parsed_url.netloc.lower())
+
+
+def build_session(pool_size=None):
+    pool_size = max(1, int(pool_size or defaults.DEFAULT_HTTP_POOL_SIZE))
+
+    session = requests.Session()
+
+    # pool_connections is the number of per host pools an adapter keeps, which only
+    # matters when a session is redirected to other hosts (ie, a CDN)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def get(url, pool_size=None):
+    '''Return the requests.Session shared by all requests to the host of url'''
+    key = session_key(url)
+
+    with _sessions_lock:
+        if key not in _sessions:
+            log.debug('Creating a http session for %s://%s with a connection pool size of %s',
+                      key[0], key[1], pool_size or defaults.DEFAULT_HTTP_POOL_SIZE)
+
+            _sessions[key] = build_session(pool_size=pool_size)
+
+        return _sessions[key]
+
+
+def close_all():
+    '''Close all of the shared sessions and their pooled connections'''
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
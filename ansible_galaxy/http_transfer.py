@@ -0,0 +1,412 @@
+'''Timeouts, retries and rate limits for http requests (the 'transfer policy')
+
+Every http request mazer makes (Galaxy API requests and artifact downloads) goes
+through request(), which:
+
+    - sets a connect and read timeout, so a server that stops responding can not
+      hang mazer forever
+    - retries requests that fail with a connection error, a timeout or a 429/5xx
+      response, waiting longer (with random jitter) after each attempt, or as long
+      as the server asks for with a 'Retry-After' header
+    - gives up retrying once the request has taken longer than the deadline, and
+      never waits longer than the time left before the deadline for an attempt
+    - takes a token from the rate limiter of the server first, if there is one
+
+Only idempotent requests (GET, HEAD, OPTIONS) are retried. When the retries run out,
+the last response is returned (or the last exception raised) as if there had been
+no retries, so the usual error handling applies.
+
+The rate limiter of a server is a token bucket shared by every request to that server
+from any thread. A 429 response with a Retry-After pauses the bucket, so all of the
+workers back off together instead of each finding out on their own.
+
+Artifact downloads can also be limited (see download_limits()) to a number of bytes per
+second, for all downloads together and for each host, and to a number of connections to
+each host at the same time, so mazer doesn't saturate a shared link.
+'''
+
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import attr
+import requests
+
+from six.moves.urllib.parse import urlparse
+
+from ansible_galaxy import http_session
+from ansible_galaxy.config import defaults
+
+log = logging.getLogger(__name__)
+
+RETRY_METHODS = ('GET', 'HEAD', 'OPTIONS')
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+# The shortest timeout an attempt is given, even if the deadline is closer than that
+MIN_ATTEMPT_TIMEOUT = 0.1
+
+# (scheme, host[:port]) -> RateLimiter
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+# (scheme, host[:port]) -> DownloadLimits, and None -> the RateLimiter (in bytes) for all downloads
+_download_limits = {}
+_download_limits_lock = threading.Lock()
+
+
+# The clock and sleep used here, so tests can replace them
+def _now():
+    return time.time()
+
+
+def _sleep(seconds):
+    time.sleep(seconds)
+
+
+@attr.s(frozen=True)
+class TransferPolicy(object):
+    '''How long to wait for http requests, and how to retry them
+
+    Timeouts are in seconds. deadline is the most time (in seconds) to spend on a request
+    including its retries, 0 for no deadline. The backoff before the nth retry is a random
+    time between 0 and min(max_backoff, backoff * 2**n).
+
+    rate_limit is the max requests per second to a Galaxy API server (0 for no limit),
+    with up to rate_limit_burst requests at once.
+
+    download_rate_limit is the max bytes per second for all artifact downloads together and
+    download_max_connections the max downloads from each host at the same time (0 for no
+    limit). download_hosts overrides them for particular hosts, ie:
+
+        {'cdn.example.com': {'rate_limit': 1048576, 'max_connections': 2}}
+
+    A host rate_limit applies on top of download_rate_limit.'''
+
+    connect_timeout = attr.ib(default=defaults.DEFAULT_HTTP_CONNECT_TIMEOUT)
+    read_timeout = attr.ib(default=defaults.DEFAULT_HTTP_READ_TIMEOUT)
+    retries = attr.ib(default=defaults.DEFAULT_HTTP_RETRIES)
+    backoff = attr.ib(default=defaults.DEFAULT_HTTP_RETRY_BACKOFF)
+    max_backoff = attr.ib(default=defaults.DEFAULT_HTTP_MAX_RETRY_BACKOFF)
+    deadline = attr.ib(default=defaults.DEFAULT_HTTP_DEADLINE)
+    rate_limit = attr.ib(default=defaults.DEFAULT_API_RATE_LIMIT)
+    rate_limit_burst = attr.ib(default=defaults.DEFAULT_API_RATE_LIMIT_BURST)
+    download_rate_limit = attr.ib(default=defaults.DEFAULT_DOWNLOAD_RATE_LIMIT)
+    download_max_connections = attr.ib(default=defaults.DEFAULT_DOWNLOAD_MAX_CONNECTIONS)
+    download_hosts = attr.ib(default=attr.Factory(dict), hash=False)
+
+    @property
+    def timeout(self):
+        '''The (connect, read) timeout to pass to requests'''
+        return (self.connect_timeout or None, self.read_timeout or None)
+
+    def backoff_delay(self, attempt):
+        '''Seconds to wait before retry number attempt (starting at 0)'''
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    def host_download_limits(self, url):
+        '''The (rate_limit, max_connections) for downloads from the host of url'''
+        host_limits = self.download_hosts.get(urlparse(url).hostname or '', None) or {}
+
+        return (float(_option(host_limits, 'rate_limit', 0)),
+                int(_option(host_limits, 'max_connections', self.download_max_connections)))
+
+
+def _option(options, key, default):
+    value = options.get(key, None)
+
+    if value is None:
+        return default
+
+    return value
+
+
+def policy(galaxy_context):
+    '''The TransferPolicy configured for galaxy_context'''
+    options = galaxy_context.options
+
+    return TransferPolicy(connect_timeout=float(_option(options, 'http_connect_timeout', defaults.DEFAULT_HTTP_CONNECT_TIMEOUT)),
+                          read_timeout=float(_option(options, 'http_read_timeout', defaults.DEFAULT_HTTP_READ_TIMEOUT)),
+                          retries=max(0, int(_option(options, 'http_retries', defaults.DEFAULT_HTTP_RETRIES))),
+                          backoff=float(_option(options, 'http_retry_backoff', defaults.DEFAULT_HTTP_RETRY_BACKOFF)),
+                          max_backoff=float(_option(options, 'http_max_retry_backoff', defaults.DEFAULT_HTTP_MAX_RETRY_BACKOFF)),
+                          deadline=float(_option(options, 'http_deadline', defaults.DEFAULT_HTTP_DEADLINE)),
+                          rate_limit=float(_option(options, 'api_rate_limit', defaults.DEFAULT_API_RATE_LIMIT)),
+                          rate_limit_burst=max(1, int(_option(options, 'api_rate_limit_burst', defaults.DEFAULT_API_RATE_LIMIT_BURST))),
+                          download_rate_limit=float(_option(options, 'download_rate_limit', defaults.DEFAULT_DOWNLOAD_RATE_LIMIT)),
+                          download_max_connections=int(_option(options, 'download_max_connections', defaults.DEFAULT_DOWNLOAD_MAX_CONNECTIONS)),
+                          download_hosts=dict(_option(options, 'download_hosts', {})))
+
+
+class RateLimiter(object):
+    '''A token bucket of rate tokens per second, holding up to burst tokens
+
+    A rate of 0 means no limit, but the limiter can still be paused with defer().'''
+
+    def __init__(self, rate=0, burst=1):
+        self.rate = float(rate or 0)
+        self.capacity = float(max(1, burst or 1))
+
+        self._tokens = self.capacity
+        self._updated = _now()
+        self._not_before = 0
+        self._lock = threading.Lock()
+
+    def _wait_time(self, tokens):
+        now = _now()
+
+        if self.rate:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+        if self._not_before > now:
+            return self._not_before - now
+
+        if not self.rate:
+            return 0
+
+        # More tokens than the bucket can hold are allowed once it is full, leaving it
+        # in debt, so the average rate still works out
+        needed = min(tokens, self.capacity)
+
+        if self._tokens >= needed:
+            self._tokens -= tokens
+            return 0
+
+        return (needed - self._tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        '''Wait until a request (or tokens, ie bytes) is allowed'''
+        while True:
+            with self._lock:
+                wait = self._wait_time(tokens)
+
+            if not wait:
+                return
+
+            log.debug('Waiting %.2fs for the rate limit', wait)
+            _sleep(wait)
+
+    def defer(self, seconds):
+        '''Don't allow any requests for seconds'''
+        with self._lock:
+            self._not_before = max(self._not_before, _now() + seconds)
+
+
+def rate_limiter(url, rate=None, burst=None):
+    '''Return the RateLimiter shared by all requests to the host of url
+
+    The first caller for a host decides the rate and burst.'''
+    key = http_session.session_key(url)
+
+    with _rate_limiters_lock:
+        if key not in _rate_limiters:
+            if rate:
+                log.debug('Limiting requests to %s://%s to %s per second', key[0], key[1], rate)
+
+            _rate_limiters[key] = RateLimiter(rate=rate, burst=burst)
+
+        return _rate_limiters[key]
+
+
+class ConnectionSlot(object):
+    '''One of the connections allowed to a host (a slot of semaphore), held until release()
+
+    A released slot can be acquire()'ed again, ie by request() after waiting to retry.'''
+
+    def __init__(self, semaphore):
+        self._semaphore = semaphore
+        self._held = False
+        self.acquire()
+
+    def acquire(self):
+        if self._semaphore and not self._held:
+            self._semaphore.acquire()
+            self._held = True
+
+    def release(self):
+        if self._semaphore and self._held:
+            self._semaphore.release()
+            self._held = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class DownloadLimits(object):
+    '''The bandwidth and connection limits for downloads from a host
+
+    bandwidth_limiters are RateLimiters in bytes (ie, one for all downloads and one
+    for the host).'''
+
+    def __init__(self, bandwidth_limiters=None, max_connections=0):
+        self.bandwidth_limiters = [limiter for limiter in (bandwidth_limiters or []) if limiter]
+        self.max_connections = max_connections
+
+        self._connections = None
+        if max_connections:
+            self._connections = threading.BoundedSemaphore(max_connections)
+
+    def connection(self):
+        '''Wait for a connection to the host to be allowed, and return a ConnectionSlot to release when done'''
+        return ConnectionSlot(self._connections)
+
+    def throttle(self, byte_count):
+        '''Wait until byte_count more bytes are allowed'''
+        for limiter in self.bandwidth_limiters:
+            limiter.acquire(byte_count)
+
+
+def _bandwidth_limiter(rate):
+    if not rate:
+        return None
+
+    # Up to a second's worth at once
+    return RateLimiter(rate=rate, burst=rate)
+
+
+def download_limits(url, transfer_policy=None):
+    '''Return the DownloadLimits shared by all downloads from the host of url
+
+    The first caller for a host decides its limits, and the first caller of all decides
+    the limit for all downloads.'''
+    transfer_policy = transfer_policy or TransferPolicy()
+    key = http_session.session_key(url)
+
+    with _download_limits_lock:
+        if None not in _download_limits:
+            if transfer_policy.download_rate_limit:
+                log.debug('Limiting downloads to %s bytes per second', transfer_policy.download_rate_limit)
+
+            _download_limits[None] = _bandwidth_limiter(transfer_policy.download_rate_limit)
+
+        if key not in _download_limits:
+            host_rate_limit, max_connections = transfer_policy.host_download_limits(url)
+
+            if host_rate_limit or max_connections:
+                log.debug('Limiting downloads from %s://%s to %s bytes per second and %s connections',
+                          key[0], key[1], host_rate_limit or 'any', max_connections or 'any')
+
+            _download_limits[key] = DownloadLimits(bandwidth_limiters=[_download_limits[None],
+                                                                       _bandwidth_limiter(host_rate_limit)],
+                                                   max_connections=max_connections)
+
+        return _download_limits[key]
+
+
+def parse_retry_after(retry_after):
+    '''The seconds to wait from a Retry-After header value (seconds or a http date), or None'''
+    if not retry_after:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    retry_after_date = email.utils.parsedate_tz(retry_after)
+    if not retry_after_date:
+        log.debug('Ignoring the invalid Retry-After: %s', retry_after)
+        return None
+
+    return max(0.0, email.utils.mktime_tz(retry_after_date) - _now())
+
+
+def _attempt_timeout(timeout, deadline):
+    '''timeout (a requests timeout, ie (connect, read)) capped at the time left before deadline
+
+    The read timeout is the longest wait for each read, not for the whole response, so this
+    keeps an attempt from waiting past the deadline for a response (or for the next bytes of it).'''
+    if deadline is None:
+        return timeout
+
+    remaining = max(MIN_ATTEMPT_TIMEOUT, deadline - _now())
+
+    if isinstance(timeout, tuple):
+        return tuple(min(part, remaining) if part else remaining for part in timeout)
+
+    return min(timeout, remaining) if timeout else remaining
+
+
+def request(session, method, url, transfer_policy=None, limiter=None, slot=None, **kwargs):
+    '''session.request(method, url, **kwargs) with the timeouts and retries of transfer_policy
+
+    If limiter (a RateLimiter) is provided, every attempt waits for it first.
+
+    If slot (the held ConnectionSlot for the request, ie from DownloadLimits.connection()) is
+    provided, it is released while waiting to retry and acquired again for the next attempt,
+    so other requests to the host can use the connection in the meantime.'''
+    transfer_policy = transfer_policy or TransferPolicy()
+
+    timeout = kwargs.pop('timeout', transfer_policy.timeout)
+
+    deadline = None
+    if transfer_policy.deadline:
+        deadline = _now() + transfer_policy.deadline
+
+    retryable_method = method.upper() in RETRY_METHODS
+
+    attempt = 0
+
+    while True:
+        if limiter:
+            limiter.acquire()
+
+        if slot:
+            slot.acquire()
+
+        resp = None
+        request_exc = None
+
+        try:
+            resp = session.request(method, url, timeout=_attempt_timeout(timeout, deadline), **kwargs)
+        except requests.exceptions.SSLError:
+            # not going to get any better
+            raise
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as exc:
+            if not retryable_method or attempt >= transfer_policy.retries:
+                raise
+
+            request_exc = exc
+            delay = transfer_policy.backoff_delay(attempt)
+            reason = repr(exc)
+        else:
+            if not retryable_method or resp.status_code not in RETRY_STATUS_CODES or attempt >= transfer_policy.retries:
+                return resp
+
+            reason = 'http_status=%s' % resp.status_code
+
+            retry_after = parse_retry_after(resp.headers.get('Retry-After', None))
+            delay = retry_after
+            if delay is None:
+                delay = transfer_policy.backoff_delay(attempt)
+
+            # The server is telling everyone to slow down, not just this request
+            if resp.status_code == 429 and limiter and retry_after is not None:
+                limiter.defer(retry_after)
+
+        if deadline is not None and _now() + delay > deadline:
+            log.warning('Not retrying "%s %s" after %s, since it would take longer than the %ss deadline',
+                        method, url, reason, transfer_policy.deadline)
+
+            if request_exc is not None:
+                raise request_exc
+            return resp
+
+        if resp is not None:
+            # return the connection to the pool
+            resp.close()
+
+        attempt += 1
+
+        log.info('Retrying "%s %s" in %.2fs after %s (retry %s of %s)',
+                 method, url, delay, reason, attempt, transfer_policy.retries)
+
+        if slot:
+            slot.release()
+
+        _sleep(delay)
@@ -7,8 +7,10 @@ import pprint
 import attr
 
 from ansible_galaxy import repository_archive
+from ansible_galaxy import download
 from ansible_galaxy import exceptions
-from ansible_galaxy import installed_repository_db
+from ansible_galaxy import installed_repository_index_file
+from ansible_galaxy import repository
 from ansible_galaxy.models.install_destination import InstallDestinationInfo
 from ansible_galaxy.models.repository_spec import FetchMethods, RepositorySpec
 
@@ -59,6 +61,62 @@ def fetch(fetcher, repository_spec, find_results):
     return fetch_results
 
 
+def stage(galaxy_context, fetch_results, repository_spec):
+    '''For a streaming fetch, download and extract the artifact to a staging dir now
+
+    This is the slow part of installing a streamed artifact, so it can be done by
+    the same workers that fetch other artifacts. install() then only has to swap
+    the staging dir into place. Returns the fetch_results, with the 'staged' results
+    of repository_archive.stage_from_url() added for a streaming fetch.'''
+
+    stream_url = fetch_results.get('stream_url', None)
+
+    if not stream_url or fetch_results.get('staged', None):
+        return fetch_results
+
+    destination_info = _destination_info(galaxy_context, repository_spec)
+
+    fetch_custom = fetch_results.get('custom', None) or {}
+
+    stage_kwargs = {'repository_spec': repository_spec,
+                    'destination_info': destination_info,
+                    'validate_certs': fetch_results.get('validate_certs', True),
+                    'pool_size': fetch_results.get('pool_size', None),
+                    'transfer_policy': fetch_results.get('transfer_policy', None),
+                    'expected_sha256': fetch_custom.get('artifact_sha256', None)}
+
+    # stream_url is a mirror (see download.mirror_url()) if there is a stream_fallback_url
+    fallback_url = fetch_results.get('stream_fallback_url', None)
+
+    try:
+        staged = repository_archive.stage_from_url(stream_url, **stage_kwargs)
+    except exceptions.GalaxyDownloadError as e:
+        if not fallback_url or not download.mirror_missed(e):
+            raise
+
+        log.warning('Could not download %s from the mirror (%s), downloading %s instead',
+                    stream_url, e, fallback_url)
+
+        staged = repository_archive.stage_from_url(fallback_url, **stage_kwargs)
+
+    # The install info records where Galaxy said the artifact is, not the mirror
+    staged['download_url'] = fetch_custom.get('download_url', None) or staged['download_url']
+
+    staged_fetch_results = fetch_results.copy()
+    staged_fetch_results['staged'] = staged
+
+    return staged_fetch_results
+
+
+def discard(fetcher, fetch_results):
+    '''Clean up after a fetch that is not going to be installed'''
+    fetcher.cleanup()
+
+    staged = (fetch_results or {}).get('staged', None)
+    if staged:
+        repository_archive.discard_staged(staged)
+
+
 def repository_spec_from_find_results(find_results,
                                       requirement_spec):
     '''Create a new RepositorySpec with updated info from fetch_results.
@@ -94,14 +152,44 @@ def repository_spec_from_find_results(find_results,
     return repository_spec
 
 
+def _destination_info(galaxy_context, repository_spec, force_overwrite=False):
+    '''Build up all the info about where the repository will be installed to'''
+
+    # preparation for archive extraction
+    if not os.path.isdir(galaxy_context.collections_path):
+        log.debug('No content path (%s) found so creating it', galaxy_context.collections_path)
+
+        try:
+            os.makedirs(galaxy_context.collections_path)
+        except OSError:
+            # another worker may have just created it
+            if not os.path.isdir(galaxy_context.collections_path):
+                raise
+
+    namespaced_repository_path = '%s/%s' % (repository_spec.namespace,
+                                            repository_spec.name)
+
+    editable = repository_spec.fetch_method == FetchMethods.EDITABLE
+
+    return InstallDestinationInfo(collections_path=galaxy_context.collections_path,
+                                  repository_spec=repository_spec,
+                                  namespaced_repository_path=namespaced_repository_path,
+                                  force_overwrite=force_overwrite,
+                                  editable=editable)
+
+
 def install(galaxy_context,
             fetcher,
             fetch_results,
             repository_spec,
             force_overwrite=False,
-            display_callback=None):
+            display_callback=None,
+            installed_index=None):
     """extract the archive to the filesystem and write out install metadata.
 
+    If an InstalledRepositoryIndex is provided as installed_index, the just
+    installed repositories are added to it.
+
     MUST be called after self.fetch()."""
 
     log.debug('install: repository_spec=%s, force_overwrite=%s',
@@ -114,71 +202,87 @@ def install(galaxy_context,
 
     archive_path = fetch_results.get('archive_path', None)
 
-    # TODO: this could be pulled up a layer, after getting fetch_results but before install()
-    if not archive_path:
-        raise exceptions.GalaxyClientError('No valid content data found for...')
+    # A small artifact may have been downloaded into memory instead of a file
+    archive_fileobj = fetch_results.get('archive_fileobj', None)
 
-    log.debug("installing from %s", archive_path)
+    # For a streaming fetch, the artifact is downloaded and extracted at the same time by stage(),
+    # which has usually been done already by the fetch workers
+    stream_url = fetch_results.get('stream_url', None)
 
-    repo_archive_ = repository_archive.load_archive(archive_path, repository_spec)
+    # TODO: this could be pulled up a layer, after getting fetch_results but before install()
+    if not archive_path and not archive_fileobj and not stream_url and not fetch_results.get('staged', None):
+        raise exceptions.GalaxyClientError('No valid content data found for...')
 
-    log.debug('repo_archive_: %s', repo_archive_)
-    log.debug('repo_archive_.info: %s', repo_archive_.info)
+    try:
+        repo_archive_ = None
+        if archive_path or archive_fileobj:
+            log.debug("installing from %s", archive_path or 'the artifact downloaded into memory')
 
-    # we strip off any higher-level directories for all of the files contained within
-    # the tar file here. The default is 'github_repo-target'. Gerrit instances, on the other
-    # hand, does not have a parent directory at all.
+            repo_archive_ = repository_archive.load_archive(archive_path, repository_spec, fileobj=archive_fileobj)
 
-    # preparation for archive extraction
-    if not os.path.isdir(galaxy_context.collections_path):
-        log.debug('No content path (%s) found so creating it', galaxy_context.collections_path)
+            log.debug('repo_archive_: %s', repo_archive_)
+            log.debug('repo_archive_.info: %s', repo_archive_.info)
 
-        os.makedirs(galaxy_context.collections_path)
+        # we strip off any higher-level directories for all of the files contained within
+        # the tar file here. The default is 'github_repo-target'. Gerrit instances, on the other
+        # hand, does not have a parent directory at all.
 
-    # Build up all the info about where the repository will be installed to
-    namespaced_repository_path = '%s/%s' % (repository_spec.namespace,
-                                            repository_spec.name)
+        destination_info = _destination_info(galaxy_context, repository_spec, force_overwrite=force_overwrite)
 
-    editable = repository_spec.fetch_method == FetchMethods.EDITABLE
+        # Where the artifact came from (for collections from Galaxy), saved in the install info
+        fetch_custom = fetch_results.get('custom', None) or {}
 
-    destination_info = InstallDestinationInfo(collections_path=galaxy_context.collections_path,
-                                              repository_spec=repository_spec,
-                                              namespaced_repository_path=namespaced_repository_path,
-                                              force_overwrite=force_overwrite,
-                                              editable=editable)
+        # A list of InstallationResults
+        if repo_archive_:
+            res = repository_archive.install(repo_archive_,
+                                             repository_spec=repository_spec,
+                                             destination_info=destination_info,
+                                             display_callback=display_callback,
+                                             download_url=fetch_custom.get('download_url', None),
+                                             artifact_sha256=fetch_custom.get('artifact_sha256', None))
+        else:
+            staged = stage(galaxy_context, fetch_results, repository_spec)['staged']
 
-    # A list of InstallationResults
-    res = repository_archive.install(repo_archive_,
-                                     repository_spec=repository_spec,
-                                     destination_info=destination_info,
-                                     display_callback=display_callback)
+            log.debug("installing from %s, extracted to %s while downloading it", stream_url, staged['staging_path'])
 
-    just_installed_spec_and_results.append((repository_spec, res))
+            res = repository_archive.install_staged(staged,
+                                                    repository_spec=repository_spec,
+                                                    destination_info=destination_info)
 
-    # rm any temp files created when getting the content archive
-    # TODO: use some sort of callback?
-    fetcher.cleanup()
+        just_installed_spec_and_results.append((repository_spec, res))
+    finally:
+        # rm any temp files created when getting the content archive, even if the install failed
+        # TODO: use some sort of callback?
+        fetcher.cleanup()
 
     # We know the repo specs for the repos we asked to install, and the installation results,
-    # so now use that info to find the just installed repos on disk and load them and return them.
-    just_installed_repository_specs = [x[0] for x in just_installed_spec_and_results]
+    # so now use that info to load the just installed repos from disk and return them.
+    just_installed_repositories = []
 
-    # log.debug('just_installed_repository_specs: %s', just_installed_repository_specs)
+    for just_installed_repository_spec, install_results in just_installed_spec_and_results:
+        # We know exactly where it was installed to, so load it from there instead of
+        # searching all of collections_path for it.
+        just_installed_repository = \
+            repository.load_from_dir(galaxy_context.collections_path,
+                                     namespace_path=os.path.dirname(install_results.installed_to_path),
+                                     namespace=just_installed_repository_spec.namespace,
+                                     name=just_installed_repository_spec.name,
+                                     installed=True)
 
-    irdb = installed_repository_db.InstalledRepositoryDatabase(galaxy_context)
+        if not just_installed_repository or \
+                just_installed_repository.repository_spec != just_installed_repository_spec:
+            log.warning('Unable to find %s where it was just installed (%s)',
+                        just_installed_repository_spec, install_results.installed_to_path)
+            continue
 
-    just_installed_repositories = []
+        log.debug('just_installed_repository is installed: %s', pprint.pformat(attr.asdict(just_installed_repository)))
 
-    for just_installed_repository_spec in just_installed_repository_specs:
-        just_installed_repository_gen = irdb.by_repository_spec(just_installed_repository_spec)
+        if installed_index is not None:
+            installed_index.add(just_installed_repository)
 
-        # TODO: Eventually, we could make install.install return a generator and yield these results straigt
-        #       from just_installed_repository_generator. The loop here is mostly for logging/feedback.
-        # Should only get one answer here for now.
-        for just_installed_repository in just_installed_repository_gen:
-            log.debug('just_installed_repository is installed: %s', pprint.pformat(attr.asdict(just_installed_repository)))
+        installed_repository_index_file.add(galaxy_context, just_installed_repository)
 
-            just_installed_repositories.append(just_installed_repository)
+        just_installed_repositories.append(just_installed_repository)
 
     # log.debug('just_installed_repositories: %s', pprint.pformat(just_installed_repositories))
 
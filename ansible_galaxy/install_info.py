@@ -20,7 +20,9 @@ def load(data_or_file_object):
     # log.debug('info_dict: %s', info_dict)
     install_info = InstallInfo(version=info_dict.get('version', None),
                                install_date=info_dict.get('install_date', None),
-                               install_date_iso=info_dict.get('install_date_iso', None))
+                               install_date_iso=info_dict.get('install_date_iso', None),
+                               download_url=info_dict.get('download_url', None),
+                               artifact_sha256=info_dict.get('artifact_sha256', None))
 
     # log.debug('install_info loaded from %s', install_info)
     return install_info
@@ -1,34 +1,12 @@
 import logging
-import os
+import threading
 
-from ansible_galaxy import repository
+from ansible_galaxy import installed_repository_index_file
 from ansible_galaxy import matchers
-from ansible_galaxy import installed_namespaces_db
 
 log = logging.getLogger(__name__)
 
 
-def get_repository_paths(namespace_path):
-    # TODO: abstract this a bit?  one to make it easier to mock, but also
-    #       possibly to prepare for nested dirs, multiple paths, various
-    #       filters/whitelist/blacklist/excludes, caching, or respecting
-    #       fs ordering, etc
-    #
-    # TODO: do some caching, invalidation based on dir mtimes?
-    try:
-        # TODO: filter on any rules for what a namespace path looks like
-        #       may one being 'somenamespace.somename' (a dot sep ns and name)
-        #
-        repository_paths = os.listdir(namespace_path)
-    except OSError as e:
-        log.exception(e)
-        log.warning('The namespace path %s did not exist so no repositories were found.',
-                    namespace_path)
-        repository_paths = []
-
-    return repository_paths
-
-
 def installed_repository_iterator(galaxy_context,
                                   namespace_match_filter=None,
                                   repository_spec_match_filter=None,
@@ -39,35 +17,21 @@ def installed_repository_iterator(galaxy_context,
     repository_spec_match_filter = repository_spec_match_filter or matchers.MatchAll()
     requirement_spec_match_filter = requirement_spec_match_filter or matchers.MatchAll()
 
-    installed_namespace_db = installed_namespaces_db.InstalledNamespaceDatabase(galaxy_context)
-
-    # TODO: iterate/filter per namespace, then per collection
-    for namespace in installed_namespace_db.select(namespace_match_filter=namespace_match_filter):
-        log.debug('Looking for repos in namespace "%s"', namespace.namespace)
-
-        # TODO: filter potential repository_paths based on repository_match_filer before we
-        #       try to listdir() instead of after
-        repository_paths = get_repository_paths(namespace.path)
-
-        for repository_path in repository_paths:
+    # The index only loads the repositories whose dirs changed since the last time
+    indexed_repositories = \
+        installed_repository_index_file.installed_repository_iterator(galaxy_context,
+                                                                      namespace_match_filter=namespace_match_filter)
 
-            # TODO: just build up one dir and pass it in
-            # TODO: if we need to distinquish repo from collection or role, we could do it here
-            repository_ = repository.load_from_dir(galaxy_context.collections_path,
-                                                   namespace_path=namespace.path,
-                                                   namespace=namespace.namespace,
-                                                   name=repository_path,
-                                                   installed=True)
+    for repository_ in indexed_repositories:
+        # log.debug('candidate installed repo (pre filter): %s', repository_)
 
-            # log.debug('candidate installed repo (pre filter): %s', repository_)
+        if repository_spec_match_filter(repository_):
+            log.debug('Found repository "%s" (%s)', repository_.label, repository_)
 
-            if repository_spec_match_filter(repository_):
-                log.debug('Found repository "%s" (%s) in namespace "%s"', repository_path, str(repository), namespace.namespace)
-
-                if requirement_spec_match_filter(repository_):
-                    log.debug('Found repository "%s" in namespace "%s"',
-                              repository_path, namespace.namespace)
-                    yield repository_
+            if requirement_spec_match_filter(repository_):
+                log.debug('Found repository "%s" in namespace "%s"',
+                          repository_.repository_spec.name, repository_.repository_spec.namespace)
+                yield repository_
 
 
 # TODO: add a get(namespace_id, repository_id) for loading a known ns.n directly without iterating
@@ -113,3 +77,86 @@ class InstalledRepositoryDatabase(object):
         requirement_spec_match_filter = matchers.MatchRepositoryToRequirementSpec([requirement_spec])
 
         return self.select(requirement_spec_match_filter=requirement_spec_match_filter)
+
+
+class InstalledRepositoryIndex(object):
+    '''An in memory index of the installed repositories, keyed by (namespace, name)
+
+    The index is loaded from galaxy_context.collections_path the first time it is
+    used, and is then kept up to date with add() and remove() instead of looking
+    at the collections_path again. The intent is to build one per 'install' run
+    and use it for all the 'is this already installed?' checks.
+
+    The select() and by_*() methods work like the InstalledRepositoryDatabase ones.
+
+    It is safe to look things up from multiple threads.'''
+
+    def __init__(self, installed_context=None):
+        self.installed_context = installed_context
+        self._repositories = None
+        self._load_lock = threading.Lock()
+
+    def _load(self):
+        if self._repositories is not None:
+            return self._repositories
+
+        with self._load_lock:
+            # another thread may have loaded it while we waited
+            if self._repositories is not None:
+                return self._repositories
+
+            irdb = InstalledRepositoryDatabase(self.installed_context)
+
+            repositories = {}
+            for installed_repository in irdb.select():
+                repositories[self._key(installed_repository.repository_spec)] = installed_repository
+
+            log.debug('Loaded %s installed repositories into the index', len(repositories))
+
+            self._repositories = repositories
+
+        return self._repositories
+
+    @staticmethod
+    def _key(repository_spec):
+        return (repository_spec.namespace, repository_spec.name)
+
+    def get(self, namespace, name):
+        return self._load().get((namespace, name), None)
+
+    def add(self, installed_repository):
+        self._load()[self._key(installed_repository.repository_spec)] = installed_repository
+
+    def remove(self, installed_repository):
+        self._load().pop(self._key(installed_repository.repository_spec), None)
+
+    def select(self, repository_spec_match_filter=None,
+               requirement_spec_match_filter=None):
+        repository_spec_match_filter = repository_spec_match_filter or matchers.MatchAll()
+        requirement_spec_match_filter = requirement_spec_match_filter or matchers.MatchAll()
+
+        repositories = self._load()
+
+        for key in sorted(repositories):
+            installed_repository = repositories[key]
+
+            if repository_spec_match_filter(installed_repository) and \
+                    requirement_spec_match_filter(installed_repository):
+                yield installed_repository
+
+    def by_repository_spec(self, repository_spec):
+        installed_repository = self.get(repository_spec.namespace, repository_spec.name)
+
+        if installed_repository and installed_repository.repository_spec == repository_spec:
+            yield installed_repository
+
+    def by_requirement(self, requirement):
+        return self.by_requirement_spec(requirement_spec=requirement.requirement_spec)
+
+    def by_requirement_spec(self, requirement_spec):
+        installed_repository = self.get(requirement_spec.namespace, requirement_spec.name)
+
+        requirement_spec_match_filter = matchers.MatchRepositoryToRequirementSpec([requirement_spec])
+
+        if installed_repository and requirement_spec_match_filter(installed_repository):
+            yield installed_repository
@@ -0,0 +1,289 @@
+'''A persistent index of the repositories installed in a collections_path
+
+Loading an installed repository means reading and parsing its MANIFEST.json,
+galaxy.yml and meta/.galaxy_install_info. With lots of installed collections
+(or a slow, network mounted collections_path), doing that for every collection
+each time mazer runs gets slow.
+
+The index is a json file in the root of the collections_path (next to, not in,
+the 'ansible_collections' dir) that records what was found the last time the
+collections_path was looked at, along with a 'stamp' ([mtime, size, inode]) of the
+'ansible_collections' dir and each namespace dir, and the stamps of each collection
+dir and the files a collection is loaded from (MANIFEST.json, galaxy.yml and
+meta/.galaxy_install_info, null if missing):
+
+    {"version": 2,
+     "stamp": [1559143431.0, 4096, 1311],
+     "namespaces": {"alikins": {"stamp": [1559143431.0, 4096, 1312],
+                                "collections": {"collection_inspect": {"stamp": [[1559143431.0, 4096, 1313],
+                                                                                 [1559143431.0, 912, 1314],
+                                                                                 null,
+                                                                                 [1559143431.0, 61, 1315]],
+                                                                       "version": "1.0.0",
+                                                                       "dependencies": {}}}}}}
+
+A namespace or collection whose stamp matches the index is not listed or loaded
+again. Anything else (a new, changed or missing entry) is looked at the usual way
+and the index is updated. The inode changes when an install swaps in a new
+collection dir, and the file stamps change when a file is edited in place (which
+doesn't change the mtime of its dir), so neither is missed if the dir mtime
+happens to come out the same.
+
+The index is only an optimization. It is rewritten atomically and any failure
+to read or write it is ignored.
+'''
+
+import json
+import logging
+import os
+import tempfile
+
+from ansible_galaxy.config.defaults import COLLECTIONS_PYTHON_NAMESPACE
+from ansible_galaxy import collection_artifact_manifest
+from ansible_galaxy import collection_info
+from ansible_galaxy import installed_namespaces_db
+from ansible_galaxy import repository
+from ansible_galaxy import requirements
+from ansible_galaxy.models.galaxy_namespace import GalaxyNamespace
+from ansible_galaxy.models.repository import Repository
+from ansible_galaxy.models.repository_spec import RepositorySpec
+
+log = logging.getLogger(__name__)
+
+INDEX_FILENAME = '.mazer-installed-index.json'
+INDEX_FORMAT_VERSION = 2
+
+# The files in a collection dir that repository.load_from_dir() loads it from
+COLLECTION_STAMP_FILES = (collection_artifact_manifest.COLLECTION_MANIFEST_FILENAME,
+                          collection_info.COLLECTION_INFO_FILENAME,
+                          'meta/.galaxy_install_info')
+
+
+def index_path(collections_path):
+    return os.path.join(collections_path, INDEX_FILENAME)
+
+
+def _stamp(path):
+    '''[mtime, size, inode] of path, or None if it isn't there'''
+    try:
+        path_stat = os.stat(path)
+    except OSError:
+        return None
+
+    return [path_stat.st_mtime, path_stat.st_size, path_stat.st_ino]
+
+
+def _collection_stamp(collection_path):
+    '''The stamps of collection_path and the COLLECTION_STAMP_FILES in it, or None if it isn't there'''
+    dir_stamp = _stamp(collection_path)
+
+    if dir_stamp is None:
+        return None
+
+    return [dir_stamp] + [_stamp(os.path.join(collection_path, filename)) for filename in COLLECTION_STAMP_FILES]
+
+
+def _visible(dir_entries):
+    # skip dot files and dirs (tmp files, in progress installs, etc)
+    return sorted([x for x in dir_entries if not x.startswith('.')])
+
+
+def _empty_index():
+    return {'version': INDEX_FORMAT_VERSION,
+            'stamp': None,
+            'namespaces': {}}
+
+
+def load(collections_path):
+    '''Load the index for collections_path, or return an empty index if there isn't a usable one'''
+    try:
+        with open(index_path(collections_path), 'r') as index_fd:
+            index_data = json.load(index_fd)
+    except (EnvironmentError, ValueError) as e:
+        log.debug('No usable installed repository index for %s: %s', collections_path, e)
+        return _empty_index()
+
+    if not isinstance(index_data, dict) or index_data.get('version', None) != INDEX_FORMAT_VERSION:
+        log.debug('Ignoring the installed repository index for %s with an unknown format', collections_path)
+        return _empty_index()
+
+    return index_data
+
+
+def save(collections_path, index_data):
+    '''Atomically replace the index for collections_path with index_data'''
+    if not os.path.isdir(collections_path):
+        return False
+
+    try:
+        index_fd, tmp_path = tempfile.mkstemp(dir=collections_path, prefix='.tmp-', suffix=INDEX_FILENAME)
+        with os.fdopen(index_fd, 'w') as index_fo:
+            json.dump(index_data, index_fo)
+        os.rename(tmp_path, index_path(collections_path))
+    except (EnvironmentError, TypeError, ValueError) as e:
+        # ie, a global collections_path we can read but not write
+        log.debug('Unable to save the installed repository index for %s: %s', collections_path, e)
+        return False
+
+    return True
+
+
+def repository_to_entry(repository_, stamp):
+    dependencies = {}
+    for requirement in repository_.requirements:
+        req_spec = requirement.requirement_spec
+        req_label = req_spec.spec_string or '%s.%s' % (req_spec.namespace, req_spec.name)
+        dependencies[req_label] = str(req_spec.version_spec)
+
+    version = repository_.repository_spec.version
+
+    return {'stamp': stamp,
+            'version': str(version) if version else None,
+            'dependencies': dependencies}
+
+
+def repository_from_entry(entry, namespace, name, namespace_path):
+    repository_spec = RepositorySpec(namespace=namespace,
+                                     name=name,
+                                     version=entry.get('version', None))
+
+    requirements_list = requirements.from_dependencies_dict(entry.get('dependencies', None) or {},
+                                                            repository_spec=repository_spec)
+
+    return Repository(repository_spec=repository_spec,
+                      path=os.path.join(namespace_path, name),
+                      installed=True,
+                      requirements=requirements_list)
+
+
+def _namespace_entries(collections_path, index_data):
+    '''Update index_data['namespaces'] to match the namespace dirs if needed. Return True if it changed'''
+    ansible_collections_path = os.path.join(collections_path, COLLECTIONS_PYTHON_NAMESPACE)
+    stamp = _stamp(ansible_collections_path)
+
+    if stamp is not None and stamp == index_data.get('stamp', None):
+        return False
+
+    namespace_entries = index_data.get('namespaces', None) or {}
+    index_data['namespaces'] = \
+        dict([(namespace, namespace_entries.get(namespace, None) or {'stamp': None, 'collections': {}})
+              for namespace in _visible(installed_namespaces_db.get_namespace_paths(collections_path))])
+    index_data['stamp'] = stamp
+
+    return True
+
+
+def _collection_entries(namespace_path, namespace_entry):
+    '''Update namespace_entry['collections'] to match the collection dirs if needed. Return True if it changed'''
+    stamp = _stamp(namespace_path)
+
+    if stamp is not None and stamp == namespace_entry.get('stamp', None):
+        return False
+
+    collection_entries = namespace_entry.get('collections', None) or {}
+    namespace_entry['collections'] = \
+        dict([(name, collection_entries.get(name, None))
+              for name in _visible(repository.get_repository_paths(namespace_path))])
+    namespace_entry['stamp'] = stamp
+
+    return True
+
+
+def installed_repository_iterator(galaxy_context, namespace_match_filter=None):
+    '''For each repository in galaxy_context.collections_path, yield the Repository
+
+    Repositories whose dirs have not changed since they were indexed are built from
+    the index instead of loaded from disk. The index is saved when the iterator finishes
+    if anything changed.'''
+    collections_path = galaxy_context.collections_path
+
+    index_data = load(collections_path)
+
+    changed = _namespace_entries(collections_path, index_data)
+
+    try:
+        for namespace in sorted(index_data['namespaces']):
+            namespace_path = os.path.join(collections_path, COLLECTIONS_PYTHON_NAMESPACE, namespace)
+
+            if namespace_match_filter and \
+                    not namespace_match_filter(GalaxyNamespace(namespace=namespace, path=namespace_path)):
+                continue
+
+            namespace_entry = index_data['namespaces'][namespace]
+
+            changed = _collection_entries(namespace_path, namespace_entry) or changed
+
+            for name in sorted(namespace_entry['collections']):
+                entry = namespace_entry['collections'][name]
+                stamp = _collection_stamp(os.path.join(namespace_path, name))
+
+                if entry and stamp is not None and stamp == entry.get('stamp', None):
+                    if entry.get('not_a_repository', False):
+                        continue
+
+                    yield repository_from_entry(entry, namespace, name, namespace_path)
+                    continue
+
+                repository_ = repository.load_from_dir(collections_path,
+                                                       namespace_path=namespace_path,
+                                                       namespace=namespace,
+                                                       name=name,
+                                                       installed=True)
+
+                if not repository_:
+                    # remember this isn't a repository (ie, a file) so we don't look again
+                    namespace_entry['collections'][name] = {'stamp': stamp, 'not_a_repository': True}
+                    changed = True
+                    continue
+
+                namespace_entry['collections'][name] = repository_to_entry(repository_, stamp)
+                changed = True
+
+                yield repository_
+    finally:
+        if changed:
+            save(collections_path, index_data)
+
+
+def add(galaxy_context, installed_repository):
+    '''Update the index for a just installed repository'''
+    collections_path = galaxy_context.collections_path
+    repository_spec = installed_repository.repository_spec
+
+    index_data = load(collections_path)
+
+    _namespace_entries(collections_path, index_data)
+
+    namespace_entry = index_data['namespaces'].get(repository_spec.namespace, None)
+
+    # the namespace dir isn't there?
+    if namespace_entry is None:
+        return save(collections_path, index_data)
+
+    namespace_path = os.path.join(collections_path, COLLECTIONS_PYTHON_NAMESPACE, repository_spec.namespace)
+
+    _collection_entries(namespace_path, namespace_entry)
+
+    if repository_spec.name in namespace_entry['collections']:
+        stamp = _collection_stamp(os.path.join(namespace_path, repository_spec.name))
+        namespace_entry['collections'][repository_spec.name] = repository_to_entry(installed_repository, stamp)
+
+    return save(collections_path, index_data)
+
+
+def remove(galaxy_context, installed_repository):
+    '''Update the index for a just removed repository'''
+    collections_path = galaxy_context.collections_path
+    repository_spec = installed_repository.repository_spec
+
+    index_data = load(collections_path)
+
+    _namespace_entries(collections_path, index_data)
+
+    namespace_entry = index_data['namespaces'].get(repository_spec.namespace, None)
+
+    if namespace_entry is not None:
+        namespace_path = os.path.join(collections_path, COLLECTIONS_PYTHON_NAMESPACE, repository_spec.namespace)
+        _collection_entries(namespace_path, namespace_entry)
+
+    return save(collections_path, index_data)
@@ -31,12 +31,15 @@ log = logging.getLogger(__name__)
 class GalaxyContext(object):
     ''' Keeps global galaxy info '''
 
-    def __init__(self, collections_path=None, server=None):
+    def __init__(self, collections_path=None, server=None, options=None):
         self.server = server or {'url': None,
                                  'ignore_certs': False,
                                  'api_key': None}
         self.collections_path = collections_path
 
+        # runtime options from the 'options' section of the config
+        self.options = options or {}
+
     def __repr__(self):
-        return 'GalaxyContext(collections_path=%s, server=%s)' % \
-            (self.collections_path, self.server)
+        return 'GalaxyContext(collections_path=%s, server=%s, options=%s)' % \
+            (self.collections_path, self.server, self.options)
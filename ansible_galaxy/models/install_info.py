@@ -18,11 +18,18 @@ class InstallInfo(object):
     version = attr.ib(type=semantic_version.Version, default=None,
                       converter=convert_string_to_semver)
 
+    # Where a collection installed from Galaxy was downloaded from, and the
+    # sha256 of that artifact. Used to write frozen collections lockfiles.
+    download_url = attr.ib(default=None)
+    artifact_sha256 = attr.ib(default=None)
+
     @classmethod
-    def from_version_date(cls, version, install_datetime):
+    def from_version_date(cls, version, install_datetime, download_url=None, artifact_sha256=None):
         inst = cls(version=version,
                    install_date_iso=install_datetime,
-                   install_date=install_datetime.strftime('%c'))
+                   install_date=install_datetime.strftime('%c'),
+                   download_url=download_url,
+                   artifact_sha256=artifact_sha256)
         return inst
 
     def to_dict_version_strings(self):
@@ -31,6 +38,11 @@ class InstallInfo(object):
         if data.get('verison', '') is None:
             del data['version']
 
+        # Only saved for collections installed from Galaxy
+        for key in ('download_url', 'artifact_sha256'):
+            if data.get(key, None) is None:
+                del data[key]
+
         # semantic_version.Version isnt yaml-able, so build a dict with
         # the Version replaced with a str version
         ver = data.get('version', '')
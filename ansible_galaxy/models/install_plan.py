@@ -0,0 +1,24 @@
+import logging
+
+import attr
+
+from ansible_galaxy.models.repository_spec import RepositorySpec
+from ansible_galaxy.models.requirement import Requirement
+
+log = logging.getLogger(__name__)
+
+
+@attr.s(frozen=True)
+class InstallPlan(object):
+    '''A Requirement that has been found and resolved to a RepositorySpec, but is not fetched or installed yet.
+
+    The fetcher and find_results are what install.fetch() needs to download the artifact. already_installed
+    is the list of installed Repository objects that would be replaced (via --force) by this install.'''
+
+    requirement = attr.ib(type=Requirement)
+    repository_spec = attr.ib(type=RepositorySpec)
+
+    fetcher = attr.ib(cmp=False)
+    find_results = attr.ib(factory=dict, cmp=False)
+
+    already_installed = attr.ib(factory=list, cmp=False)
@@ -13,6 +13,8 @@ class FetchMethods(object):
     LOCAL_FILE = 'LOCAL_FILE'
     REMOTE_URL = 'REMOTE_URL'
     GALAXY_URL = 'GALAXY_URL'
+    # A collection from Galaxy whose version and download url are already known (ie, from a frozen lockfile)
+    GALAXY_FROZEN = 'GALAXY_FROZEN'
     EDITABLE = 'EDITABLE'
 
 
@@ -33,6 +33,12 @@ class RequirementSpec(object):
     # If created from a parsed string, spec_string is copy of the full string
     spec_string = attr.ib(default=None, cmp=False)
 
+    # The expected sha256 of the artifact at 'src', ie from a frozen collections lockfile
+    artifact_sha256 = attr.ib(default=None, cmp=False)
+
+    # The exact semantic_version.Version locked in a frozen collections lockfile
+    frozen_version = attr.ib(type=semantic_version.Version, default=None, cmp=False)
+
     @property
     def label(self):
         return '%s.%s,%s' % (self.namespace, self.name, str(self.version_spec))
@@ -65,5 +71,7 @@ class RequirementSpec(object):
                        scm=data.get('scm', None),
                        spec_string=data.get('spec_string', None),
                        src=data.get('src', None),
+                       artifact_sha256=data.get('artifact_sha256', None),
+                       frozen_version=data.get('frozen_version', None),
                        )
         return instance
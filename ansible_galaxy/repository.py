@@ -27,6 +27,29 @@ def load(data_or_file_object):
     return repository_data
 
 
+def get_repository_paths(namespace_path):
+    # TODO: abstract this a bit?  one to make it easier to mock, but also
+    #       possibly to prepare for nested dirs, multiple paths, various
+    #       filters/whitelist/blacklist/excludes, caching, or respecting
+    #       fs ordering, etc
+    #
+    # Note: see installed_repository_index_file for the caching of the results
+    #       with invalidation based on dir and metadata file stats
+    try:
+        # TODO: filter on any rules for what a namespace path looks like
+        #       may one being 'somenamespace.somename' (a dot sep ns and name)
+        #
+        # skip hidden dirs, ie the '.name.staging-*' dirs of in progress installs
+        repository_paths = [x for x in os.listdir(namespace_path) if not x.startswith('.')]
+    except OSError as e:
+        log.exception(e)
+        log.warning('The namespace path %s did not exist so no repositories were found.',
+                    namespace_path)
+        repository_paths = []
+
+    return repository_paths
+
+
 def load_from_archive(repository_archive, namespace=None, installed=True):
     repo_tarfile = repository_archive.tar_file
     archive_path = repository_archive.info.archive_path
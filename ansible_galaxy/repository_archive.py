@@ -1,20 +1,33 @@
 import datetime
 import logging
 import os
+import shutil
 import tarfile
+import threading
+import time
+import uuid
+
+import requests
 
 from ansible_galaxy import archive
 from ansible_galaxy import collection_members
+from ansible_galaxy import download
 from ansible_galaxy import exceptions
+from ansible_galaxy import http_transfer
 from ansible_galaxy import install_info
 from ansible_galaxy.models.collection_artifact_archive import CollectionArtifactArchiveInfo
 from ansible_galaxy.models.collection_artifact_archive import CollectionArtifactArchive
 from ansible_galaxy.models.repository_spec import FetchMethods
 from ansible_galaxy.models.install_info import InstallInfo
 from ansible_galaxy.models.installation_results import InstallationResults
+from ansible_galaxy.utils import chksums
 
 log = logging.getLogger(__name__)
 
+# A staging dir that has not been modified in this long is assumed to be left behind
+# by an install that died, not one that another mazer process is still extracting into.
+STALE_STAGING_SECONDS = 60 * 60
+
 
 # TODO: extract_archive_to_dir may not be needed now (was for roles)
 def extract(repository_spec,
@@ -33,28 +46,13 @@ def extract(repository_spec,
 
     log.debug('About to extract "%s" to collections_path %s', repository_spec, collections_path)
 
-    tar_members = tar_file.members
-
     # TODO: need to support deleting all content in the dirs we are targetting
     #       first (and/or delete the top dir) so that we clean up any files not
     #       part of the content. At the moment, this will add or update the files
     #       that are in the archive, but it will not delete files on the fs that are
     #       not in the archive
-    files_to_extract = []
-    for member in tar_members:
-        rel_path = member.name
-
-        extract_to_filename_path = os.path.join(extract_archive_to_dir, rel_path)
-
-        files_to_extract.append({
-            'archive_member': member,
-            # Note: for trad roles, we are extract the top level of the archive into
-            #       a sub path of the destination
-            'dest_dir': extract_archive_to_dir,
-            'dest_filename': extract_to_filename_path,
-            'force_overwrite': force_overwrite})
-
-    file_extractor = archive.extract_files(tar_file, files_to_extract)
+    file_extractor = archive.extract_members(tar_file, extract_archive_to_dir,
+                                             force_overwrite=force_overwrite)
 
     installed_paths = [x for x in file_extractor]
 
@@ -91,18 +89,20 @@ def load_editable_archive_info(archive_path, repository_spec):
     return archive_info, None
 
 
-def load_tarfile_archive_info(archive_path, repository_spec):
+def load_tarfile_archive_info(archive_path, repository_spec, fileobj=None):
+    '''Open the artifact at archive_path, or in the file object fileobj (ie, downloaded into memory)'''
 
     # if not tarfile.is_tarfile(archive_path):
     #    raise exceptions.GalaxyClientError("the file downloaded was not a tar.gz")
 
-    if archive_path.endswith('.gz'):
+    # An artifact in a file object doesn't have a name, but it is always a .tar.gz
+    if fileobj is not None or archive_path.endswith('.gz'):
         tar_flags = "r:gz"
     else:
         tar_flags = "r"
 
     try:
-        repository_tar_file = tarfile.open(archive_path, tar_flags)
+        repository_tar_file = tarfile.open(archive_path, tar_flags, fileobj=fileobj)
     except tarfile.TarError as e:
         log.exception(e)
         raise exceptions.GalaxyClientError("Error opening the tar file %s with flags: %s for repo: %s" %
@@ -114,20 +114,23 @@ def load_tarfile_archive_info(archive_path, repository_spec):
     return archive_info, repository_tar_file
 
 
-def load_archive_info(archive_path, repository_spec=None):
+def load_archive_info(archive_path, repository_spec=None, fileobj=None):
 
     # "installing" an existing dir as editable
     if repository_spec and repository_spec.fetch_method == FetchMethods.EDITABLE:
         return load_editable_archive_info(archive_path, repository_spec)
 
-    return load_tarfile_archive_info(archive_path, repository_spec)
+    return load_tarfile_archive_info(archive_path, repository_spec, fileobj=fileobj)
 
 
-def load_archive(archive_path, repository_spec=None):
-    '''Load the archive file at archive_path and return a CollectionRepositoryArtifactArchive'''
+def load_archive(archive_path, repository_spec=None, fileobj=None):
+    '''Load the archive file at archive_path and return a CollectionRepositoryArtifactArchive
+
+    If the archive is in a file object instead of a file (ie, it was downloaded into memory),
+    pass it as fileobj. archive_path can be None then.'''
     # To avoid opening the archive file twice, and since we have to open/load it to
     # get the archive_info, we also return it from load_archive_info
-    archive_info, tar_file = load_archive_info(archive_path, repository_spec)
+    archive_info, tar_file = load_archive_info(archive_path, repository_spec, fileobj=fileobj)
 
     repository_archive_ = CollectionArtifactArchive(info=archive_info,
                                                     tar_file=tar_file)
@@ -137,30 +140,23 @@ def load_archive(archive_path, repository_spec=None):
     return repository_archive_
 
 
-def install(repository_archive, repository_spec, destination_info, display_callback):
-    log.debug('installing/extracting repo archive %s to destination %s', repository_archive, destination_info)
-
-    # An editable install is a symlink to existing dir, so nothing to extract
-    if destination_info.editable:
-        all_installed_files = []
-    else:
-        log.debug('destination_info.force_overrite: %s', destination_info.force_overwrite)
-
-        all_installed_files = extract(repository_spec,
-                                      collections_path=destination_info.collections_path,
-                                      extract_archive_to_dir=destination_info.path,
-                                      tar_file=repository_archive.tar_file,
-                                      display_callback=display_callback)
+def _save_install_info(repository_spec, destination_info, all_installed_files, install_info_path=None,
+                       download_url=None, artifact_sha256=None):
+    '''Write the .galaxy_install_info and return the InstallationResults
 
+    install_info_path is where to write it if not destination_info.install_info_path, ie
+    in a staging dir.'''
     install_datetime = datetime.datetime.utcnow()
 
     install_info_ = InstallInfo.from_version_date(repository_spec.version,
-                                                  install_datetime=install_datetime)
+                                                  install_datetime=install_datetime,
+                                                  download_url=download_url,
+                                                  artifact_sha256=artifact_sha256)
 
     # TODO: this save will need to be moved to a step later. after validating install?
     # The to_dict_version_strings is to convert the un-yaml-able semantic_version.Version to a string
     install_info.save(install_info_.to_dict_version_strings(),
-                      destination_info.install_info_path)
+                      install_info_path or destination_info.install_info_path)
 
     installation_results = InstallationResults(install_info_path=destination_info.install_info_path,
                                                install_info=install_info_,
@@ -168,3 +164,353 @@ def install(repository_archive, repository_spec, destination_info, display_callb
                                                installed_datetime=install_datetime,
                                                installed_files=all_installed_files)
     return installation_results
+
+
+def _sibling_path(destination_info, suffix):
+    '''A uniq, hidden path next to destination_info.path, ie '.ntp.staging-<uuid>'
+
+    Being in the same dir means it is on the same filesystem so it can be renamed into place.
+    The leading '.' means it is skipped when looking for installed repositories.'''
+    namespace_path, name = os.path.split(destination_info.path)
+    return os.path.join(namespace_path, '.%s.%s-%s' % (name, suffix, uuid.uuid4().hex))
+
+
+def _create_staging_dir(destination_info):
+    namespace_path = os.path.dirname(destination_info.path)
+
+    if not os.path.isdir(namespace_path):
+        try:
+            os.makedirs(namespace_path)
+        except OSError:
+            if not os.path.isdir(namespace_path):
+                raise
+
+    staging_path = _sibling_path(destination_info, 'staging')
+
+    # not tempfile.mkdtemp() since that is mode 0700 and this will be the installed dir
+    os.mkdir(staging_path)
+
+    log.debug('Created staging dir %s for %s', staging_path, destination_info.path)
+
+    return staging_path
+
+
+def _remove_staging_path(staging_path):
+    log.debug('Removing the staging path %s', staging_path)
+
+    try:
+        if os.path.islink(staging_path):
+            os.unlink(staging_path)
+        else:
+            shutil.rmtree(staging_path)
+    except EnvironmentError as e:
+        log.warning('Unable to remove the staging path %s: %s', staging_path, e)
+
+
+def remove_in_background(path):
+    '''Remove the dir at path in a thread and return the thread'''
+    remove_thread = threading.Thread(target=shutil.rmtree,
+                                     args=(path,),
+                                     kwargs={'ignore_errors': True},
+                                     name='remove-%s' % os.path.basename(path))
+    remove_thread.start()
+
+    return remove_thread
+
+
+def _sibling_paths(destination_info, suffix):
+    '''The existing _sibling_path()s of destination_info.path with suffix, newest first'''
+    namespace_path, name = os.path.split(destination_info.path)
+    prefix = '.%s.%s-' % (name, suffix)
+
+    try:
+        sibling_names = [x for x in os.listdir(namespace_path) if x.startswith(prefix)]
+    except OSError:
+        return []
+
+    sibling_paths = [os.path.join(namespace_path, x) for x in sibling_names]
+
+    return sorted(sibling_paths, key=lambda x: os.lstat(x).st_mtime, reverse=True)
+
+
+def recover_interrupted(destination_info, staging_path=None):
+    '''Clean up after an install of destination_info.path that was interrupted
+
+    If the install was interrupted between moving the previous install out of the way and
+    moving the new one into place, the previous install is moved back. Any other old dirs
+    left behind are removed, as are staging dirs (except staging_path, the one in use) that
+    have not been modified in STALE_STAGING_SECONDS, since a newer one may belong to another
+    install of the same collection that is still running.'''
+    path = destination_info.path
+
+    old_paths = _sibling_paths(destination_info, 'old')
+
+    if old_paths and not os.path.lexists(path):
+        log.warning('Restoring %s from %s, left by an interrupted install', path, old_paths[0])
+
+        os.rename(old_paths[0], path)
+        old_paths = old_paths[1:]
+
+    stale_before = time.time() - STALE_STAGING_SECONDS
+
+    staging_paths = [x for x in _sibling_paths(destination_info, 'staging')
+                     if x != staging_path and os.lstat(x).st_mtime < stale_before]
+
+    for leftover_path in old_paths + staging_paths:
+        log.info('Removing %s, left by an interrupted install', leftover_path)
+        _remove_staging_path(leftover_path)
+
+
+def swap_into_place(staging_path, destination_info):
+    '''Rename the fully populated staging_path to destination_info.path
+
+    If something is already installed there (and force_overwrite is set) it is renamed out of
+    the way first and then removed in the background. Two renames can not replace a dir
+    atomically, so for a moment nothing is at the installed path. If the second rename fails,
+    the previous install is renamed back. If the process dies in between, the previous install
+    is left in a '.old-' dir next to it, and recover_interrupted() (run here, by the next
+    install) moves it back.'''
+    recover_interrupted(destination_info, staging_path=staging_path)
+
+    path = destination_info.path
+
+    old_path = None
+
+    if os.path.lexists(path):
+        if not destination_info.force_overwrite:
+            message = "The Galaxy content %s appears to already exist." % path
+            raise exceptions.GalaxyClientError(message)
+
+        old_path = _sibling_path(destination_info, 'old')
+
+        log.debug('Moving the previously installed %s to %s', path, old_path)
+        os.rename(path, old_path)
+
+    try:
+        os.rename(staging_path, path)
+    except OSError:
+        # put the previous install back
+        if old_path:
+            os.rename(old_path, path)
+        raise
+
+    log.debug('Moved staging path %s to %s', staging_path, path)
+
+    if old_path:
+        # an editable install is a symlink
+        if os.path.islink(old_path):
+            os.unlink(old_path)
+        else:
+            remove_in_background(old_path)
+
+    return path
+
+
+def _staged(staging_path, destination_info, installed_files):
+    '''Map the paths of files extracted into staging_path to where they will be installed'''
+    return [os.path.join(destination_info.path, os.path.relpath(installed_file, staging_path))
+            for installed_file in installed_files]
+
+
+def _staging_install_info_path(staging_path, destination_info):
+    return os.path.join(staging_path, os.path.relpath(destination_info.install_info_path, destination_info.path))
+
+
+def install(repository_archive, repository_spec, destination_info, display_callback,
+            download_url=None, artifact_sha256=None):
+    '''Install repository_archive to destination_info.path
+
+    download_url and artifact_sha256 are where the archive came from, if anywhere, and
+    are saved in the .galaxy_install_info'''
+    log.debug('installing/extracting repo archive %s to destination %s', repository_archive, destination_info)
+
+    # An editable install is a symlink to existing dir, so nothing to extract
+    if destination_info.editable:
+        real_path = os.path.realpath(repository_archive.info.archive_path)
+
+        # The editable fetch creates the symlink unless something was already installed
+        if os.path.realpath(destination_info.path) != real_path:
+            staging_path = _sibling_path(destination_info, 'staging')
+            os.symlink(real_path, staging_path)
+
+            try:
+                swap_into_place(staging_path, destination_info)
+            except (OSError, exceptions.GalaxyError):
+                _remove_staging_path(staging_path)
+                raise
+
+        return _save_install_info(repository_spec, destination_info, [])
+
+    log.debug('destination_info.force_overrite: %s', destination_info.force_overwrite)
+
+    # Extract to a staging dir next to the install path, then rename it into place
+    staging_path = _create_staging_dir(destination_info)
+
+    try:
+        staged_files = extract(repository_spec,
+                               collections_path=destination_info.collections_path,
+                               extract_archive_to_dir=staging_path,
+                               tar_file=repository_archive.tar_file,
+                               display_callback=display_callback)
+
+        installation_results = \
+            _save_install_info(repository_spec, destination_info,
+                               _staged(staging_path, destination_info, staged_files),
+                               install_info_path=_staging_install_info_path(staging_path, destination_info),
+                               download_url=download_url,
+                               artifact_sha256=artifact_sha256)
+
+        swap_into_place(staging_path, destination_info)
+    except Exception:
+        _remove_staging_path(staging_path)
+        raise
+
+    return installation_results
+
+
+def stage_from_url(download_url, repository_spec, destination_info,
+                   validate_certs=True, expected_sha256=None, pool_size=None, transfer_policy=None):
+    '''Download the artifact at download_url and extract it to a staging dir while it downloads
+
+    The download is read as a tar stream ('r|gz'), so the artifact is never saved to
+    disk and is only decompressed once. The sha256 of the artifact is computed as it
+    is read. If it does not match expected_sha256, the extracted files are removed and
+    a GalaxyArtifactChksumError is raised.
+
+    A stream can not be resumed part way through, so if the connection drops, the
+    partly extracted files are removed and the download starts over, up to
+    transfer_policy.retries times.
+
+    Returns a dict with the 'staging_path', the 'staged_files' in it, the 'artifact_sha256'
+    and the 'download_url', to pass to install_staged().'''
+
+    # TODO: move to content info validate step in install states?
+    if not repository_spec.namespace:
+        # TODO: better error
+        raise exceptions.GalaxyError('While installing a collection , no namespace was found. Try providing one with --namespace')
+
+    transfer_policy = transfer_policy or http_transfer.TransferPolicy()
+
+    attempt = 0
+
+    while True:
+        try:
+            return _stage_from_url(download_url, repository_spec, destination_info,
+                                   validate_certs=validate_certs,
+                                   expected_sha256=expected_sha256,
+                                   pool_size=pool_size,
+                                   transfer_policy=transfer_policy)
+        except download.RAW_READ_ERRORS as e:
+            if attempt >= transfer_policy.retries:
+                raise exceptions.GalaxyDownloadError('Error extracting the artifact for %s while downloading it: %s' %
+                                                     (repository_spec.label, e),
+                                                     url=download_url)
+
+            attempt += 1
+            log.warning('The download of %s was interrupted (%s), starting over (%s of %s)',
+                        download_url, e, attempt, transfer_policy.retries)
+
+
+def _stage_from_url(download_url, repository_spec, destination_info,
+                    validate_certs, expected_sha256, pool_size, transfer_policy):
+    log.debug('About to stream "%s" from %s to %s', repository_spec, download_url, destination_info.path)
+
+    limits = http_transfer.download_limits(download_url, transfer_policy)
+
+    # wait for a connection to the host to be allowed
+    slot = limits.connection()
+
+    try:
+        response = download.open_url(download_url, validate_certs=validate_certs, pool_size=pool_size,
+                                     transfer_policy=transfer_policy, slot=slot)
+    except requests.RequestException as e:
+        slot.release()
+        log.exception(e)
+        raise exceptions.GalaxyDownloadError(e, url=download_url)
+
+    artifact_reader = chksums.Sha256Reader(download.ThrottledReader(response.raw, limits))
+
+    staging_path = _create_staging_dir(destination_info)
+
+    try:
+        tar_file = tarfile.open(fileobj=artifact_reader, mode='r|gz')
+
+        staged_files = list(archive.extract_stream_files(tar_file, staging_path))
+
+        # the rest of the gzip stream (padding, trailer) is part of the artifact sha256
+        artifact_reader.read_to_end()
+    except download.RAW_READ_ERRORS:
+        # the caller decides whether to start over
+        _remove_staging_path(staging_path)
+        raise
+    except (tarfile.TarError, EnvironmentError, EOFError) as e:
+        log.exception(e)
+        _remove_staging_path(staging_path)
+        raise exceptions.GalaxyDownloadError('Error extracting the artifact for %s while downloading it: %s' %
+                                             (repository_spec.label, e),
+                                             url=download_url)
+    except Exception:
+        _remove_staging_path(staging_path)
+        raise
+    finally:
+        response.close()
+        slot.release()
+
+    artifact_sha256 = artifact_reader.hexdigest()
+
+    log.debug('Extracted %s files from %s (sha256: %s) to %s',
+              len(staged_files), download_url, artifact_sha256, staging_path)
+
+    if expected_sha256 and artifact_sha256 != expected_sha256:
+        _remove_staging_path(staging_path)
+        msg = 'The sha256 of the artifact for %s was %s but %s was expected' % \
+            (repository_spec.label, artifact_sha256, expected_sha256)
+        raise exceptions.GalaxyArtifactChksumError(msg,
+                                                   url=download_url,
+                                                   expected=expected_sha256,
+                                                   actual=artifact_sha256)
+
+    return {'staging_path': staging_path,
+            'staged_files': staged_files,
+            'artifact_sha256': artifact_sha256,
+            'download_url': download_url}
+
+
+def discard_staged(staged):
+    '''Remove the staging dir of a stage_from_url() that is not going to be installed'''
+    if os.path.lexists(staged['staging_path']):
+        _remove_staging_path(staged['staging_path'])
+
+
+def install_staged(staged, repository_spec, destination_info):
+    '''Install the collection extracted by stage_from_url() by swapping its staging dir into place'''
+    staging_path = staged['staging_path']
+
+    try:
+        installation_results = \
+            _save_install_info(repository_spec, destination_info,
+                               _staged(staging_path, destination_info, staged['staged_files']),
+                               install_info_path=_staging_install_info_path(staging_path, destination_info),
+                               download_url=staged['download_url'],
+                               artifact_sha256=staged['artifact_sha256'])
+
+        swap_into_place(staging_path, destination_info)
+    except Exception:
+        _remove_staging_path(staging_path)
+        raise
+
+    return installation_results
+
+
+def install_from_url(download_url, repository_spec, destination_info, display_callback,
+                     validate_certs=True, expected_sha256=None, pool_size=None, transfer_policy=None):
+    '''Download the artifact at download_url, extracting it while it downloads, and install it
+
+    See stage_from_url()'''
+    staged = stage_from_url(download_url, repository_spec, destination_info,
+                            validate_certs=validate_certs,
+                            expected_sha256=expected_sha256,
+                            pool_size=pool_size,
+                            transfer_policy=transfer_policy)
+
+    return install_staged(staged, repository_spec, destination_info)
@@ -0,0 +1,326 @@
+'''Resolve a set of collection requirements to one version of each collection
+
+resolve() looks for one version of each required collection (and of each of their
+dependencies) that satisfies every version spec that requires it. It picks a version
+for one collection at a time, starting with the collection that has the fewest
+versions left to choose from (the most constrained one). When a choice leads to a
+collection that no version can satisfy, it backtracks and tries the next version.
+
+The available versions (a VersionIndex) and dependencies of a collection come from a 'candidates'
+object. GalaxyCandidates gets them from the Galaxy API, plus any already installed versions,
+so an installed collection that Galaxy does not have still counts. Since the most constrained
+collections are tried first, and dependencies are only looked up for the versions
+that are tried, the number of API requests needed stays close to the number of
+collections being installed.
+
+If nothing works, a GalaxyResolutionError explaining the conflicts is raised
+instead of installing some of the requirements.
+'''
+
+import logging
+
+from concurrent import futures
+
+from six.moves.urllib.parse import quote as urlquote
+
+from ansible_galaxy import exceptions
+from ansible_galaxy import requirements
+from ansible_galaxy.utils.version import VersionIndex
+
+log = logging.getLogger(__name__)
+
+# Give up instead of trying every combination of a badly tangled set of requirements
+MAX_RESOLVE_STEPS = 10000
+
+# The number of conflicts to show in a GalaxyResolutionError message
+MAX_CONFLICTS_SHOWN = 10
+
+
+class GalaxyCandidates(object):
+    '''The available versions of collections, and their dependencies, from the Galaxy API
+
+    The versions list of each collection is requested once. The dependencies of a
+    version come from the 'metadata' in the versions list if it is included, or else
+    from the CollectionVersion detail. The GalaxyAPI remembers the requests it made,
+    so a find() using the same GalaxyAPI later does not request them again.
+
+    installed is a dict of (namespace, name) -> (version, dependencies dict) of the
+    installed collections. An installed version that is not in the Galaxy versions
+    list is added to the candidates too (see installed_only()).'''
+
+    def __init__(self, galaxy_api, concurrency=1, installed=None):
+        self.galaxy_api = galaxy_api
+        self.concurrency = max(1, int(concurrency or 1))
+        self.installed = installed or {}
+
+        # (namespace, name) -> VersionIndex of the CollectionVersion data
+        self._collection_versions = {}
+
+    def _load_versions(self, namespace, name):
+        versions_list_url = '{base_api_url}/v2/collections/{namespace}/{name}/versions/'.format(base_api_url=self.galaxy_api.base_api_url,
+                                                                                                namespace=urlquote(namespace),
+                                                                                                name=urlquote(name))
+
+        try:
+            collection_version_list_data = self.galaxy_api.get_object(versions_list_url,
+                                                                      page_size=self.galaxy_api.page_size)
+        except exceptions.GalaxyRestAPIError as exc:
+            if getattr(exc.response, 'status_code', None) != 404:
+                raise
+
+            log.debug('%s.%s was not found on %s', namespace, name, self.galaxy_api.api_server)
+            collection_version_list_data = []
+
+        collection_versions = VersionIndex()
+        for collection_version in collection_version_list_data or []:
+            try:
+                collection_versions.add(collection_version.get('version', None), data=collection_version)
+            except (TypeError, ValueError) as exc:
+                log.warning('Ignoring the invalid version of %s.%s: %s', namespace, name, exc)
+
+        if (namespace, name) in self.installed:
+            installed_version, installed_dependencies = self.installed[(namespace, name)]
+
+            if installed_version not in collection_versions:
+                log.debug('The installed %s.%s,%s is not on %s', namespace, name, installed_version, self.galaxy_api.api_server)
+
+                collection_versions.add(installed_version,
+                                        data={'version': str(installed_version),
+                                              'metadata': {'dependencies': installed_dependencies},
+                                              'installed_only': True})
+
+        return collection_versions
+
+    def version_index(self, namespace, name):
+        '''The VersionIndex of the available versions of namespace.name'''
+        key = (namespace, name)
+
+        if key not in self._collection_versions:
+            self._collection_versions[key] = self._load_versions(namespace, name)
+
+        return self._collection_versions[key]
+
+    def prefetch(self, keys):
+        '''Request the versions lists of all of the (namespace, name) keys at the same time'''
+        missing_keys = [key for key in keys if key not in self._collection_versions]
+
+        if len(missing_keys) < 2 or self.concurrency < 2:
+            return
+
+        executor = futures.ThreadPoolExecutor(max_workers=min(self.concurrency, len(missing_keys)))
+
+        try:
+            loaded = executor.map(lambda key: self._load_versions(*key), missing_keys)
+
+            for key, collection_versions in zip(missing_keys, loaded):
+                self._collection_versions[key] = collection_versions
+        finally:
+            executor.shutdown(wait=True)
+
+    def installed_only(self, namespace, name, version):
+        '''True if version of namespace.name is installed, but is not available from Galaxy'''
+        collection_version = self.version_index(namespace, name).data(version) or {}
+
+        return collection_version.get('installed_only', False)
+
+    def dependencies(self, namespace, name, version):
+        '''The 'dependencies' dict (collection label -> version spec string) of a version of namespace.name'''
+        collection_version = self.version_index(namespace, name).data(version) or {}
+
+        metadata = collection_version.get('metadata', None)
+
+        if metadata is None and collection_version.get('href', None):
+            collection_version_detail_data = self.galaxy_api.get_object(href=collection_version['href']) or {}
+            metadata = collection_version_detail_data.get('metadata', None)
+
+        return (metadata or {}).get('dependencies', None) or {}
+
+
+class _Conflict(Exception):
+    '''Raised inside the resolver when the choices made so far can not work'''
+    def __init__(self, reasons):
+        super(_Conflict, self).__init__(reasons)
+        self.reasons = reasons
+
+
+def _label(key):
+    return '%s.%s' % key
+
+
+def _required_by_label(required_by):
+    if not required_by:
+        return 'the requested collections'
+
+    return '%s.%s,%s' % required_by
+
+
+def _constraints_blurb(key_constraints):
+    return ', '.join(["'%s' (required by %s)" % (requirement_spec.version_spec, _required_by_label(required_by))
+                      for requirement_spec, required_by in key_constraints])
+
+
+def _no_match_reason(key, key_constraints, available_versions, pinned_version=None):
+    if pinned_version is not None:
+        return '%s,%s is installed, but does not match all of %s. Use --force to replace it.' % \
+            (_label(key), pinned_version, _constraints_blurb(key_constraints))
+
+    if not available_versions:
+        return '%s was not found (required by %s)' % \
+            (_label(key), ', '.join(sorted(set([_required_by_label(required_by) for _spec, required_by in key_constraints]))))
+
+    return 'No version of %s matches all of %s. The available versions are: %s' % \
+        (_label(key), _constraints_blurb(key_constraints), ', '.join([str(version) for version in available_versions]))
+
+
+def _matching_versions(key, key_constraints, candidates, preferred_versions, pinned_versions):
+    version_index = candidates.version_index(*key)
+
+    # newest first
+    matching_versions = list(reversed(version_index.filter(*[requirement_spec.version_spec
+                                                             for requirement_spec, _required_by in key_constraints])))
+
+    # ie, installed and not going to be replaced, so it's that or nothing
+    if key in pinned_versions:
+        return [version for version in matching_versions if version == pinned_versions[key]]
+
+    # ie, try the already installed version first
+    preferred_version = preferred_versions.get(key, None)
+    if preferred_version in matching_versions:
+        matching_versions.remove(preferred_version)
+        matching_versions.insert(0, preferred_version)
+
+    return matching_versions
+
+
+def _search(constraints, decided, candidates, preferred_versions, pinned_versions, provided, steps):
+    steps[0] += 1
+    if steps[0] > steps[1]:
+        raise exceptions.GalaxyResolutionError('Gave up resolving the collection dependencies after trying %s combinations of versions' %
+                                               steps[1])
+
+    undecided = sorted([key for key in constraints if key not in decided])
+
+    if not undecided:
+        return decided
+
+    candidates.prefetch(undecided)
+
+    choices = dict((key, _matching_versions(key, constraints[key], candidates, preferred_versions, pinned_versions))
+                   for key in undecided)
+
+    # The most constrained collection first, since it is the most likely to fail
+    key = min(undecided, key=lambda undecided_key: (len(choices[undecided_key]), undecided_key))
+
+    if not choices[key]:
+        available_versions = list(reversed(list(candidates.version_index(*key))))
+        raise _Conflict([_no_match_reason(key, constraints[key], available_versions, pinned_versions.get(key, None))])
+
+    log.debug('Choosing a version of %s from %s', _label(key), [str(version) for version in choices[key]])
+
+    reasons = []
+
+    for version in choices[key]:
+        required_by = key + (version,)
+
+        new_decided = dict(decided)
+        new_decided[key] = version
+
+        new_constraints = dict(constraints)
+
+        conflict_reason = None
+
+        dep_reqs = requirements.from_dependencies_dict(candidates.dependencies(key[0], key[1], version))
+
+        for dep_req in dep_reqs:
+            dep_req_spec = dep_req.requirement_spec
+            dep_key = (dep_req_spec.namespace, dep_req_spec.name)
+
+            # ie, something requested from a local artifact or an scm
+            if dep_key in provided:
+                continue
+
+            new_constraints[dep_key] = new_constraints.get(dep_key, ()) + ((dep_req_spec, required_by),)
+
+            if dep_key in new_decided and not dep_req_spec.version_spec.match(new_decided[dep_key]):
+                conflict_reason = '%s,%s requires %s \'%s\', but %s,%s was chosen for %s' % \
+                    (_label(key), version, _label(dep_key), dep_req_spec.version_spec,
+                     _label(dep_key), new_decided[dep_key], _constraints_blurb(constraints.get(dep_key, ())))
+                break
+
+        if conflict_reason:
+            log.debug('Backtracking from %s,%s: %s', _label(key), version, conflict_reason)
+            reasons.append(conflict_reason)
+            continue
+
+        try:
+            return _search(new_constraints, new_decided, candidates, preferred_versions, pinned_versions, provided, steps)
+        except _Conflict as conflict:
+            log.debug('Backtracking from %s,%s: %s', _label(key), version, conflict.reasons)
+            reasons.extend(conflict.reasons)
+
+    raise _Conflict(reasons)
+
+
+def resolve(requirements_list, candidates, preferred_versions=None, provided=None, max_steps=MAX_RESOLVE_STEPS,
+            pinned_versions=None):
+    '''Choose one version of each collection required by requirements_list or their dependencies
+
+    candidates provides the version_index() and dependencies() of each collection (ie, GalaxyCandidates).
+
+    preferred_versions is a dict of (namespace, name) -> version to try first if it matches
+    (ie, the already installed versions). pinned_versions is a dict of (namespace, name) -> the
+    only version of that collection that can be chosen (ie, the installed versions, if they are
+    not to be replaced). provided is a set of (namespace, name) of collections
+    that come from somewhere else (ie, a local artifact) whose versions are not resolved here.
+
+    Returns a dict of (namespace, name) -> {'version': semantic_version.Version,
+    'required_by': [(namespace, name, version) of the dependents, None for requirements_list]}
+
+    Raises GalaxyResolutionError if there is no set of versions that works.'''
+
+    preferred_versions = preferred_versions or {}
+    pinned_versions = pinned_versions or {}
+    provided = provided or set()
+
+    constraints = {}
+    for requirement in requirements_list:
+        requirement_spec = requirement.requirement_spec
+        key = (requirement_spec.namespace, requirement_spec.name)
+
+        constraints[key] = constraints.get(key, ()) + ((requirement_spec, None),)
+
+    try:
+        decided = _search(constraints, {}, candidates, preferred_versions, pinned_versions, provided, [0, max_steps])
+    except _Conflict as conflict:
+        # the same conflict can be found down more than one path
+        reasons = []
+        for reason in conflict.reasons:
+            if reason not in reasons:
+                reasons.append(reason)
+
+        msg_lines = ['Unable to find versions of the collections that satisfy all of the requirements:']
+        msg_lines.extend(['  - %s' % reason for reason in reasons[:MAX_CONFLICTS_SHOWN]])
+        if len(reasons) > MAX_CONFLICTS_SHOWN:
+            msg_lines.append('  ... and %s more' % (len(reasons) - MAX_CONFLICTS_SHOWN))
+
+        raise exceptions.GalaxyResolutionError('\n'.join(msg_lines), conflicts=reasons)
+
+    # Dependencies are found again for the final versions, instead of keeping the
+    # constraints around, to tell which collections required each one
+    required_by = dict((key, []) for key in decided)
+
+    for requirement in requirements_list:
+        requirement_spec = requirement.requirement_spec
+        required_by[(requirement_spec.namespace, requirement_spec.name)].append(None)
+
+    for key, version in sorted(decided.items()):
+        for dep_req in requirements.from_dependencies_dict(candidates.dependencies(key[0], key[1], version)):
+            dep_key = (dep_req.requirement_spec.namespace, dep_req.requirement_spec.name)
+
+            if dep_key in required_by:
+                required_by[dep_key].append(key + (version,))
+
+    log.debug('Resolved %s', ', '.join(['%s,%s' % (_label(key), version) for key, version in sorted(decided.items())]))
+
+    return dict((key, {'version': version, 'required_by': required_by[key]})
+                for key, version in decided.items())
@@ -22,21 +22,39 @@
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
+import itertools
 import logging
+import math
+import threading
 import uuid
 
+from concurrent import futures
+
 import requests
 
-from six.moves.urllib.parse import quote as urlquote
+from six.moves.urllib.parse import parse_qsl, quote as urlquote, urlencode, urlparse, urlunparse
 
+from ansible_galaxy import api_version_cache
 from ansible_galaxy import exceptions
+from ansible_galaxy import http_cache
+from ansible_galaxy import http_session
+from ansible_galaxy import http_transfer
 from ansible_galaxy import user_agent
+from ansible_galaxy.config import defaults
 
 log = logging.getLogger(__name__)
 http_log = logging.getLogger('%s.(http).(general)' % __name__)
 request_log = logging.getLogger('%s.(http).(request)' % __name__)
 response_log = logging.getLogger('%s.(http).(response)' % __name__)
 
+# server url -> threading.BoundedSemaphore limiting the requests in flight to that server
+_server_semaphores = {}
+_server_semaphores_lock = threading.Lock()
+
+# url -> the threading.Thread revalidating the stale cached response for that url
+_revalidations = {}
+_revalidations_lock = threading.Lock()
+
 
 def response_slug(response):
     # The slug we use to identify a request by method, url and request id
@@ -45,20 +63,115 @@ def response_slug(response):
     return slug
 
 
+def server_semaphore(server_url, max_concurrency=None):
+    '''Return the semaphore shared by every RestClient making requests to server_url
+
+    The first caller for a server_url decides the max_concurrency.'''
+    with _server_semaphores_lock:
+        if server_url not in _server_semaphores:
+            max_concurrency = max(1, int(max_concurrency or defaults.DEFAULT_API_CONCURRENCY))
+
+            log.debug('Allowing %s concurrent requests to %s', max_concurrency, server_url)
+
+            _server_semaphores[server_url] = threading.BoundedSemaphore(max_concurrency)
+
+        return _server_semaphores[server_url]
+
+
+def set_query_params(url, **params):
+    '''Return url with the query params in params added or replaced'''
+    parsed_url = urlparse(url)
+
+    query = [(key, str(params[key]) if key in params else value)
+             for key, value in parse_qsl(parsed_url.query, keep_blank_values=True)]
+
+    query_keys = set([key for key, value in query])
+    query.extend(sorted([(key, str(value)) for key, value in params.items() if key not in query_keys]))
+
+    return urlunparse(parsed_url._replace(query=urlencode(query)))
+
+
+def page_urls_from_next(next_url, count, page_length):
+    '''Build the urls of all the pages after the first page of a paginated list
+
+    next_url is the 'next' url from the first page, count is the total number
+    of items and page_length is the number of items on the first page.
+
+    Returns None if the page urls can not be determined (ie, no count, or the
+    'next' url does not use a 'page' number) and the 'next' links have to be followed.'''
+    if not next_url or not count or not page_length:
+        return None
+
+    next_page = dict(parse_qsl(urlparse(next_url).query)).get('page', None)
+
+    try:
+        next_page = int(next_page)
+    except (TypeError, ValueError):
+        return None
+
+    last_page = int(math.ceil(count / float(page_length)))
+
+    return [set_query_params(next_url, page=page) for page in range(next_page, last_page + 1)]
+
+
+# http status codes for responses that suggest the server's API version has changed
+# (when the response is not a Galaxy API error, ie a 404 for the whole API path)
+API_VERSION_ERROR_STATUS_CODES = (404, 406, 410)
+
+
+def is_api_version_error(exc):
+    '''True if exc could be caused by using the wrong server API version'''
+    response = getattr(exc, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+
+    if isinstance(exc, exceptions.GalaxyRestServerError):
+        return status_code in API_VERSION_ERROR_STATUS_CODES
+
+    # a Galaxy API 404 is just something that doesn't exist (ie, an unknown collection)
+    if isinstance(exc, exceptions.GalaxyRestAPIError):
+        return status_code in (406, 410)
+
+    return False
+
+
 def g_connect(method):
-    ''' wrapper to lazily initialize connection info to galaxy '''
+    ''' wrapper to lazily initialize connection info to galaxy
+
+    The server API version is only checked if it is not already in the api_version_cache.
+    If a request fails with an error that suggests the API version has changed, the cached
+    version is invalidated so it is checked again next time.'''
 
     def wrapped(self, *args, **kwargs):
-        if not self.initialized:
-            log.debug("Initial connection to galaxy_server: %s", self._api_server)
+        # A GalaxyAPI can be shared by threads, but only one needs to check the version
+        with self._connect_lock:
+            if not self.initialized:
+                log.debug("Initial connection to galaxy_server: %s", self._api_server)
 
-            server_version = self._get_server_api_version()
+                server_version = api_version_cache.get(self.galaxy_context, self._api_server)
+
+                if server_version is None:
+                    server_version = self._get_server_api_version()
+
+                    if server_version in self.SUPPORTED_VERSIONS:
+                        api_version_cache.put(self.galaxy_context, self._api_server, server_version)
+                else:
+                    log.debug('Using cached API version "%s" of %s', server_version, self._api_server)
+
+                if server_version not in self.SUPPORTED_VERSIONS:
+                    raise exceptions.GalaxyClientError("Unsupported Galaxy server API version: %s" % server_version)
+
+                self.initialized = True
+
+        try:
+            return method(self, *args, **kwargs)
+        except exceptions.GalaxyRequestsError as exc:
+            if is_api_version_error(exc):
+                log.debug('Invalidating the cached API version of %s after: %s', self._api_server, exc)
 
-            if server_version not in self.SUPPORTED_VERSIONS:
-                raise exceptions.GalaxyClientError("Unsupported Galaxy server API version: %s" % server_version)
+                api_version_cache.invalidate(self.galaxy_context, self._api_server)
+                self.initialized = False
+            raise
 
-            self.initialized = True
-        return method(self, *args, **kwargs)
     return wrapped
 
 
@@ -69,6 +182,16 @@ class RestClient(object):
     more logging.
 
     Also sets the mazer http user agent, and adds 'Request-ID' headers.
+
+    RestClient's can be used from multiple threads. The number of requests
+    in flight to a server at once is limited to http_context['max_concurrency']
+    across all RestClient's.
+
+    All RestClient's for a server share one requests.Session (see http_session)
+    so connections to the server are reused.
+
+    Requests are made with the timeouts and retries of http_context['transfer_policy'],
+    and wait for the rate limiter of the server (see http_transfer).
     '''
 
     def __init__(self, http_context=None):
@@ -80,8 +203,20 @@ class RestClient(object):
 
         log.debug('User Agent: %s', self.user_agent)
 
-        self.session = requests.Session()
-        self.session.headers.update({'User-Agent': self.user_agent})
+        server_url = (self.http_context.get('server', None) or {}).get('url', None)
+
+        # Shared with every other request to the server, so the User-Agent is set per request
+        self.session = http_session.get(server_url,
+                                        pool_size=self.http_context.get('pool_size', None))
+
+        self.semaphore = server_semaphore(server_url,
+                                          max_concurrency=self.http_context.get('max_concurrency', None))
+
+        self.transfer_policy = self.http_context.get('transfer_policy', None) or http_transfer.TransferPolicy()
+
+        self.limiter = http_transfer.rate_limiter(server_url,
+                                                  rate=self.transfer_policy.rate_limit,
+                                                  burst=self.transfer_policy.rate_limit_burst)
 
         self.log = logging.getLogger(__name__ + '.' + self.__class__.__name__)
 
@@ -106,6 +241,7 @@ class RestClient(object):
         request_headers = headers or {}
         request_id = uuid.uuid4().hex
         request_headers['X-Request-ID'] = request_id
+        request_headers['User-Agent'] = self.user_agent
 
         # The slug we use to identify a request by method, url and request id
         # For ex, '"GET https://galaxy.ansible.com/api/v1/repositories" c48937f4e8e849828772c4a0ce0fd5ed'
@@ -120,9 +256,14 @@ class RestClient(object):
 
         try:
 
-            # Make the actual request
-            resp = self.session.request(http_method, url, data=args, headers=request_headers,
-                                        verify=self.validate_certs)
+            # Make the actual request. The slot is given up while waiting to retry.
+            with http_transfer.ConnectionSlot(self.semaphore) as slot:
+                resp = http_transfer.request(self.session, http_method, url,
+                                             transfer_policy=self.transfer_policy,
+                                             limiter=self.limiter,
+                                             slot=slot,
+                                             data=args, headers=request_headers,
+                                             verify=self.validate_certs)
 
         except requests.exceptions.ConnectionError as connection_exc:
             self.log.debug('Connection exception on %s', pre_request_slug)
@@ -175,7 +316,14 @@ class RestClient(object):
 
 
 class GalaxyAPI(object):
-    ''' This class is meant to be used as a API client for an Ansible Galaxy server '''
+    ''' This class is meant to be used as a API client for an Ansible Galaxy server
+
+    A GalaxyAPI remembers the result of each get_object() for as long as it lives,
+    including 404 'not found' errors. If the same url is requested by more than one
+    thread at once, only one request is made and they all get its result. So one
+    GalaxyAPI shared by everything in a run (ie, an install) does not repeat
+    the same lookups. The results are shared, so they should not be modified.
+    '''
 
     SUPPORTED_VERSIONS = ['v1', 'v2']
 
@@ -190,11 +338,22 @@ class GalaxyAPI(object):
         # set the API server
         self._api_server = galaxy_context.server['url']
 
-        self.rest_client = RestClient(http_context={'server': galaxy_context.server})
+        self.rest_client = RestClient(http_context={'server': galaxy_context.server,
+                                                    'max_concurrency': galaxy_context.options.get('api_concurrency', None),
+                                                    'pool_size': http_session.pool_size(galaxy_context),
+                                                    'transfer_policy': http_transfer.policy(galaxy_context)})
+
+        # None if response caching is not enabled
+        self.http_cache = http_cache.get(galaxy_context)
         # self.log.debug('Validate TLS certificates for %s: %s', self._api_server, self._validate_certs)
 
         # This is set to true by the g_connect wrapper once there is there has been a server api check
         self.initialized = False
+        self._connect_lock = threading.Lock()
+
+        # url -> concurrent.futures.Future of the get_object() results for the url
+        self._lookups = {}
+        self._lookups_lock = threading.Lock()
 
     @property
     def api_server(self):
@@ -204,6 +363,11 @@ class GalaxyAPI(object):
     def base_api_url(self):
         return '%s/api' % self._api_server
 
+    @property
+    def page_size(self):
+        '''The page size to request for paginated lists'''
+        return self.galaxy_context.options.get('api_page_size', None) or defaults.DEFAULT_API_PAGE_SIZE
+
     def _get_server_api_version(self):
         """
         Fetches the Galaxy API current version to ensure
@@ -228,6 +392,11 @@ class GalaxyAPI(object):
         """
         Fetch the list of related items for the given role.
         The url comes from the 'related' field of the role.
+
+        If the first page has a 'count' and its 'next' url has a 'page' param,
+        the urls of the rest of the pages are known up front, so they are fetched
+        at the same time (up to the 'api_concurrency' option) and merged in order.
+        Otherwise, the 'next' links are followed one page at a time.
         """
 
         # This is not an object that could have paging data
@@ -241,26 +410,43 @@ class GalaxyAPI(object):
         if 'next' not in data and 'count' not in data:
             return data
 
-        results = data['results']
+        # a list of each page's results, joined into one list at the end
+        pages_results = [data['results']]
+
+        next_url = data.get('next', None)
+
+        page_urls = page_urls_from_next(next_url, data.get('count', None), len(data['results']))
+
+        if page_urls:
+            log.debug('Fetching %s more pages after %s', len(page_urls), next_url)
+
+            max_workers = min(len(page_urls), self.galaxy_context.options.get('api_concurrency', None) or defaults.DEFAULT_API_CONCURRENCY)
+            executor = futures.ThreadPoolExecutor(max_workers=max(1, max_workers))
 
-        done = (data.get('next', None) is None)
+            try:
+                # map() returns the pages in page_urls order and reraises the first error
+                pages_data = list(executor.map(self._get_data, page_urls))
+            finally:
+                executor.shutdown(wait=True)
 
-        while not done:
-            next_url = data['next']
+            pages_results.extend([page_data.get('results', []) for page_data in pages_data])
 
+            # If more versions were added since the first page, there could be even more pages
+            next_url = pages_data[-1].get('next', None)
+
+        while next_url:
             log.debug('next_url: %s', next_url)
 
             # Basic get_object() but sans automatic paging
-            resp = self.rest_client.mkrequest(url=next_url, http_method='GET')
-            next_data = self.handle_response(resp)
+            next_data = self._get_data(next_url)
 
             # can assume all the rest of the links will also be 'page' dicts
             # if no results, default to a empty list
-            results += next_data.get('results', [])
+            pages_results.append(next_data.get('results', []))
 
-            done = (next_data.get('next', None) is None)
+            next_url = next_data.get('next', None)
 
-        return results
+        return list(itertools.chain.from_iterable(pages_results))
 
     @g_connect
     def get_collection_detail(self, namespace, name):
@@ -331,19 +517,129 @@ class GalaxyAPI(object):
     def _get_object(self, href=None):
         '''Get a full url and return deserialized results'''
 
-        # responses = self.rest_client.mkrequest():
-        # return self.handle_responses(responses)
-        resp = self.rest_client.mkrequest(url=href, http_method='GET')
-
-        data = self.handle_response(resp)
+        data = self._get_data(href)
 
         # determine if the data is paginated and if so, page it and accumulate results
         return self.paginate(data)
 
+    def _get_data(self, href):
+        '''GET href and return the deserialized response, using the http cache if enabled'''
+
+        if not self.http_cache:
+            resp = self.rest_client.mkrequest(url=href, http_method='GET')
+            return self.handle_response(resp)
+
+        cache_entry = self.http_cache.load(href)
+
+        if cache_entry and self.http_cache.is_fresh(cache_entry):
+            self.log.debug('Using cached response for %s', href)
+            return cache_entry['data']
+
+        if cache_entry and self.http_cache.is_usable_while_revalidating(cache_entry):
+            self.log.debug('Using stale cached response for %s while revalidating it', href)
+
+            self._start_revalidation(href, cache_entry)
+
+            return cache_entry['data']
+
+        return self._get_data_conditionally(href, cache_entry)
+
+    def _start_revalidation(self, href, cache_entry):
+        '''Revalidate the cached response for href in a background thread, unless one already is'''
+        with _revalidations_lock:
+            if href in _revalidations:
+                self.log.debug('The cached response for %s is already being revalidated', href)
+                return
+
+            revalidate_thread = threading.Thread(target=self._revalidate,
+                                                 args=(href, cache_entry),
+                                                 name='revalidate-%s' % href)
+
+            # Don't keep mazer from exiting for it. The cache entry is replaced atomically,
+            # so an unfinished revalidation just means it is revalidated again next time.
+            revalidate_thread.daemon = True
+
+            _revalidations[href] = revalidate_thread
+
+        try:
+            revalidate_thread.start()
+        except Exception:
+            with _revalidations_lock:
+                _revalidations.pop(href, None)
+            raise
+
+    def _revalidate(self, href, cache_entry):
+        try:
+            self._get_data_conditionally(href, cache_entry)
+        except exceptions.GalaxyError as e:
+            self.log.warning('Unable to revalidate the cached response for %s: %s', href, e)
+        finally:
+            with _revalidations_lock:
+                _revalidations.pop(href, None)
+
+    def _get_data_conditionally(self, href, cache_entry=None):
+        request_headers = None
+        if cache_entry:
+            request_headers = self.http_cache.conditional_headers(cache_entry)
+
+        resp = self.rest_client.mkrequest(url=href, http_method='GET', headers=request_headers)
+
+        if cache_entry and resp.status_code == 304:
+            self.log.debug('%s was not modified, using cached response', response_slug(resp))
+            self.http_cache.refresh(href, cache_entry)
+            return cache_entry['data']
+
+        data = self.handle_response(resp)
+
+        # handle_response raises for any errors, but only cache the good stuff
+        if resp.status_code == 200:
+            self.http_cache.save(href, data, resp.headers)
+
+        return data
+
     @g_connect
-    def get_object(self, href=None):
-        '''Get a full url and return deserialized results'''
-        return self._get_object(href=href)
+    def get_object(self, href=None, page_size=None):
+        '''Get a full url and return deserialized results
+
+        If page_size is set, it is requested as the 'page_size' of a paginated
+        list so that fewer pages are needed. The server may use a smaller one.'''
+        if page_size:
+            href = set_query_params(href, page_size=page_size)
+
+        return self._lookup(href)
+
+    def _lookup(self, href):
+        '''_get_object(href), unless it has already been requested by this GalaxyAPI'''
+        with self._lookups_lock:
+            lookup = self._lookups.get(href, None)
+            requested = lookup is not None
+
+            if not requested:
+                lookup = futures.Future()
+                self._lookups[href] = lookup
+
+        if requested:
+            self.log.debug('Using the result of the previous request for %s', href)
+
+            # waits for the request if it is still in flight and reraises any error
+            return lookup.result()
+
+        try:
+            data = self._get_object(href=href)
+        except Exception as exc:
+            status_code = getattr(getattr(exc, 'response', None), 'status_code', None)
+
+            # remember the api saying something doesn't exist, but let anything else be retried
+            if not (isinstance(exc, exceptions.GalaxyRestAPIError) and status_code == 404):
+                with self._lookups_lock:
+                    self._lookups.pop(href, None)
+
+            lookup.set_exception(exc)
+            raise
+
+        lookup.set_result(data)
+
+        return data
 
     @g_connect
     def publish_file(self, form, publish_api_key):
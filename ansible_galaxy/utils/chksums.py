@@ -16,3 +16,30 @@ def sha256sum_from_fo(fo):
 def sha256sum_from_path(filename):
     with open(filename, 'rb') as fo:
         return sha256sum_from_fo(fo)
+
+
+class Sha256Reader(object):
+    '''Wrap a readable file object and compute the sha256 of everything read from it'''
+
+    block_size = 65536
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self._sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self.fileobj.read()
+        else:
+            data = self.fileobj.read(size)
+
+        self._sha256.update(data)
+        return data
+
+    def read_to_end(self):
+        '''Read (and hash) whatever has not been read yet'''
+        for _block in iter(lambda: self.read(self.block_size), b''):
+            pass
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
@@ -1,3 +1,4 @@
+import bisect
 import logging
 import re
 
@@ -8,6 +9,36 @@ log = logging.getLogger(__name__)
 VERSION_WITH_LEADING_V_MATCH_RE = re.compile(r'^[vV]\d+\.')
 VERSION_WITH_LEADING_V_SUB_RE = re.compile(r'(^[vV])')
 
+# One clause of a version spec, ie, '>=1.0.0'
+VERSION_SPEC_CLAUSE_RE = re.compile(r'^(==|=|>=|<=|>|<)?\s*([^<>=!~^*\s]+)$')
+
+# The parsed Version and Spec objects are immutable, so the same object is shared
+# by everything that parses the same string. The caches are emptied if they get this big.
+PARSED_CACHE_SIZE = 4096
+
+# version string -> semantic_version.Version
+_versions = {}
+
+# version spec string -> semantic_version.Spec
+_version_specs = {}
+
+# version spec string -> (lowest, highest) semantic_version.Version that could match
+_version_spec_bounds = {}
+
+
+def _memoize(cache, key, parse):
+    value = cache.get(key, None)
+
+    if value is None:
+        value = parse(key)
+
+        if len(cache) >= PARSED_CACHE_SIZE:
+            cache.clear()
+
+        cache[key] = value
+
+    return value
+
 
 def convert_string_to_semver(version):
     # log.debug('vs: %s type: %s', version, type(version))
@@ -18,7 +49,7 @@ def convert_string_to_semver(version):
     if isinstance(version, semantic_version.Version):
         return version
 
-    return semantic_version.Version(version)
+    return _memoize(_versions, version, semantic_version.Version)
 
 
 def convert_string_to_version_spec(version_spec):
@@ -29,7 +60,43 @@ def convert_string_to_version_spec(version_spec):
     if isinstance(version_spec, semantic_version.Spec):
         return version_spec
 
-    return semantic_version.Spec(version_spec)
+    return _memoize(_version_specs, version_spec, semantic_version.Spec)
+
+
+def _parse_version_spec_bounds(version_spec_string):
+    lowest = None
+    highest = None
+
+    for clause in version_spec_string.split(','):
+        matches = VERSION_SPEC_CLAUSE_RE.match(clause.strip())
+
+        # ie, '*', '!=1.0.0', '~1.2' or '^1.2.0'. Those don't narrow the range.
+        if not matches:
+            continue
+
+        op, version_string = matches.groups()
+
+        try:
+            version = semantic_version.Version(version_string)
+        except ValueError:
+            # a partial version like '==1.2' matches 1.2.x
+            continue
+
+        if op in (None, '=', '==', '>', '>=') and (lowest is None or version > lowest):
+            lowest = version
+
+        if op in (None, '=', '==', '<', '<=') and (highest is None or version < highest):
+            highest = version
+
+    return (lowest, highest)
+
+
+def version_spec_bounds(version_spec):
+    '''The (lowest, highest) versions that version_spec could match. None if unbounded.
+
+    The bounds are inclusive and only used to narrow down which versions to check with
+    version_spec.match(), so a version between the bounds may still not match.'''
+    return _memoize(_version_spec_bounds, str(version_spec), _parse_version_spec_bounds)
 
 
 def version_needs_aka(version_string):
@@ -69,3 +136,94 @@ def normalize_version_string(version_string):
                 version_string, new_versions_string)
 
     return new_versions_string
+
+
+def version_sort_key(version):
+    '''The key semantic_version sorts version by, build metadata included
+
+    Versions that differ only in build metadata (ie, 1.0.0 and 1.0.0+b1) have the same
+    precedence, so neither is < the other, and sorting them by < alone leaves them in
+    whatever order they came in. This key puts them in a consistent order.'''
+    return version.precedence_key
+
+
+class VersionIndex(object):
+    '''The available versions of a collection, parsed once and kept sorted
+
+    Each version can have some data (ie, the CollectionVersion from the Galaxy API) kept with it.
+
+    The versions are sorted by version_sort_key(), so versions that differ only in build
+    metadata are in a consistent order, and the one whose build metadata sorts last is
+    the 'latest' for select().
+
+    Version spec queries use the bounds of the spec (see version_spec_bounds) to bisect the
+    sorted versions, and only the versions in between are matched against the spec. Bounds
+    compare without build metadata (the same as Spec.match does), so all of the builds of a
+    bound version are in between.'''
+
+    def __init__(self, versions=None):
+        self._versions = []
+        self._sort_keys = []
+        self._data = {}
+
+        for version in versions or []:
+            self.add(version)
+
+    def add(self, version, data=None):
+        version = convert_string_to_semver(version)
+
+        if version not in self._data:
+            sort_key = version_sort_key(version)
+            index = bisect.bisect_right(self._sort_keys, sort_key)
+
+            self._sort_keys.insert(index, sort_key)
+            self._versions.insert(index, version)
+
+        self._data[version] = data
+
+        return version
+
+    def data(self, version):
+        return self._data.get(convert_string_to_semver(version), None)
+
+    def __len__(self):
+        return len(self._versions)
+
+    def __iter__(self):
+        '''The versions, oldest first'''
+        return iter(self._versions)
+
+    def __contains__(self, version):
+        return convert_string_to_semver(version) in self._data
+
+    def _candidates(self, version_specs):
+        lo = 0
+        hi = len(self._versions)
+
+        for version_spec in version_specs:
+            lowest, highest = version_spec_bounds(version_spec)
+
+            if lowest is not None:
+                lo = max(lo, bisect.bisect_left(self._versions, lowest))
+
+            if highest is not None:
+                hi = min(hi, bisect.bisect_right(self._versions, highest))
+
+        return self._versions[lo:hi]
+
+    def filter(self, *version_specs):
+        '''The versions that match all of version_specs, oldest first'''
+        version_specs = [convert_string_to_version_spec(version_spec) for version_spec in version_specs]
+
+        return [version for version in self._candidates(version_specs)
+                if all(version_spec.match(version) for version_spec in version_specs)]
+
+    def select(self, *version_specs):
+        '''The latest version (by version_sort_key()) that matches all of version_specs, or None'''
+        version_specs = [convert_string_to_version_spec(version_spec) for version_spec in version_specs]
+
+        for version in reversed(self._candidates(version_specs)):
+            if all(version_spec.match(version) for version_spec in version_specs):
+                return version
+
+        return None
@@ -95,6 +95,9 @@ class GalaxyCLI(cli.CLI):
             self.parser.set_usage("usage: %prog install [options] [collection_name(s)[,version] | collection_artifact_file(s)]")
             self.parser.add_option('-l', '--lockfile', dest='collections_lockfile',
                                    help='A collections lockfile listing collections to install')
+            self.parser.add_option('--frozen', dest='frozen', action='store_true', default=False,
+                                   help='Install the exact versions in a frozen collections lockfile (see \'list --lockfile --freeze\') '
+                                   'from their recorded download urls without any Galaxy API requests')
             self.parser.add_option('-g', '--global', dest='global_install', action='store_true',
                                    help='Install content to the path containing your global or system-wide content. The default is the '
                                    'global_collections_path configured in your mazer.yml file (/usr/share/ansible/content, if not configured)')
@@ -197,7 +200,11 @@ class GalaxyCLI(cli.CLI):
         if getattr(options, 'publish_api_key', None):
             server['api_key'] = options.publish_api_key
 
-        galaxy_context = GalaxyContext(server=server, collections_path=collections_path)
+        options = (config.options or {}).copy()
+
+        galaxy_context = GalaxyContext(server=server,
+                                       collections_path=collections_path,
+                                       options=options)
 
         return galaxy_context
 
@@ -304,7 +311,8 @@ class GalaxyCLI(cli.CLI):
                                                    display_callback=self.display,
                                                    ignore_errors=self.options.ignore_errors,
                                                    no_deps=self.options.no_deps,
-                                                   force_overwrite=self.options.force)
+                                                   force_overwrite=self.options.force,
+                                                   frozen=self.options.frozen)
 
         return rc
 
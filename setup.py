@@ -21,6 +21,8 @@ requirements = ['six',
                 # used for data classes
                 # 18.1.0 introduces the 'factory' keyword
                 'attrs>=18.1.0',
+                # concurrent.futures backport for py2
+                'futures; python_version < "3.0"',
                 ]
 
 setup_requirements = ['pytest-runner', ]
@@ -1,14 +1,21 @@
 import logging
 import mock
+import threading
+
+import pytest
+import semantic_version
 
 from ansible_galaxy.actions import install
 from ansible_galaxy import exceptions
 from ansible_galaxy import repository_spec
 from ansible_galaxy import requirements
+from ansible_galaxy.models.install_plan import InstallPlan
 from ansible_galaxy.models.repository import Repository
 from ansible_galaxy.models.repository_spec import RepositorySpec
 from ansible_galaxy.models.requirement import Requirement, RequirementOps
+from ansible_galaxy.models.context import GalaxyContext
 from ansible_galaxy.models.requirement_spec import RequirementSpec
+from ansible_galaxy.rest_api import GalaxyAPI
 
 log = logging.getLogger(__name__)
 
@@ -38,8 +45,16 @@ def test_install_repositories(galaxy_context, mocker):
     requirements_to_install = \
         requirements.from_dependencies_dict({'some_namespace.this_requires_some_name': '*'})
 
-    mocker.patch('ansible_galaxy.actions.install.install_repository',
-                 return_value=expected_repos)
+    install_plan = InstallPlan(requirement=requirements_to_install[0],
+                               repository_spec=repo_spec,
+                               fetcher=mocker.MagicMock(name='mock_fetcher'))
+
+    mocker.patch('ansible_galaxy.actions.install.find_repository',
+                 return_value=install_plan)
+    mock_fetch_repository = mocker.patch('ansible_galaxy.actions.install.fetch_repository',
+                                         return_value={'archive_path': '/dev/null/some.tar.gz'})
+    mock_install_fetched = mocker.patch('ansible_galaxy.actions.install.install_fetched_repository',
+                                        return_value=expected_repos)
 
     ret = install.install_repositories(galaxy_context,
                                        requirements_to_install=requirements_to_install,
@@ -50,6 +65,84 @@ def test_install_repositories(galaxy_context, mocker):
     assert isinstance(ret, list)
     assert ret == expected_repos
 
+    mock_fetch_repository.assert_called_once_with(install_plan, galaxy_context)
+    assert mock_install_fetched.call_args[0][1] == install_plan
+    assert mock_install_fetched.call_args[0][2] == {'archive_path': '/dev/null/some.tar.gz'}
+
+
+def test_install_repositories_fetch_all_before_install(galaxy_context, mocker):
+    requirements_to_install = \
+        requirements.from_dependencies_dict({'some_namespace.some_name': '*',
+                                             'some_namespace.some_other_name': '*'})
+
+    def find_repository(galaxy_context, requirement_to_install, **kwargs):
+        req_spec = requirement_to_install.requirement_spec
+        repo_spec = RepositorySpec(namespace=req_spec.namespace, name=req_spec.name, version='1.0.0')
+        return InstallPlan(requirement=requirement_to_install,
+                           repository_spec=repo_spec,
+                           fetcher=mocker.MagicMock(name='mock_fetcher'))
+
+    mocker.patch('ansible_galaxy.actions.install.find_repository',
+                 side_effect=find_repository)
+    mocker.patch('ansible_galaxy.actions.install.fetch_repository',
+                 side_effect=lambda plan, galaxy_context: {'archive_path': '/dev/null/%s.tar.gz' % plan.repository_spec.name})
+
+    def install_fetched_repository(galaxy_context, install_plan, fetch_results, **kwargs):
+        return [Repository(repository_spec=install_plan.repository_spec)]
+
+    mocker.patch('ansible_galaxy.actions.install.install_fetched_repository',
+                 side_effect=install_fetched_repository)
+
+    ret = install.install_repositories(galaxy_context,
+                                       requirements_to_install=requirements_to_install,
+                                       display_callback=display_callback)
+
+    log.debug('ret: %s', ret)
+
+    # installed in the same order as they were found
+    assert [x.repository_spec.name for x in ret] == ['some_name', 'some_other_name']
+
+
+def test_install_repositories_fetch_error_cleans_up(galaxy_context, mocker):
+    requirements_to_install = \
+        requirements.from_dependencies_dict({'some_namespace.some_name': '*',
+                                             'some_namespace.some_other_name': '*'})
+
+    fetchers = {}
+    other_fetched = threading.Event()
+
+    def find_repository(galaxy_context, requirement_to_install, **kwargs):
+        req_spec = requirement_to_install.requirement_spec
+        repo_spec = RepositorySpec(namespace=req_spec.namespace, name=req_spec.name, version='1.0.0')
+        fetchers[req_spec.name] = mocker.MagicMock(name='mock_fetcher_%s' % req_spec.name)
+        return InstallPlan(requirement=requirement_to_install,
+                           repository_spec=repo_spec,
+                           fetcher=fetchers[req_spec.name])
+
+    def fetch_repository(install_plan, galaxy_context):
+        if install_plan.repository_spec.name == 'some_name':
+            other_fetched.wait(5)
+            raise exceptions.GalaxyDownloadError('some download error', url='http://example.invalid')
+        other_fetched.set()
+        return {'archive_path': '/dev/null/some.tar.gz'}
+
+    mocker.patch('ansible_galaxy.actions.install.find_repository',
+                 side_effect=find_repository)
+    mocker.patch('ansible_galaxy.actions.install.fetch_repository',
+                 side_effect=fetch_repository)
+    mock_install_fetched = mocker.patch('ansible_galaxy.actions.install.install_fetched_repository')
+
+    with pytest.raises(exceptions.GalaxyError, match='some download error'):
+        install.install_repositories(galaxy_context,
+                                     requirements_to_install=requirements_to_install,
+                                     display_callback=display_callback)
+
+    # the first fetch failed, so nothing is installed and the artifact
+    # for the other one is cleaned up
+    assert mock_install_fetched.call_count == 0
+    assert fetchers['some_name'].cleanup.call_count == 0
+    assert fetchers['some_other_name'].cleanup.call_count == 1
+
 
 def test_install_repository_deprecated(galaxy_context, mocker):
     requirements_to_install = \
@@ -88,9 +181,9 @@ def test_install_repositories_no_deps_required(galaxy_context, mocker):
     repository_specs_to_install = \
         [repository_spec.repository_spec_from_string('some_namespace.this_requires_nothing')]
 
-    # mock out install_repository
-    mocker.patch('ansible_galaxy.actions.install.install_repository',
-                 return_value=[])
+    # nothing found for the requirement
+    mocker.patch('ansible_galaxy.actions.install.find_repository',
+                 return_value=None)
 
     ret = install.install_repositories(galaxy_context,
                                        requirements_to_install=repository_specs_to_install,
@@ -149,3 +242,392 @@ def test_find_new_deps_from_installed(galaxy_context):
     assert isinstance(res, list)
     assert isinstance(res[0], Requirement)
     assert res[0].requirement_spec == req_spec
+
+
+def _remote_artifact(requests_mock, remote_url, artifact):
+    '''Serve artifact ({'body': ..., 'etag': ...}) at remote_url, with a 304 if it's not modified'''
+    requested = []
+
+    def respond(request, context):
+        requested.append(request.headers.get('If-None-Match', None))
+        context.headers['ETag'] = artifact['etag']
+        if request.headers.get('If-None-Match', None) == artifact['etag']:
+            context.status_code = 304
+            return b''
+        return artifact['body']
+
+    requests_mock.get(remote_url, content=respond)
+    return requested
+
+
+@pytest.fixture
+def remote_url_cache(galaxy_context, tmpdir, mocker):
+    galaxy_context.options['cache_path'] = tmpdir.mkdir('cache').strpath
+
+    def load_data(path):
+        return {'namespace': 'some_namespace', 'name': 'some_name', 'version': '1.2.3',
+                'src': path, 'spec_string': path}
+
+    mocker.patch('ansible_galaxy.actions.install.collection_artifact.load_data_from_collection_artifact',
+                 side_effect=load_data)
+    return galaxy_context
+
+
+def test_fetch_remote_url_spec_data_artifact_cache(remote_url_cache, requests_mock):
+    remote_url = 'http://example.invalid/downloads/some_namespace-some_name-1.2.3.tar.gz'
+    artifact = {'body': b'not really a tar.gz', 'etag': '"v1"'}
+    requested = _remote_artifact(requests_mock, remote_url, artifact)
+
+    spec_data = install._fetch_remote_url_spec_data(remote_url_cache, remote_url)
+
+    assert spec_data['src'].endswith('some_namespace-some_name-1.2.3.tar.gz')
+    assert spec_data['src'].startswith(remote_url_cache.options['cache_path'])
+
+    other_spec_data = install._fetch_remote_url_spec_data(remote_url_cache, remote_url)
+
+    # checked the cached copy was still the artifact at remote_url, and it was
+    assert requested == [None, '"v1"']
+    assert other_spec_data['src'] == spec_data['src']
+
+
+def test_fetch_remote_url_spec_data_artifact_cache_changed(remote_url_cache, requests_mock):
+    remote_url = 'http://example.invalid/downloads/some_namespace-some_name-1.2.3.tar.gz'
+    artifact = {'body': b'not really a tar.gz', 'etag': '"v1"'}
+    requested = _remote_artifact(requests_mock, remote_url, artifact)
+
+    install._fetch_remote_url_spec_data(remote_url_cache, remote_url)
+
+    # rebuilt and uploaded again as the same version
+    artifact.update({'body': b'not really a tar.gz either', 'etag': '"v2"'})
+
+    spec_data = install._fetch_remote_url_spec_data(remote_url_cache, remote_url)
+
+    # the check said it changed, so it was downloaded again
+    assert requested == [None, '"v1"', None]
+    with open(spec_data['src'], 'rb') as artifact_fo:
+        assert artifact_fo.read() == b'not really a tar.gz either'
+
+
+def test_fetch_remote_url_spec_data_artifact_cache_other_url(remote_url_cache, requests_mock):
+    remote_url = 'http://example.invalid/downloads/some_namespace-some_name-1.2.3.tar.gz'
+    other_remote_url = 'http://other.invalid/downloads/some_namespace-some_name-1.2.3.tar.gz'
+    _remote_artifact(requests_mock, remote_url, {'body': b'not really a tar.gz', 'etag': '"v1"'})
+    other_requested = _remote_artifact(requests_mock, other_remote_url,
+                                       {'body': b'some other not a tar.gz', 'etag': '"v1"'})
+
+    install._fetch_remote_url_spec_data(remote_url_cache, remote_url)
+    spec_data = install._fetch_remote_url_spec_data(remote_url_cache, other_remote_url)
+
+    # the cached copy is from remote_url, so it is not even checked against other_remote_url
+    assert other_requested == [None]
+    with open(spec_data['src'], 'rb') as artifact_fo:
+        assert artifact_fo.read() == b'some other not a tar.gz'
+
+
+def test_install_repositories_finds_concurrently(galaxy_context, mocker):
+    requirements_to_install = \
+        requirements.from_dependencies_dict({'some_namespace.some_name': '*',
+                                             'some_namespace.some_other_name': '*'})
+
+    other_found = threading.Event()
+
+    def find_repository(galaxy_context, requirement_to_install, display_callback=None, **kwargs):
+        req_spec = requirement_to_install.requirement_spec
+
+        # the first find waits on the second, so they have to run at the same time
+        if req_spec.name == 'some_name':
+            assert other_found.wait(5)
+        else:
+            other_found.set()
+
+        display_callback('Found %s' % req_spec.name)
+
+        repo_spec = RepositorySpec(namespace=req_spec.namespace, name=req_spec.name, version='1.0.0')
+        return InstallPlan(requirement=requirement_to_install,
+                           repository_spec=repo_spec,
+                           fetcher=mocker.MagicMock(name='mock_fetcher'))
+
+    mocker.patch('ansible_galaxy.actions.install.find_repository',
+                 side_effect=find_repository)
+
+    mock_display_callback = mocker.MagicMock(name='mock_display_callback')
+
+    res = install._find_install_plans(galaxy_context,
+                                      sorted(requirements_to_install),
+                                      display_callback=mock_display_callback)
+
+    assert [x.repository_spec.name for x in res] == ['some_name', 'some_other_name']
+
+    # messages are shown in requirement order, not the order the finds finished in
+    assert mock_display_callback.call_args_list == [mocker.call('Found some_name'),
+                                                    mocker.call('Found some_other_name')]
+
+
+def test_install_repositories_finds_deps_before_fetching(galaxy_context, mocker):
+    requirements_to_install = \
+        requirements.from_dependencies_dict({'some_namespace.some_name': '*'})
+
+    # what find() knows about the dependencies of each collection
+    dependencies = {'some_name': {'some_namespace.some_dep': '>=1.0.0',
+                                  'some_namespace.some_other_dep': '*'},
+                    'some_dep': {'some_namespace.some_other_dep': '*'},
+                    'some_other_dep': {}}
+
+    def find_repository(galaxy_context, requirement_to_install, **kwargs):
+        req_spec = requirement_to_install.requirement_spec
+        repo_spec = RepositorySpec(namespace=req_spec.namespace, name=req_spec.name, version='1.0.0')
+        return InstallPlan(requirement=requirement_to_install,
+                           repository_spec=repo_spec,
+                           fetcher=mocker.MagicMock(name='mock_fetcher'),
+                           find_results={'custom': {'dependencies': dependencies[req_spec.name]}})
+
+    mock_find_repository = mocker.patch('ansible_galaxy.actions.install.find_repository',
+                                        side_effect=find_repository)
+    mock_fetch_repository = mocker.patch('ansible_galaxy.actions.install.fetch_repository',
+                                         return_value={'archive_path': '/dev/null/some.tar.gz'})
+
+    def install_fetched_repository(galaxy_context, install_plan, fetch_results, **kwargs):
+        # everything was found before anything was installed
+        assert mock_find_repository.call_count == 3
+        return [Repository(repository_spec=install_plan.repository_spec)]
+
+    mocker.patch('ansible_galaxy.actions.install.install_fetched_repository',
+                 side_effect=install_fetched_repository)
+
+    ret = install.install_repositories(galaxy_context,
+                                       requirements_to_install=requirements_to_install,
+                                       display_callback=display_callback)
+
+    # some_other_dep is required twice, but only found and fetched once
+    assert mock_fetch_repository.call_count == 3
+
+    # dependencies are installed first
+    assert [x.repository_spec.name for x in ret] == ['some_other_dep', 'some_dep', 'some_name']
+
+
+def test_install_repositories_no_deps_skips_known_deps(galaxy_context, mocker):
+    requirements_to_install = \
+        requirements.from_dependencies_dict({'some_namespace.some_name': '*'})
+
+    repo_spec = RepositorySpec(namespace='some_namespace', name='some_name', version='1.0.0')
+    install_plan = InstallPlan(requirement=requirements_to_install[0],
+                               repository_spec=repo_spec,
+                               fetcher=mocker.MagicMock(name='mock_fetcher'),
+                               find_results={'custom': {'dependencies': {'some_namespace.some_dep': '*'}}})
+
+    mock_find_repository = mocker.patch('ansible_galaxy.actions.install.find_repository',
+                                        return_value=install_plan)
+    mocker.patch('ansible_galaxy.actions.install.fetch_repository',
+                 return_value={'archive_path': '/dev/null/some.tar.gz'})
+    mocker.patch('ansible_galaxy.actions.install.install_fetched_repository',
+                 return_value=[Repository(repository_spec=repo_spec)])
+
+    install.install_repositories(galaxy_context,
+                                 requirements_to_install=requirements_to_install,
+                                 display_callback=display_callback,
+                                 no_deps=True)
+
+    assert mock_find_repository.call_count == 1
+
+
+def test_dependency_order_cycle(mocker):
+    def install_plan(name, dependencies):
+        repo_spec = RepositorySpec(namespace='some_namespace', name=name, version='1.0.0')
+        req = requirements.from_dependencies_dict({'some_namespace.%s' % name: '*'})[0]
+        return InstallPlan(requirement=req,
+                           repository_spec=repo_spec,
+                           fetcher=mocker.MagicMock(name='mock_fetcher'),
+                           find_results={'custom': {'dependencies': dependencies}})
+
+    install_plans = [install_plan('a', {'some_namespace.b': '*'}),
+                     install_plan('b', {'some_namespace.a': '*'}),
+                     install_plan('c', {})]
+
+    res = install._dependency_order(install_plans)
+
+    assert [x.repository_spec.name for x in res] == ['b', 'a', 'c']
+
+
+def test_resolve_requirements(galaxy_context, mocker):
+    requirements_list = requirements.from_dependencies_dict({'some_namespace.some_name': '>=1.0.0'})
+
+    some_name_spec = RepositorySpec(namespace='some_namespace', name='some_name', version='1.2.0')
+    mocker.patch('ansible_galaxy.actions.install.resolver.resolve',
+                 return_value={('some_namespace', 'some_name'): {'version': some_name_spec.version,
+                                                                 'required_by': [None]},
+                               ('some_namespace', 'some_dep'): {'version': semantic_version.Version('2.0.0'),
+                                                                'required_by': [('some_namespace', 'some_name', some_name_spec.version)]}})
+
+    res = install.resolve_requirements(galaxy_context,
+                                       requirements_list,
+                                       display_callback=display_callback,
+                                       galaxy_api=mocker.MagicMock(name='mock_galaxy_api'))
+
+    assert [(req.requirement_spec.label, req.repository_spec) for req in res] == \
+        [('some_namespace.some_dep,==2.0.0', some_name_spec),
+         ('some_namespace.some_name,==1.2.0', None)]
+
+
+def test_resolve_requirements_conflict(galaxy_context, mocker):
+    requirements_list = requirements.from_dependencies_dict({'some_namespace.some_name': '>=1.0.0'})
+
+    mocker.patch('ansible_galaxy.actions.install.resolver.resolve',
+                 side_effect=exceptions.GalaxyResolutionError('Unable to find versions'))
+
+    with pytest.raises(exceptions.GalaxyError, match='Unable to find versions'):
+        install.resolve_requirements(galaxy_context,
+                                     requirements_list,
+                                     display_callback=display_callback,
+                                     galaxy_api=mocker.MagicMock(name='mock_galaxy_api'))
+
+    # with ignore_errors, the requirements are installed as they were
+    res = install.resolve_requirements(galaxy_context,
+                                       requirements_list,
+                                       display_callback=display_callback,
+                                       ignore_errors=True,
+                                       galaxy_api=mocker.MagicMock(name='mock_galaxy_api'))
+
+    assert res == requirements_list
+
+
+def test_resolve_requirements_installed_not_on_galaxy(galaxy_context, requests_mock, mocker):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': 'http://example.invalid',
+                                    'ignore_certs': False})
+
+    requests_mock.get('http://example.invalid/api/', json={'current_version': 'v2'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '1.0.0',
+                                         'metadata': {'dependencies': {'some_namespace.some_dep': '>=1.0.0'}}}]})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_dep/versions/',
+                      status_code=404,
+                      json={'code': 'not_found', 'message': 'Not found.'})
+
+    # some_dep is installed, but was removed from (or never was on) Galaxy
+    installed_index = mocker.MagicMock(name='mock_installed_index')
+    installed_index.select.return_value = \
+        [Repository(repository_spec=RepositorySpec(namespace='some_namespace', name='some_dep', version='1.1.0'),
+                    installed=True)]
+
+    res = install.resolve_requirements(context,
+                                       requirements.from_dependencies_dict({'some_namespace.some_name': '*'}),
+                                       display_callback=display_callback,
+                                       installed_index=installed_index,
+                                       galaxy_api=GalaxyAPI(context))
+
+    # the installed some_dep satisfies the dependency, so there is nothing else to install
+    assert [req.requirement_spec.label for req in res] == ['some_namespace.some_name,==1.0.0']
+
+
+def _installed_dep_context(galaxy_context, requests_mock, mocker, installed_version):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': 'http://example.invalid',
+                                    'ignore_certs': False})
+
+    requests_mock.get('http://example.invalid/api/', json={'current_version': 'v2'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '1.0.0',
+                                         'metadata': {'dependencies': {'some_namespace.some_dep': '>=2.0.0'}}}]})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_dep/versions/',
+                      json={'count': 3,
+                            'next': None,
+                            'results': [{'version': version, 'metadata': {'dependencies': {}}}
+                                        for version in ('1.0.0', '2.0.0', '3.0.0')]})
+
+    installed_index = mocker.MagicMock(name='mock_installed_index')
+    installed_index.select.return_value = \
+        [Repository(repository_spec=RepositorySpec(namespace='some_namespace', name='some_dep', version=installed_version),
+                    installed=True)]
+
+    return context, installed_index
+
+
+def test_resolve_requirements_installed_conflict(galaxy_context, requests_mock, mocker):
+    context, installed_index = _installed_dep_context(galaxy_context, requests_mock, mocker, '1.0.0')
+
+    # some_name needs a newer some_dep than the installed one, which is only replaced with --force
+    with pytest.raises(exceptions.GalaxyError, match=r'some_namespace.some_dep,1.0.0 is installed.*--force'):
+        install.resolve_requirements(context,
+                                     requirements.from_dependencies_dict({'some_namespace.some_name': '*'}),
+                                     display_callback=display_callback,
+                                     installed_index=installed_index,
+                                     galaxy_api=GalaxyAPI(context))
+
+
+@pytest.mark.parametrize("installed_version,force_overwrite,expected", [
+    # already satisfied, so nothing to do for some_dep
+    ('2.0.0', False, ['some_namespace.some_name,==1.0.0']),
+    # --force doesn't replace dependencies that are already satisfied
+    ('2.0.0', True, ['some_namespace.some_name,==1.0.0']),
+    # but does replace the ones that aren't
+    ('1.0.0', True, ['some_namespace.some_dep,==3.0.0', 'some_namespace.some_name,==1.0.0']),
+])
+def test_resolve_requirements_installed_dep(galaxy_context, requests_mock, mocker, installed_version, force_overwrite, expected):
+    context, installed_index = _installed_dep_context(galaxy_context, requests_mock, mocker, installed_version)
+
+    res = install.resolve_requirements(context,
+                                       requirements.from_dependencies_dict({'some_namespace.some_name': '*'}),
+                                       display_callback=display_callback,
+                                       force_overwrite=force_overwrite,
+                                       installed_index=installed_index,
+                                       galaxy_api=GalaxyAPI(context))
+
+    assert [req.requirement_spec.label for req in res] == expected
+
+
+@pytest.mark.parametrize("force_overwrite,expected", [
+    (False, []),
+    # the requested collection is reinstalled, as the newest version
+    (True, ['some_namespace.some_dep,==3.0.0']),
+])
+def test_resolve_requirements_requested_installed(galaxy_context, requests_mock, mocker, force_overwrite, expected):
+    context, installed_index = _installed_dep_context(galaxy_context, requests_mock, mocker, '2.0.0')
+
+    res = install.resolve_requirements(context,
+                                       requirements.from_dependencies_dict({'some_namespace.some_dep': '*'}),
+                                       display_callback=display_callback,
+                                       force_overwrite=force_overwrite,
+                                       installed_index=installed_index,
+                                       galaxy_api=GalaxyAPI(context))
+
+    assert [req.requirement_spec.label for req in res] == expected
+
+
+def test_install_repository_specs_loop_frozen_needs_lockfile(galaxy_context):
+    with pytest.raises(exceptions.GalaxyClientError, match='lockfile is required'):
+        install.install_repository_specs_loop(galaxy_context,
+                                              repository_spec_strings=[],
+                                              display_callback=display_callback,
+                                              frozen=True)
+
+
+def test_install_repository_specs_loop_frozen_missing_dep(galaxy_context, tmpdir, mocker):
+    lockfile = tmpdir.join('collections_lockfile.yml')
+    lockfile.write('''
+some_namespace.some_name:
+  version: 1.0.0
+  download_url: http://example.invalid/download/some_namespace-some_name-1.0.0.tar.gz
+  sha256: 0123456789abcdef
+''')
+
+    repo_spec = RepositorySpec(namespace='some_namespace', name='some_name', version='1.0.0')
+    dep_reqs = requirements.from_dependencies_dict({'some_namespace.some_dep': '>=1.0.0'},
+                                                   repository_spec=repo_spec)
+    just_installed = Repository(repository_spec=repo_spec, requirements=dep_reqs)
+
+    mock_install = mocker.patch('ansible_galaxy.actions.install.install_repositories_matching_repository_specs',
+                                return_value=[just_installed])
+
+    with pytest.raises(exceptions.GalaxyClientError, match='some_namespace.some_dep'):
+        install.install_repository_specs_loop(galaxy_context,
+                                              repository_spec_strings=[],
+                                              collections_lockfile_path=lockfile.strpath,
+                                              display_callback=display_callback,
+                                              frozen=True)
+
+    requirements_list = mock_install.call_args[0][1]
+    assert requirements_list[0].requirement_spec.fetch_method == 'GALAXY_FROZEN'
@@ -1,8 +1,12 @@
 import logging
 import os
 
+import yaml
+
 from ansible_galaxy import exceptions
 from ansible_galaxy.actions import list as list_action
+from ansible_galaxy.models.repository import Repository
+from ansible_galaxy.models.repository_spec import RepositorySpec
 
 log = logging.getLogger(__name__)
 
@@ -16,7 +20,7 @@ def display_callback(msg, **kwargs):
 def test__list(galaxy_context, mocker):
     mocker.patch('ansible_galaxy.installed_namespaces_db.get_namespace_paths',
                  return_value=iter(['ns_blip', 'ns_foo']))
-    mocker.patch('ansible_galaxy.installed_repository_db.get_repository_paths',
+    mocker.patch('ansible_galaxy.repository.get_repository_paths',
                  return_value=iter(['n_bar', 'n_baz']))
 
     mocker.patch('ansible_galaxy.repository.os.path.isdir',
@@ -82,3 +86,31 @@ def test_format_as_lockfile(mocker):
     log.debug('res: |%s|', res)
 
     assert 'testns.testcollection' in res
+
+
+def test_format_as_lockfile_freeze(tmpdir):
+    repo_spec = RepositorySpec(namespace='testns', name='testcollection', version='1.2.3')
+    repo_path = tmpdir.mkdir('testcollection')
+    repo_path.mkdir('meta').join('.galaxy_install_info').write('''
+install_date: Tue Jul 17 14:41:59 2018
+version: 1.2.3
+download_url: http://example.invalid/download/testns-testcollection-1.2.3.tar.gz
+artifact_sha256: 0123456789abcdef
+''')
+
+    other_repo_spec = RepositorySpec(namespace='example', name='randomjunk', version='0.0.1')
+
+    repo_list = [{'content_items': {},
+                  'installed_repository': Repository(repository_spec=repo_spec, path=repo_path.strpath)},
+                 {'content_items': {},
+                  'installed_repository': Repository(repository_spec=other_repo_spec,
+                                                     path=tmpdir.join('randomjunk').strpath)}]
+
+    res = list_action.format_as_lockfile(repo_list, lockfile_freeze=True)
+    log.debug('res: |%s|', res)
+
+    res_data = yaml.safe_load(res)
+    assert res_data == {'testns.testcollection': {'version': '1.2.3',
+                                                  'download_url': 'http://example.invalid/download/testns-testcollection-1.2.3.tar.gz',
+                                                  'sha256': '0123456789abcdef'},
+                        'example.randomjunk': '==0.0.1'}
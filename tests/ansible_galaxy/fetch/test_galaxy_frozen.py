@@ -0,0 +1,81 @@
+import hashlib
+import logging
+
+import pytest
+import semantic_version
+
+from ansible_galaxy import exceptions
+from ansible_galaxy.fetch import galaxy_frozen
+from ansible_galaxy.models.repository_spec import FetchMethods
+from ansible_galaxy.models.requirement_spec import RequirementSpec
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_URL = 'http://example.invalid/download/some_namespace-some_name-9.3.245.tar.gz'
+ARTIFACT_DATA = b'not really a tar.gz'
+ARTIFACT_SHA256 = hashlib.sha256(ARTIFACT_DATA).hexdigest()
+
+
+def _req_spec(sha256=ARTIFACT_SHA256, download_url=DOWNLOAD_URL, frozen_version=semantic_version.Version('9.3.245')):
+    return RequirementSpec(namespace='some_namespace',
+                           name='some_name',
+                           version_spec='==9.3.245',
+                           frozen_version=frozen_version,
+                           fetch_method=FetchMethods.GALAXY_FROZEN,
+                           src=download_url,
+                           artifact_sha256=sha256)
+
+
+def test_galaxy_frozen_fetch_find(galaxy_context, requests_mock):
+    fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=_req_spec(), galaxy_context=galaxy_context)
+
+    res = fetcher.find()
+
+    log.debug('res: %s', res)
+
+    # no Galaxy API requests
+    assert requests_mock.call_count == 0
+    assert res['content']['version'] == semantic_version.Version('9.3.245')
+    assert res['custom']['download_url'] == DOWNLOAD_URL
+    assert res['custom']['artifact_sha256'] == ARTIFACT_SHA256
+
+
+def test_galaxy_frozen_fetch_find_no_download_url(galaxy_context):
+    fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=_req_spec(download_url=None), galaxy_context=galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyClientError, match='No download_url'):
+        fetcher.find()
+
+
+def test_galaxy_frozen_fetch_find_no_frozen_version(galaxy_context):
+    fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=_req_spec(frozen_version=None), galaxy_context=galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyClientError, match='No version'):
+        fetcher.find()
+
+
+@pytest.mark.parametrize("sha256", [ARTIFACT_SHA256, None])
+def test_galaxy_frozen_fetch_fetch(galaxy_context, requests_mock, sha256):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=_req_spec(sha256=sha256), galaxy_context=galaxy_context)
+    res = fetcher.fetch(find_results=fetcher.find())
+
+    try:
+        # small enough to be downloaded into memory
+        assert res['archive_path'] is None
+        assert res['archive_fileobj'].read() == ARTIFACT_DATA
+    finally:
+        fetcher.cleanup()
+
+
+def test_galaxy_frozen_fetch_fetch_sha256_mismatch(galaxy_context, requests_mock):
+    requests_mock.get(DOWNLOAD_URL, content=b'some other artifact')
+
+    fetcher = galaxy_frozen.GalaxyFrozenFetch(requirement_spec=_req_spec(), galaxy_context=galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyArtifactChksumError) as exc_info:
+        fetcher.fetch(find_results=fetcher.find())
+
+    assert exc_info.value.expected == ARTIFACT_SHA256
+    assert exc_info.value.actual == hashlib.sha256(b'some other artifact').hexdigest()
@@ -1,4 +1,6 @@
+import hashlib
 import logging
+import os
 
 import pytest
 
@@ -6,6 +8,7 @@ from ansible_galaxy import exceptions
 from ansible_galaxy.fetch import galaxy_url
 from ansible_galaxy.models.context import GalaxyContext
 from ansible_galaxy.models.requirement_spec import RequirementSpec
+from ansible_galaxy.rest_api import GalaxyAPI
 
 log = logging.getLogger(__name__)
 
@@ -66,32 +69,32 @@ def galaxy_url_fetch(galaxy_context_example_invalid):
 
 
 def test_galaxy_url_fetch_find(galaxy_url_fetch, requests_mock):
-    download_url = 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/artifact'
+    download_url = 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/artifact'
 
     requests_mock.get('http://example.invalid/api/',
                       json={'current_version': 'v2'})
 
     # get CollectionVersionList
-    requests_mock.get('http://example.invalid/api/v2/collections/some_ns/some_name/versions/',
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
                       json={
                           'count': 2,
                           'next': None,
                           'previous': None,
                           'results':
                           [{'version': '1.2.3',
-                            'href': 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/1.2.3/'},
+                            'href': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/1.2.3/'},
                            {'version': '9.3.245',
-                            'href': 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/'}]})
+                            'href': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/'}]})
 
     # The request to get the CollectionVersion detail via href from CollectionVersion list
-    requests_mock.get('http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/',
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/',
                       json={'download_url': download_url,
-                            'metadata': {},
+                            'metadata': {'dependencies': {'some_namespace.some_dep': '>=1.0.0'}},
                             'version': '9.3.245'})
 
     # The Collection detail
     requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/',
-                      json={'versions_url': 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/'})
+                      json={'versions_url': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/'})
 
     res = galaxy_url_fetch.find()
 
@@ -101,6 +104,39 @@ def test_galaxy_url_fetch_find(galaxy_url_fetch, requests_mock):
     assert res['content']['repo_name'] == 'some_name'
 
     assert res['custom']['download_url'] == download_url
+    assert res['custom']['dependencies'] == {'some_namespace.some_dep': '>=1.0.0'}
+
+
+def test_galaxy_url_fetch_find_shared_galaxy_api(galaxy_context_example_invalid, requests_mock):
+    requests_mock.get('http://example.invalid/api/',
+                      json={'current_version': 'v2'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/',
+                      json={'versions_url': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '9.3.245',
+                                         'href': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/'}]})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/',
+                      json={'download_url': 'http://example.invalid/download/some_namespace-some_name-9.3.245.tar.gz',
+                            'version': '9.3.245'})
+
+    api = GalaxyAPI(galaxy_context_example_invalid)
+
+    # ie, two collections that require the same collection
+    for req_version_spec in ('>=9.0.0', '==9.3.245'):
+        req_spec = RequirementSpec(namespace='some_namespace',
+                                   name='some_name',
+                                   version_spec=req_version_spec)
+        fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec,
+                                            galaxy_context=galaxy_context_example_invalid,
+                                            galaxy_api=api)
+        res = fetcher.find()
+
+        assert str(res['content']['version']) == '9.3.245'
+
+    # the api version, detail, versions list and version detail are only requested once
+    assert requests_mock.call_count == 4
 
 
 def test_galaxy_url_fetch_find_no_repo_data(galaxy_url_fetch, galaxy_context, requests_mock):
@@ -108,6 +144,9 @@ def test_galaxy_url_fetch_find_no_repo_data(galaxy_url_fetch, galaxy_context, re
                       json={'current_version': 'v2'})
     requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/',
                       json={})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                      status_code=404,
+                      json={'code': 'not_found', 'message': 'Not found.'})
 
     # galaxy_url_fetch = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=context)
     # - sorry, some_namespace.some_name (version_spec: ==9.3.245) was not found on http://galaxy.invalid/.
@@ -119,12 +158,67 @@ def test_galaxy_url_fetch_find_no_repo_data(galaxy_url_fetch, galaxy_context, re
     log.debug('exc_info:%s', exc_info)
 
 
+def test_galaxy_url_fetch_find_other_versions_url(galaxy_url_fetch, requests_mock):
+    download_url = 'http://example.invalid/download/some_namespace-some_name-9.3.245.tar.gz'
+
+    requests_mock.get('http://example.invalid/api/',
+                      json={'current_version': 'v2'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/',
+                      json={'versions_url': 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/'})
+    # the versions list url derived from the namespace and name isn't the one the detail points to
+    derived_versions = requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                                         status_code=404,
+                                         json={'code': 'not_found', 'message': 'Not found.'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_ns/some_name/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '9.3.245',
+                                         'href': 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/'}]})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/',
+                      json={'download_url': download_url,
+                            'version': '9.3.245'})
+
+    res = galaxy_url_fetch.find()
+
+    assert derived_versions.called
+    assert res['custom']['download_url'] == download_url
+
+
+def test_galaxy_url_fetch_find_versions_list_has_download_url(galaxy_url_fetch, requests_mock):
+    download_url = 'http://example.invalid/download/some_namespace-some_name-9.3.245.tar.gz'
+
+    requests_mock.get('http://example.invalid/api/',
+                      json={'current_version': 'v2'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/',
+                      json={'versions_url': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/'})
+    requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '9.3.245',
+                                         'href': 'http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/',
+                                         'download_url': download_url,
+                                         'artifact': {'sha256': 'abc123'}}]})
+    version_detail = requests_mock.get('http://example.invalid/api/v2/collections/some_namespace/some_name/versions/9.3.245/',
+                                       json={'download_url': download_url,
+                                             'version': '9.3.245'})
+
+    res = galaxy_url_fetch.find()
+
+    assert res['custom']['download_url'] == download_url
+    assert res['custom']['artifact_sha256'] == 'abc123'
+    # the versions list didn't include the metadata, so the dependencies aren't known yet
+    assert res['custom']['dependencies'] is None
+    # the versions list already had everything needed
+    assert not version_detail.called
+
+
 def test_galaxy_url_fetch_fetch(galaxy_url_fetch, mocker, requests_mock):
     download_url = 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/artifact'
     collection_path = '/dev/null/path/to/collection.tar.gz'
 
-    mocked_download_fetch_url = mocker.patch('ansible_galaxy.fetch.galaxy_url.download.fetch_url', autospec=True)
-    mocked_download_fetch_url.return_value = collection_path
+    mocked_download_fetch_url = mocker.patch('ansible_galaxy.fetch.galaxy_url.download.fetch_artifact', autospec=True)
+    mocked_download_fetch_url.return_value = {'archive_path': collection_path,
+                                              'sha256': 'some_sha256'}
 
     # download_url = 'http://example.invalid/invalid/whatever'
     find_results = {'content': {'galaxy_namespace': 'some_namespace',
@@ -146,6 +240,24 @@ def test_galaxy_url_fetch_fetch(galaxy_url_fetch, mocker, requests_mock):
     assert isinstance(res['content'], dict)
 
 
+def test_galaxy_url_fetch_fetch_sha256_mismatch(galaxy_url_fetch, requests_mock):
+    download_url = 'http://example.invalid/download/some_namespace-some_name-9.3.245.tar.gz'
+    requests_mock.get(download_url, content=b'not the published artifact')
+
+    find_results = {'content': {'galaxy_namespace': 'some_namespace',
+                                'repo_name': 'some_name',
+                                'version': '9.3.245'},
+                    'custom': {'download_url': download_url,
+                               'artifact_sha256': hashlib.sha256(b'the published artifact').hexdigest()},
+                    }
+
+    with pytest.raises(exceptions.GalaxyArtifactChksumError):
+        galaxy_url_fetch.fetch(find_results)
+
+    # nothing left behind to install from
+    assert galaxy_url_fetch.local_path is None
+
+
 # Note that select_collection_version just gets the full version object
 # from repoversions. It does not sort or compare versions aside from equality
 @pytest.mark.parametrize("repoversions,version,expected", [
@@ -207,3 +319,74 @@ def test_select_collection_version_empty_repoversions():
 
     assert isinstance(res, dict)
     assert res == {}
+
+
+def test_galaxy_url_fetch_fetch_artifact_cache(galaxy_context_example_invalid, tmpdir, mocker):
+    galaxy_context_example_invalid.options['cache_path'] = tmpdir.mkdir('cache').strpath
+
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='==9.3.245')
+    download_url = 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/artifact'
+
+    downloaded_artifact = tmpdir.join('tmp-ansible-galaxy-content-archive-blip.tar.gz')
+    downloaded_artifact.write_binary(b'not really a tar.gz')
+
+    mocked_download_fetch_url = mocker.patch('ansible_galaxy.fetch.galaxy_url.download.fetch_artifact', autospec=True)
+    mocked_download_fetch_url.return_value = {'archive_path': downloaded_artifact.strpath,
+                                              'sha256': 'the_downloaded_sha256'}
+
+    find_results = {'content': {'galaxy_namespace': 'some_namespace',
+                                'repo_name': 'some_name',
+                                'version': '9.3.245'},
+                    'custom': {'download_url': download_url},
+                    }
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=galaxy_context_example_invalid)
+    res = fetcher.fetch(find_results)
+
+    assert mocked_download_fetch_url.call_count == 1
+    assert res['archive_path'].endswith('some_namespace-some_name-9.3.245.tar.gz')
+
+    # the sha256 computed while downloading is recorded instead of reading the artifact again
+    with open(res['archive_path'] + '.sha256', 'r') as sha256_fo:
+        assert sha256_fo.read() == 'the_downloaded_sha256'
+
+    # cleanup() leaves the cached artifact alone
+    fetcher.cleanup()
+    assert os.path.isfile(res['archive_path'])
+
+    # a second fetch of the same version uses the cached artifact
+    other_fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=galaxy_context_example_invalid)
+    other_res = other_fetcher.fetch(find_results)
+
+    assert mocked_download_fetch_url.call_count == 1
+    assert other_res['archive_path'] == res['archive_path']
+
+
+def test_galaxy_url_fetch_fetch_stream_downloads(galaxy_context_example_invalid, mocker):
+    galaxy_context_example_invalid.options['stream_downloads'] = True
+
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='==9.3.245')
+    download_url = 'http://example.invalid/api/v2/collections/some_ns/some_name/versions/9.3.245/artifact'
+
+    mocked_download_fetch_url = mocker.patch('ansible_galaxy.fetch.galaxy_url.download.fetch_artifact', autospec=True)
+
+    find_results = {'content': {'galaxy_namespace': 'some_namespace',
+                                'repo_name': 'some_name',
+                                'version': '9.3.245'},
+                    'custom': {'download_url': download_url},
+                    }
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=galaxy_context_example_invalid)
+    res = fetcher.fetch(find_results)
+
+    # nothing is downloaded until install
+    assert mocked_download_fetch_url.call_count == 0
+    assert res['archive_path'] is None
+    assert res['stream_url'] == download_url
+
+    # and there is no tmp file to clean up
+    fetcher.cleanup()
@@ -0,0 +1,54 @@
+import logging
+import os
+
+from ansible_galaxy import http_transfer
+from ansible_galaxy.fetch import remote_url
+from ansible_galaxy.models.context import GalaxyContext
+from ansible_galaxy.models.repository_spec import FetchMethods
+from ansible_galaxy.models.requirement_spec import RequirementSpec
+
+log = logging.getLogger(__name__)
+
+REMOTE_URL = 'http://example.invalid/downloads/some_namespace-some_name-1.2.3.tar.gz'
+
+
+def _req_spec():
+    return RequirementSpec(namespace='some_namespace',
+                           name='some_name',
+                           fetch_method=FetchMethods.REMOTE_URL,
+                           src=REMOTE_URL)
+
+
+def test_remote_url_fetch(galaxy_context, requests_mock):
+    requests_mock.get(REMOTE_URL, content=b'not really a tar.gz')
+
+    fetcher = remote_url.RemoteUrlFetch(requirement_spec=_req_spec(), galaxy_context=galaxy_context)
+
+    res = fetcher.fetch(find_results=fetcher.find())
+
+    log.debug('res: %s', res)
+
+    try:
+        with open(res['archive_path'], 'rb') as archive_fo:
+            assert archive_fo.read() == b'not really a tar.gz'
+    finally:
+        os.unlink(res['archive_path'])
+
+    assert res['custom']['remote_url'] == REMOTE_URL
+
+
+def test_remote_url_fetch_transfer_policy(galaxy_context, mocker):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server=galaxy_context.server,
+                            options={'http_retries': 7,
+                                     'download_max_connections': 2})
+
+    mock_fetch_url = mocker.patch('ansible_galaxy.fetch.remote_url.download.fetch_url',
+                                  return_value='/dev/null/some_namespace-some_name-1.2.3.tar.gz')
+
+    fetcher = remote_url.RemoteUrlFetch(requirement_spec=_req_spec(), galaxy_context=context)
+    fetcher.fetch(find_results=fetcher.find())
+
+    # the configured timeouts, retries and download limits apply
+    assert mock_fetch_url.call_args[1]['transfer_policy'] == http_transfer.policy(context)
+    assert mock_fetch_url.call_args[1]['transfer_policy'].retries == 7
@@ -0,0 +1,60 @@
+import logging
+import time
+
+import pytest
+
+from ansible_galaxy import api_version_cache
+
+log = logging.getLogger(__name__)
+
+SERVER_URL = 'http://bogus.invalid:9443'
+
+
+@pytest.fixture
+def cached_galaxy_context(galaxy_context, tmpdir):
+    galaxy_context.options['cache_path'] = tmpdir.mkdir('cache').strpath
+    return galaxy_context
+
+
+def test_get_not_cached(galaxy_context):
+    assert api_version_cache.get(galaxy_context, SERVER_URL) is None
+
+
+def test_put_get(galaxy_context):
+    api_version_cache.put(galaxy_context, SERVER_URL, 'v1')
+
+    assert api_version_cache.get(galaxy_context, SERVER_URL) == 'v1'
+    assert api_version_cache.get(galaxy_context, 'http://other.invalid') is None
+
+
+def test_get_persisted(cached_galaxy_context, monkeypatch):
+    api_version_cache.put(cached_galaxy_context, SERVER_URL, 'v1')
+
+    # a new process
+    monkeypatch.setattr('ansible_galaxy.api_version_cache._versions', {})
+
+    assert api_version_cache.get(cached_galaxy_context, SERVER_URL) == 'v1'
+
+
+def test_get_persisted_expired(cached_galaxy_context, monkeypatch):
+    cached_galaxy_context.options['api_version_cache_ttl'] = 60
+
+    api_version_cache.put(cached_galaxy_context, SERVER_URL, 'v1')
+
+    monkeypatch.setattr('ansible_galaxy.api_version_cache._versions', {})
+    later = time.time() + 61
+    monkeypatch.setattr('ansible_galaxy.api_version_cache.time.time', lambda: later)
+
+    assert api_version_cache.get(cached_galaxy_context, SERVER_URL) is None
+
+
+def test_invalidate(cached_galaxy_context, monkeypatch):
+    api_version_cache.put(cached_galaxy_context, SERVER_URL, 'v1')
+
+    api_version_cache.invalidate(cached_galaxy_context, SERVER_URL)
+
+    assert api_version_cache.get(cached_galaxy_context, SERVER_URL) is None
+
+    monkeypatch.setattr('ansible_galaxy.api_version_cache._versions', {})
+
+    assert api_version_cache.get(cached_galaxy_context, SERVER_URL) is None
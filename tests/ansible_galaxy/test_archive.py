@@ -1,4 +1,5 @@
 
+import io
 import logging
 import os
 import shutil
@@ -6,6 +7,8 @@ import tarfile
 import tempfile
 import pprint
 
+import pytest
+
 from ansible_galaxy import archive
 from ansible_galaxy import exceptions
 
@@ -266,6 +269,174 @@ def test_extract_files_tmp(mocker):
     shutil.rmtree(tmp_dir)
 
 
+def _build_tar(tmpdir, members):
+    '''members is a list of (name, data) for files, or (name, None, linkname) for symlinks'''
+    tar_path = tmpdir.join('some_archive.tar.gz').strpath
+
+    with tarfile.open(tar_path, mode='w:gz') as tar_file:
+        for member in members:
+            tar_info = tarfile.TarInfo(member[0])
+
+            if member[1] is None:
+                tar_info.type = tarfile.SYMTYPE
+                tar_info.linkname = member[2]
+                tar_file.addfile(tar_info)
+                continue
+
+            tar_info.size = len(member[1])
+            tar_info.mode = 0o644
+            tar_file.addfile(tar_info, io.BytesIO(member[1]))
+
+    return tarfile.open(tar_path, mode='r:gz')
+
+
+def test_extract_members(tmpdir):
+    tar_file = _build_tar(tmpdir, [('MANIFEST.json', b'{}'),
+                                   ('roles/some_role/tasks/main.yml', b'- debug: msg=hi'),
+                                   ('roles/some_role/meta/main.yml', b'{}'),
+                                   ('plugins/modules/some_module_link.py', None, '../some_module.py'),
+                                   ('plugins/some_module.py', b'# a module')])
+    dest_dir = tmpdir.join('dest').strpath
+
+    res = list(archive.extract_members(tar_file, dest_dir))
+
+    log.debug('res: %s', res)
+
+    assert len(res) == 5
+    assert os.path.isfile(os.path.join(dest_dir, 'roles/some_role/tasks/main.yml'))
+    assert os.path.islink(os.path.join(dest_dir, 'plugins/modules/some_module_link.py'))
+
+    with open(os.path.join(dest_dir, 'plugins/modules/some_module_link.py'), 'rb') as module_fd:
+        assert module_fd.read() == b'# a module'
+
+
+def test_extract_members_getmember_not_used(tmpdir, mocker):
+    tar_file = _build_tar(tmpdir, [('file_%s.txt' % x, b'blip') for x in range(50)])
+    mock_getmember = mocker.patch.object(tar_file, 'getmember')
+
+    res = list(archive.extract_members(tar_file, tmpdir.join('dest').strpath))
+
+    assert len(res) == 50
+    assert mock_getmember.call_count == 0
+
+
+@pytest.mark.parametrize('members', [
+    [('../outside.txt', b'evil')],
+    [('some_dir/../../outside.txt', b'evil')],
+    [('/tmp/outside.txt', b'evil')],
+    [('some_link', None, '../../outside')],
+    [('some_link', None, '/etc/passwd')],
+])
+def test_extract_members_outside_dest_dir(tmpdir, members):
+    tar_file = _build_tar(tmpdir, [('MANIFEST.json', b'{}')] + members)
+    dest_dir = tmpdir.join('dest').strpath
+
+    with pytest.raises(exceptions.GalaxyArchiveError):
+        list(archive.extract_members(tar_file, dest_dir))
+
+    # nothing is extracted if any member is bad
+    assert not os.path.exists(os.path.join(dest_dir, 'MANIFEST.json'))
+
+
+@pytest.mark.parametrize('members', [
+    # a second 'a/b/f' written through the first one
+    [('a/b/t', None, '../..'),
+     ('a/b/f', None, 't/../escaped.txt'),
+     ('a/b/f', b'evil')],
+    # same name, a file then a symlink
+    [('a/b/f', b'fine'),
+     ('a/b/f', None, '../b/g')],
+])
+def test_extract_members_duplicate_names(tmpdir, members):
+    tar_file = _build_tar(tmpdir, [('MANIFEST.json', b'{}')] + members)
+    dest_dir = tmpdir.join('dest').strpath
+
+    with pytest.raises(exceptions.GalaxyArchiveError, match='more than one member'):
+        list(archive.extract_members(tar_file, dest_dir))
+
+    assert not os.path.exists(os.path.join(dest_dir, 'MANIFEST.json'))
+    assert not tmpdir.join('escaped.txt').check()
+
+
+@pytest.mark.parametrize('members', [
+    # the link text looks fine, but 't' already points at the top of dest_dir
+    [('a/b/t', None, '../..'),
+     ('a/b/f', None, 't/../escaped.txt')],
+    # 'l1' only points outside once 'l2' is extracted after it
+    [('a/l1', None, 'l2/..'),
+     ('a/l2', None, '..')],
+])
+def test_extract_members_chained_symlinks(tmpdir, members):
+    tar_file = _build_tar(tmpdir, members + [('a/b/after.txt', b'after')])
+    dest_dir = tmpdir.join('dest').strpath
+
+    with pytest.raises(exceptions.GalaxyArchiveError, match='outside of'):
+        list(archive.extract_members(tar_file, dest_dir))
+
+    assert not tmpdir.join('escaped.txt').check()
+
+
+def test_extract_members_symlink_in_dest_dir(tmpdir):
+    tar_file = _build_tar(tmpdir, [('MANIFEST.json', b'{}')])
+    dest_dir = tmpdir.mkdir('dest')
+    tmpdir.join('elsewhere.json').write('{"elsewhere": true}')
+    dest_dir.join('MANIFEST.json').mksymlinkto(tmpdir.join('elsewhere.json'))
+
+    list(archive.extract_members(tar_file, dest_dir.strpath, force_overwrite=True))
+
+    # the symlink was replaced, not written through
+    assert not dest_dir.join('MANIFEST.json').islink()
+    assert dest_dir.join('MANIFEST.json').read() == '{}'
+    assert tmpdir.join('elsewhere.json').read() == '{"elsewhere": true}'
+
+
+def test_extract_stream_files(tmpdir):
+    _build_tar(tmpdir, [('MANIFEST.json', b'{}'),
+                        ('plugins/modules/some_module_link.py', None, '../some_module.py'),
+                        ('plugins/some_module.py', b'# a module')])
+    dest_dir = tmpdir.join('dest').strpath
+
+    with tarfile.open(tmpdir.join('some_archive.tar.gz').strpath, mode='r|gz') as tar_file:
+        res = list(archive.extract_stream_files(tar_file, dest_dir))
+
+    assert len(res) == 3
+    assert os.path.islink(os.path.join(dest_dir, 'plugins/modules/some_module_link.py'))
+
+
+@pytest.mark.parametrize('members', [
+    # 's' is a symlink to the parent of dest_dir by the time the file in it is written
+    [('a/b/t', None, '../..'),
+     ('a/b/s', None, 't/..'),
+     ('a/b/s/escaped.txt', b'evil')],
+    [('a/b/t', None, '../..'),
+     ('a/b/f', None, 't/../escaped.txt'),
+     ('a/b/f', b'evil')],
+])
+def test_extract_stream_files_outside_dest_dir(tmpdir, members):
+    _build_tar(tmpdir, members)
+    dest_dir = tmpdir.join('dest').strpath
+
+    with tarfile.open(tmpdir.join('some_archive.tar.gz').strpath, mode='r|gz') as tar_file:
+        with pytest.raises(exceptions.GalaxyArchiveError):
+            list(archive.extract_stream_files(tar_file, dest_dir))
+
+    assert not tmpdir.join('escaped.txt').check()
+
+
+def test_extract_members_exists(tmpdir):
+    tar_file = _build_tar(tmpdir, [('MANIFEST.json', b'{}')])
+    dest_dir = tmpdir.mkdir('dest')
+    dest_dir.join('MANIFEST.json').write('{"old": true}')
+
+    with pytest.raises(exceptions.GalaxyClientError, match='appears to already exist'):
+        list(archive.extract_members(tar_file, dest_dir.strpath))
+
+    res = list(archive.extract_members(tar_file, dest_dir.strpath, force_overwrite=True))
+
+    assert res == [dest_dir.join('MANIFEST.json').strpath]
+    assert dest_dir.join('MANIFEST.json').read() == '{}'
+
+
 foo = {'content_archive_type': 'multi-content',
        'content_type': None,
        'content_type_requires_meta': True,
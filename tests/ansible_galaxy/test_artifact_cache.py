@@ -0,0 +1,100 @@
+import logging
+import os
+
+import pytest
+
+from ansible_galaxy import artifact_cache
+from ansible_galaxy.models.context import GalaxyContext
+from ansible_galaxy.utils import chksums
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return artifact_cache.ArtifactCache(tmpdir.mkdir('artifacts').strpath)
+
+
+@pytest.fixture
+def some_artifact(tmpdir):
+    artifact = tmpdir.join('tmp-ansible-galaxy-content-archive-blip.tar.gz')
+    artifact.write_binary(b'not really a tar.gz')
+    return artifact.strpath
+
+
+def test_get_not_enabled(galaxy_context):
+    assert artifact_cache.get(galaxy_context) is None
+
+
+def test_get(tmpdir):
+    context = GalaxyContext(options={'cache_path': tmpdir.strpath})
+    res = artifact_cache.get(context)
+
+    assert isinstance(res, artifact_cache.ArtifactCache)
+    assert res.path == os.path.join(tmpdir.strpath, 'artifacts')
+
+
+@pytest.mark.parametrize("filename,expected", [
+    ('alikins-some_collection-1.2.3.tar.gz', ('alikins', 'some_collection', '1.2.3')),
+    ('http://example.invalid/download/ns-n-1.0.0-beta.1.tar.gz', ('ns', 'n', '1.0.0-beta.1')),
+    ('http://myci.example.com/somebuildjob/latest', None),
+    ('ns-n-1.0.0.zip', None),
+    (None, None),
+])
+def test_parse_artifact_filename(filename, expected):
+    assert artifact_cache.parse_artifact_filename(filename) == expected
+
+
+def test_cache_miss(cache):
+    assert cache.get('some_ns', 'some_name', '1.2.3') is None
+
+
+def test_cache_put_get(cache, some_artifact):
+    expected_sha256 = chksums.sha256sum_from_path(some_artifact)
+
+    cached_path = cache.put(some_artifact, 'some_ns', 'some_name', '1.2.3')
+
+    assert cached_path == cache.artifact_path('some_ns', 'some_name', '1.2.3')
+    assert os.path.basename(cached_path) == 'some_ns-some_name-1.2.3.tar.gz'
+
+    # the artifact is moved into the cache
+    assert not os.path.exists(some_artifact)
+    assert os.path.isfile(cached_path)
+
+    assert cache.get('some_ns', 'some_name', '1.2.3') == cached_path
+    assert cache.get('some_ns', 'some_name', '1.2.3', sha256=expected_sha256) == cached_path
+
+    # no leftover tmp files
+    assert sorted(os.listdir(os.path.dirname(cached_path))) == ['some_ns-some_name-1.2.3.tar.gz',
+                                                                'some_ns-some_name-1.2.3.tar.gz.sha256']
+
+
+def test_cache_get_sha256_mismatch(cache, some_artifact):
+    cache.put(some_artifact, 'some_ns', 'some_name', '1.2.3')
+
+    assert cache.get('some_ns', 'some_name', '1.2.3', sha256='deadbeef') is None
+
+
+def test_cache_get_no_sha256_record(cache, some_artifact):
+    cached_path = cache.put(some_artifact, 'some_ns', 'some_name', '1.2.3')
+    os.unlink(cached_path + artifact_cache.SHA256_SUFFIX)
+
+    assert cache.get('some_ns', 'some_name', '1.2.3') is None
+
+
+def test_cache_put_interrupted(cache, some_artifact, tmpdir, mocker):
+    cache.put(some_artifact, 'some_ns', 'some_name', '1.2.3', source={'url': 'http://example.invalid/blip.tar.gz'})
+
+    other_artifact = tmpdir.join('tmp-ansible-galaxy-content-archive-other.tar.gz')
+    other_artifact.write_binary(b'some other not a tar.gz')
+
+    # ie, killed while replacing the cached artifact
+    mocker.patch('ansible_galaxy.artifact_cache.os.chmod', side_effect=KeyboardInterrupt)
+
+    with pytest.raises(KeyboardInterrupt):
+        cache.put(other_artifact.strpath, 'some_ns', 'some_name', '1.2.3')
+
+    # the old records are gone, so the cached artifact is not trusted either way
+    cached_path = cache.artifact_path('some_ns', 'some_name', '1.2.3')
+    assert cache.get('some_ns', 'some_name', '1.2.3') is None
+    assert cache.source(cached_path) is None
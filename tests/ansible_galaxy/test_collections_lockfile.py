@@ -2,10 +2,12 @@ import logging
 import os
 
 import pytest
+import semantic_version
 
 from ansible_galaxy import collections_lockfile
 from ansible_galaxy import exceptions
 from ansible_galaxy.models.collections_lockfile import CollectionsLockfile
+from ansible_galaxy.models.repository_spec import FetchMethods
 
 log = logging.getLogger(__name__)
 
@@ -74,3 +76,69 @@ def test_load_not_dict():
             collections_lockfile.load(lfd)
 
     log.debug('exc_info: %s', exc_info)
+
+
+def test_load_frozen_urls():
+    lockfile_path = os.path.join(EXAMPLE_LOCKFILE_DIR,
+                                 'frozen_urls.yml')
+
+    with open(lockfile_path, 'r') as lfd:
+        lockfile = collections_lockfile.load(lfd)
+
+    assert lockfile.dependencies['alikins.collection_inspect']['version'] == '1.0.0'
+
+    res = collections_lockfile.dependencies_dict(lockfile)
+
+    assert res == {'alikins.collection_inspect': '==1.0.0',
+                   'alikins.collection_ntp': '==2.0.0'}
+
+
+def test_frozen_requirements():
+    lockfile = CollectionsLockfile(dependencies={
+        'alikins.collection_inspect': {'version': '1.0.0',
+                                       'download_url': 'https://galaxy.example.com/download/alikins-collection_inspect-1.0.0.tar.gz',
+                                       'sha256': '0123456789abcdef'}})
+
+    res = collections_lockfile.frozen_requirements(lockfile)
+
+    req_spec = res[0].requirement_spec
+    assert req_spec.namespace == 'alikins'
+    assert req_spec.name == 'collection_inspect'
+    assert str(req_spec.version_spec) == '==1.0.0'
+    assert req_spec.frozen_version == semantic_version.Version('1.0.0')
+    assert req_spec.fetch_method == FetchMethods.GALAXY_FROZEN
+    assert req_spec.src == 'https://galaxy.example.com/download/alikins-collection_inspect-1.0.0.tar.gz'
+    assert req_spec.artifact_sha256 == '0123456789abcdef'
+
+
+def test_frozen_requirements_invalid_version():
+    lockfile = CollectionsLockfile(dependencies={
+        'alikins.collection_inspect': {'version': 'latest',
+                                       'download_url': 'https://galaxy.example.com/download/alikins-collection_inspect-1.0.0.tar.gz'}})
+
+    with pytest.raises(exceptions.GalaxyClientError, match='alikins.collection_inspect has an invalid "version"'):
+        collections_lockfile.frozen_requirements(lockfile)
+
+
+def test_frozen_requirements_not_frozen():
+    lockfile_path = os.path.join(EXAMPLE_LOCKFILE_DIR,
+                                 'frozen_urls.yml')
+
+    with open(lockfile_path, 'r') as lfd:
+        lockfile = collections_lockfile.load(lfd)
+
+    with pytest.raises(exceptions.GalaxyClientError, match='alikins.collection_ntp is not frozen'):
+        collections_lockfile.frozen_requirements(lockfile)
+
+
+FROZEN_DOWNLOAD_URL = 'https://galaxy.example.com/download/ns-n-1.2.3.tar.gz'
+
+
+@pytest.mark.parametrize("download_url,expected", [
+    (None, '==1.2.3'),
+    (FROZEN_DOWNLOAD_URL, {'version': '1.2.3', 'download_url': FROZEN_DOWNLOAD_URL, 'sha256': 'abcd'}),
+])
+def test_frozen_entry(download_url, expected):
+    res = collections_lockfile.frozen_entry('1.2.3', download_url=download_url, sha256='abcd')
+
+    assert res == expected
@@ -0,0 +1,322 @@
+import hashlib
+import logging
+import os
+import threading
+
+import pytest
+import requests
+
+import galaxy_stand_in as galaxy_stand_in_py
+
+from ansible_galaxy import download
+from ansible_galaxy import exceptions
+from ansible_galaxy import http_transfer
+
+log = logging.getLogger(__name__)
+
+DOWNLOAD_URL = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+ARTIFACT_DATA = b'not really a tar.gz' * 100
+ARTIFACT_SHA256 = hashlib.sha256(ARTIFACT_DATA).hexdigest()
+
+
+@pytest.fixture
+def tmp_downloads(tmpdir, monkeypatch):
+    # so any temp files left behind can be found
+    tmp_path = tmpdir.mkdir('tmp')
+    monkeypatch.setattr('tempfile.tempdir', tmp_path.strpath)
+    return tmp_path
+
+
+def test_fetch_artifact(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    res = download.fetch_artifact(DOWNLOAD_URL, expected_sha256=ARTIFACT_SHA256, expected_size=len(ARTIFACT_DATA))
+
+    log.debug('res: %s', res)
+
+    assert res['sha256'] == ARTIFACT_SHA256
+    assert res['size'] == len(ARTIFACT_DATA)
+
+    with open(res['archive_path'], 'rb') as artifact_fo:
+        assert artifact_fo.read() == ARTIFACT_DATA
+
+
+def test_fetch_artifact_sha256_mismatch(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=b'some other artifact')
+
+    with pytest.raises(exceptions.GalaxyArtifactChksumError) as exc_info:
+        download.fetch_artifact(DOWNLOAD_URL, expected_sha256=ARTIFACT_SHA256)
+
+    assert exc_info.value.url == DOWNLOAD_URL
+    assert exc_info.value.expected == ARTIFACT_SHA256
+    assert exc_info.value.actual == hashlib.sha256(b'some other artifact').hexdigest()
+
+    # the bad artifact is not left around
+    assert os.listdir(tmp_downloads.strpath) == []
+
+
+@pytest.mark.parametrize("expected_size", [len(ARTIFACT_DATA) - 1, len(ARTIFACT_DATA) + 1])
+def test_fetch_artifact_size_mismatch(requests_mock, tmp_downloads, expected_size):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    with pytest.raises(exceptions.GalaxyDownloadError, match='bytes'):
+        download.fetch_artifact(DOWNLOAD_URL, expected_size=expected_size)
+
+    assert os.listdir(tmp_downloads.strpath) == []
+
+
+def test_fetch_artifact_http_error(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, status_code=404)
+
+    with pytest.raises(exceptions.GalaxyDownloadError):
+        download.fetch_artifact(DOWNLOAD_URL)
+
+    assert os.listdir(tmp_downloads.strpath) == []
+
+
+def test_fetch_artifact_spooled(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    res = download.fetch_artifact(DOWNLOAD_URL, expected_sha256=ARTIFACT_SHA256,
+                                  spool_max_size=len(ARTIFACT_DATA))
+
+    assert res['archive_path'] is None
+    assert res['sha256'] == ARTIFACT_SHA256
+    assert res['archive_fileobj'].read() == ARTIFACT_DATA
+
+    # nothing was written to disk
+    assert os.listdir(tmp_downloads.strpath) == []
+
+
+def test_fetch_artifact_spooled_rolls_over(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    # the size isn't known ahead of time, so it starts in memory
+    res = download.fetch_artifact(DOWNLOAD_URL, spool_max_size=100)
+
+    assert res['archive_fileobj'].read() == ARTIFACT_DATA
+    res['archive_fileobj'].close()
+
+
+def test_fetch_artifact_too_big_to_spool(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    res = download.fetch_artifact(DOWNLOAD_URL, expected_size=len(ARTIFACT_DATA),
+                                  spool_max_size=100)
+
+    assert 'archive_fileobj' not in res
+    assert os.path.getsize(res['archive_path']) == len(ARTIFACT_DATA)
+
+
+def test_fetch_artifact_rate_limited(requests_mock, tmp_downloads, monkeypatch):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    sleeps = []
+    monkeypatch.setattr('ansible_galaxy.http_transfer._now', lambda: 1000.0 + sum(sleeps))
+    monkeypatch.setattr('ansible_galaxy.http_transfer._sleep', sleeps.append)
+
+    transfer_policy = http_transfer.TransferPolicy(download_rate_limit=1000)
+
+    res = download.fetch_artifact(DOWNLOAD_URL, transfer_policy=transfer_policy)
+
+    assert res['size'] == len(ARTIFACT_DATA)
+    # a second's worth of burst, the rest is owed by the next download
+    assert sleeps == []
+
+    download.fetch_artifact(DOWNLOAD_URL, transfer_policy=transfer_policy)
+
+    # paying off the 900 bytes owed, then waiting for a full second's worth again
+    assert sum(sleeps) == pytest.approx(1.9)
+
+
+@pytest.mark.parametrize("download_url,expected", [
+    ('https://galaxy.example.invalid/download/ns-n-1.0.0.tar.gz', 'http://mirror.example.invalid/galaxy/ns-n-1.0.0.tar.gz'),
+    ('https://galaxy.example.invalid/download/special/ns-n-1.0.0.tar.gz', 'http://special.example.invalid/ns-n-1.0.0.tar.gz'),
+    ('https://elsewhere.example.invalid/download/ns-n-1.0.0.tar.gz', None),
+])
+def test_mirror_url(galaxy_context, download_url, expected):
+    galaxy_context.options['download_mirrors'] = {
+        'https://galaxy.example.invalid/download/': 'http://mirror.example.invalid/galaxy/',
+        'https://galaxy.example.invalid/download/special/': 'http://special.example.invalid/',
+    }
+
+    assert download.mirror_url(download_url, galaxy_context) == expected
+
+
+def test_mirror_url_no_mirrors(galaxy_context):
+    assert download.mirror_url(DOWNLOAD_URL, galaxy_context) is None
+
+
+@pytest.mark.parametrize("status_code,expected", [(404, True), (403, False), (500, False)])
+def test_mirror_missed_http_error(requests_mock, tmp_downloads, status_code, expected):
+    requests_mock.get(DOWNLOAD_URL, status_code=status_code)
+
+    with pytest.raises(exceptions.GalaxyDownloadError) as exc_info:
+        download.fetch_artifact(DOWNLOAD_URL, transfer_policy=http_transfer.TransferPolicy(retries=0))
+
+    assert download.mirror_missed(exc_info.value) is expected
+
+
+def test_mirror_missed_connection_error(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, exc=requests.exceptions.ConnectionError)
+
+    with pytest.raises(exceptions.GalaxyDownloadError) as exc_info:
+        download.fetch_artifact(DOWNLOAD_URL, transfer_policy=http_transfer.TransferPolicy(retries=0))
+
+    assert download.mirror_missed(exc_info.value)
+
+
+def test_mirror_missed_chksum_error():
+    assert not download.mirror_missed(exceptions.GalaxyArtifactChksumError('bad', url=DOWNLOAD_URL))
+
+
+def test_fetch_url(requests_mock, tmp_downloads):
+    requests_mock.get(DOWNLOAD_URL, content=ARTIFACT_DATA)
+
+    archive_path = download.fetch_url(DOWNLOAD_URL)
+
+    with open(archive_path, 'rb') as artifact_fo:
+        assert artifact_fo.read() == ARTIFACT_DATA
+
+
+@pytest.fixture
+def big_artifact(galaxy_stand_in):
+    artifact_path = galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path,
+                                                     'some_namespace', 'big', '1.0.0',
+                                                     padding=100000)
+    artifact_info = galaxy_stand_in.add_artifact(artifact_path)
+    artifact_info['url'] = '%s/download/%s' % (galaxy_stand_in.url, artifact_info['filename'])
+
+    return artifact_info
+
+
+def test_fetch_artifact_resumes(galaxy_stand_in, big_artifact, tmp_downloads):
+    # every response stops short, so it takes a few requests
+    galaxy_stand_in.drop_after = 40000
+
+    res = download.fetch_artifact(big_artifact['url'],
+                                  transfer_policy=http_transfer.TransferPolicy(retries=5),
+                                  expected_sha256=big_artifact['sha256'],
+                                  expected_size=big_artifact['size'])
+
+    assert res['sha256'] == big_artifact['sha256']
+    assert galaxy_stand_in.download_ranges[0] is None
+    assert len(galaxy_stand_in.download_ranges) > 2
+
+    # each resume starts where the last one stopped
+    resume_starts = [int(range_header[len('bytes='):-1]) for range_header in galaxy_stand_in.download_ranges[1:]]
+    assert resume_starts == sorted(resume_starts)
+    assert resume_starts[0] > 0
+
+
+def test_fetch_artifact_resume_not_supported(galaxy_stand_in, big_artifact, tmp_downloads):
+    galaxy_stand_in.drop_after = 40000
+    galaxy_stand_in.ranges = False
+
+    with pytest.raises(exceptions.GalaxyDownloadError):
+        download.fetch_artifact(big_artifact['url'],
+                                transfer_policy=http_transfer.TransferPolicy(retries=3))
+
+    # no point asking for the rest
+    assert galaxy_stand_in.download_ranges == [None]
+    assert os.listdir(tmp_downloads.strpath) == []
+
+
+def test_fetch_artifact_resume_artifact_changed(galaxy_stand_in, big_artifact, tmp_downloads, monkeypatch):
+    galaxy_stand_in.drop_after = 60000
+
+    # The If-Range will not match, so the server sends all of it again
+    monkeypatch.setattr('ansible_galaxy.download._validator', lambda resp: '"some_older_etag"')
+
+    with pytest.raises(exceptions.GalaxyDownloadError):
+        download.fetch_artifact(big_artifact['url'],
+                                transfer_policy=http_transfer.TransferPolicy(retries=2),
+                                expected_size=big_artifact['size'])
+
+    # but each full response is cut short too, so it never gets past the same point
+    assert len(galaxy_stand_in.download_ranges) == 3
+    assert galaxy_stand_in.download_ranges[1] == galaxy_stand_in.download_ranges[2]
+
+
+def test_fetch_artifact_segmented(galaxy_stand_in, big_artifact, tmp_downloads):
+    res = download.fetch_artifact(big_artifact['url'],
+                                  expected_sha256=big_artifact['sha256'],
+                                  expected_size=big_artifact['size'],
+                                  segment_count=4,
+                                  segment_min_size=1000)
+
+    assert res['sha256'] == big_artifact['sha256']
+    assert res['size'] == big_artifact['size']
+    assert len(galaxy_stand_in.download_ranges) == 4
+    assert all(range_header.startswith('bytes=') for range_header in galaxy_stand_in.download_ranges)
+
+
+def test_fetch_artifact_segmented_resumes(galaxy_stand_in, big_artifact, tmp_downloads):
+    galaxy_stand_in.drop_after = 20000
+
+    res = download.fetch_artifact(big_artifact['url'],
+                                  transfer_policy=http_transfer.TransferPolicy(retries=3),
+                                  expected_sha256=big_artifact['sha256'],
+                                  expected_size=big_artifact['size'],
+                                  segment_count=4,
+                                  segment_min_size=1000)
+
+    assert res['sha256'] == big_artifact['sha256']
+    # each ~25000 byte segment took more than one request
+    assert len(galaxy_stand_in.download_ranges) > 4
+
+
+def test_fetch_artifact_segmented_not_supported(galaxy_stand_in, big_artifact, tmp_downloads):
+    galaxy_stand_in.ranges = False
+
+    res = download.fetch_artifact(big_artifact['url'],
+                                  expected_sha256=big_artifact['sha256'],
+                                  expected_size=big_artifact['size'],
+                                  segment_count=4,
+                                  segment_min_size=1000)
+
+    assert res['sha256'] == big_artifact['sha256']
+    # one request for all of it
+    assert len(galaxy_stand_in.download_ranges) == 1
+
+
+def test_fetch_artifact_too_small_to_segment(galaxy_stand_in, big_artifact, tmp_downloads):
+    download.fetch_artifact(big_artifact['url'],
+                            expected_size=big_artifact['size'],
+                            segment_count=4,
+                            segment_min_size=big_artifact['size'] + 1)
+
+    assert galaxy_stand_in.download_ranges == [None]
+
+
+def test_fetch_artifact_segments_capped_by_max_connections(galaxy_stand_in, big_artifact, tmp_downloads):
+    res = download.fetch_artifact(big_artifact['url'],
+                                  transfer_policy=http_transfer.TransferPolicy(download_max_connections=2),
+                                  expected_sha256=big_artifact['sha256'],
+                                  expected_size=big_artifact['size'],
+                                  segment_count=4,
+                                  segment_min_size=1000)
+
+    assert res['sha256'] == big_artifact['sha256']
+    assert len(galaxy_stand_in.download_ranges) == 2
+
+
+def test_fetch_artifact_max_connections(galaxy_stand_in, big_artifact, tmp_downloads):
+    galaxy_stand_in.latency = 0.1
+    transfer_policy = http_transfer.TransferPolicy(download_max_connections=1)
+    results = []
+
+    def fetch():
+        results.append(download.fetch_artifact(big_artifact['url'],
+                                               transfer_policy=transfer_policy,
+                                               expected_sha256=big_artifact['sha256']))
+
+    threads = [threading.Thread(target=fetch) for dummy in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [res['sha256'] for res in results] == [big_artifact['sha256']] * 3
+    # one download at a time from the same host
+    assert galaxy_stand_in.max_in_flight == 1
@@ -0,0 +1,417 @@
+import hashlib
+import logging
+import os
+import time
+
+import pytest
+import requests
+
+import galaxy_stand_in as galaxy_stand_in_py
+
+from ansible_galaxy import exceptions
+from ansible_galaxy import http_transfer
+from ansible_galaxy import install
+from ansible_galaxy.actions import install as install_action
+from ansible_galaxy.fetch import galaxy_url
+from ansible_galaxy.models.context import GalaxyContext
+from ansible_galaxy import requirements
+from ansible_galaxy.models.requirement_spec import RequirementSpec
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def stand_in(galaxy_stand_in):
+    for version in ('1.0.0', '1.1.0', '2.0.0'):
+        artifact_path = galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path,
+                                                         'some_namespace', 'some_name', version,
+                                                         dependencies={'some_namespace.some_dep': '>=1.0.0'})
+        galaxy_stand_in.add_artifact(artifact_path)
+
+    return galaxy_stand_in
+
+
+@pytest.fixture
+def stand_in_context(galaxy_context, stand_in):
+    return GalaxyContext(collections_path=galaxy_context.collections_path,
+                         server={'url': stand_in.url,
+                                 'ignore_certs': False})
+
+
+def test_galaxy_stand_in_api(stand_in):
+    assert requests.get('%s/api/' % stand_in.url).json()['current_version'] == 'v2'
+
+    detail = requests.get('%s/api/v2/collections/some_namespace/some_name/' % stand_in.url).json()
+    assert detail['versions_url'] == '%s/api/v2/collections/some_namespace/some_name/versions/' % stand_in.url
+
+    version_detail = requests.get('%s/api/v2/collections/some_namespace/some_name/versions/1.1.0/' % stand_in.url).json()
+    assert version_detail['metadata']['dependencies'] == {'some_namespace.some_dep': '>=1.0.0'}
+
+    resp = requests.get(version_detail['download_url'])
+    assert resp.status_code == 200
+    assert int(resp.headers['Content-Length']) == version_detail['artifact']['size']
+    assert hashlib.sha256(resp.content).hexdigest() == version_detail['artifact']['sha256']
+
+
+def test_galaxy_stand_in_not_found(stand_in):
+    resp = requests.get('%s/api/v2/collections/some_namespace/not_a_name/' % stand_in.url)
+
+    assert resp.status_code == 404
+    assert resp.json()['code'] == 'not_found'
+
+
+def test_galaxy_stand_in_versions_pages(stand_in):
+    page = requests.get('%s/api/v2/collections/some_namespace/some_name/versions/?page_size=2' % stand_in.url).json()
+
+    assert page['count'] == 3
+    assert [version['version'] for version in page['results']] == ['1.0.0', '1.1.0']
+
+    next_page = requests.get(page['next']).json()
+
+    assert [version['version'] for version in next_page['results']] == ['2.0.0']
+    assert next_page['next'] is None
+
+
+def test_galaxy_stand_in_injected_errors_retried(stand_in):
+    stand_in.error_rate = 1.0
+    stand_in.retry_after = 0
+
+    session = requests.Session()
+    url = '%s/api/' % stand_in.url
+
+    resp = http_transfer.request(session, 'GET', url,
+                                 transfer_policy=http_transfer.TransferPolicy(retries=2))
+
+    assert resp.status_code == 503
+    assert len(stand_in.requests) == 3
+
+    stand_in.error_rate = 0
+
+    assert http_transfer.request(session, 'GET', url).status_code == 200
+
+
+def test_galaxy_stand_in_bandwidth(galaxy_stand_in):
+    artifact_path = galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path,
+                                                     'some_namespace', 'big', '1.0.0',
+                                                     padding=40000)
+    artifact_info = galaxy_stand_in.add_artifact(artifact_path)
+
+    galaxy_stand_in.bandwidth = artifact_info['size'] * 5
+
+    started = time.time()
+    resp = requests.get('%s/download/%s' % (galaxy_stand_in.url, artifact_info['filename']))
+    elapsed = time.time() - started
+
+    assert len(resp.content) == artifact_info['size']
+    # ~0.2s at 5 times the size per second
+    assert elapsed >= 0.15
+
+
+def test_galaxy_url_fetch_find_and_fetch(stand_in_context, stand_in):
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='<2.0.0')
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=stand_in_context)
+
+    find_results = fetcher.find()
+
+    assert str(find_results['content']['version']) == '1.1.0'
+    assert find_results['custom']['dependencies'] == {'some_namespace.some_dep': '>=1.0.0'}
+    assert find_results['custom']['artifact_sha256'] == \
+        stand_in.collections[('some_namespace', 'some_name')]['1.1.0']['sha256']
+
+    fetch_results = fetcher.fetch(find_results=find_results)
+
+    try:
+        assert len(fetch_results['archive_fileobj'].read()) == \
+            stand_in.collections[('some_namespace', 'some_name')]['1.1.0']['size']
+    finally:
+        fetcher.cleanup()
+
+
+def test_galaxy_url_fetch_find_overlaps_requests(stand_in_context, stand_in):
+    # With some latency, the collection detail and versions list requests should be in flight at once
+    stand_in.latency = 0.2
+
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='*')
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=stand_in_context)
+
+    stand_in.reset_stats()
+
+    fetcher.find()
+
+    log.debug('requests: %s', stand_in.requests)
+
+    assert stand_in.max_in_flight >= 2
+
+
+def test_galaxy_url_fetch_fetch_segmented(galaxy_context, stand_in):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': stand_in.url,
+                                    'ignore_certs': False},
+                            options={'download_segments': 3,
+                                     'download_segment_min_size': 1})
+
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='==2.0.0')
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=context)
+
+    fetch_results = fetcher.fetch(find_results=fetcher.find())
+
+    try:
+        assert os.path.getsize(fetch_results['archive_path']) == \
+            stand_in.collections[('some_namespace', 'some_name')]['2.0.0']['size']
+        assert len(stand_in.download_ranges) == 3
+    finally:
+        fetcher.cleanup()
+
+
+def test_install_downloaded_into_memory(stand_in_context, stand_in):
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='==1.0.0')
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=stand_in_context)
+
+    find_results = fetcher.find()
+    fetch_results = fetcher.fetch(find_results=find_results)
+
+    # no artifact cache, and a small artifact, so it never touched the disk
+    assert fetch_results['archive_path'] is None
+
+    repository_spec = install.repository_spec_from_find_results(find_results, req_spec)
+
+    res = install.install(stand_in_context, fetcher, fetch_results, repository_spec,
+                          display_callback=lambda *args, **kwargs: None)
+
+    assert str(res[0].repository_spec.version) == '1.0.0'
+    assert os.path.isfile(os.path.join(res[0].path, 'galaxy.yml'))
+
+    # install() cleaned up the fetcher
+    assert fetch_results['archive_fileobj'].closed
+
+
+def test_stream_downloads_staged_by_fetch_workers(galaxy_context, stand_in):
+    artifact_path = galaxy_stand_in_py.make_artifact(stand_in.artifacts_path,
+                                                     'some_namespace', 'some_dep', '1.0.0')
+    stand_in.add_artifact(artifact_path)
+
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': stand_in.url,
+                                    'ignore_certs': False},
+                            options={'stream_downloads': True,
+                                     'download_concurrency': 2})
+
+    install_plans = [install_action.find_repository(context, req, display_callback=lambda *args, **kwargs: None)
+                     for req in requirements.from_dependencies_dict({'some_namespace.some_name': '==1.0.0',
+                                                                     'some_namespace.some_dep': '==1.0.0'})]
+
+    # both downloads wait for this long, so they are only both done quickly if they overlap
+    stand_in.latency = 0.3
+    stand_in.reset_stats()
+
+    res = install_action._fetch_and_install_plans(context, install_plans,
+                                                  display_callback=lambda *args, **kwargs: None)
+
+    assert sorted([x.repository_spec.name for x in res]) == ['some_dep', 'some_name']
+    assert stand_in.max_in_flight == 2
+    assert len(stand_in.download_ranges) == 2
+
+    namespace_path = os.path.dirname(res[0].path)
+    assert sorted(os.listdir(namespace_path)) == ['some_dep', 'some_name']
+
+
+def test_stream_downloads_discarded_if_not_installed(galaxy_context, stand_in):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': stand_in.url,
+                                    'ignore_certs': False},
+                            options={'stream_downloads': True})
+
+    req = requirements.from_dependencies_dict({'some_namespace.some_name': '==1.0.0'})[0]
+    install_plan = install_action.find_repository(context, req, display_callback=lambda *args, **kwargs: None)
+
+    fetch_results = install_action.fetch_repository(install_plan, context)
+
+    staging_path = fetch_results['staged']['staging_path']
+    assert os.path.isfile(os.path.join(staging_path, 'MANIFEST.json'))
+
+    install.discard(install_plan.fetcher, fetch_results)
+
+    assert not os.path.exists(staging_path)
+
+
+@pytest.fixture
+def mirror(tmpdir):
+    server = galaxy_stand_in_py.GalaxyStandIn(tmpdir.mkdir('mirror_artifacts').strpath, seed=0)
+    server.start()
+
+    yield server
+
+    server.stop()
+
+
+def mirror_context(galaxy_context, stand_in, mirror_url, **options):
+    options['download_mirrors'] = {'%s/download/' % stand_in.url: mirror_url}
+
+    return GalaxyContext(collections_path=galaxy_context.collections_path,
+                         server={'url': stand_in.url,
+                                 'ignore_certs': False},
+                         options=options)
+
+
+def fetch_from_mirror(context, version):
+    req_spec = RequirementSpec(namespace='some_namespace',
+                               name='some_name',
+                               version_spec='==%s' % version)
+
+    fetcher = galaxy_url.GalaxyUrlFetch(requirement_spec=req_spec, galaxy_context=context)
+
+    fetch_results = fetcher.fetch(find_results=fetcher.find())
+
+    try:
+        return fetch_results['archive_fileobj'].read()
+    finally:
+        fetcher.cleanup()
+
+
+def test_galaxy_url_fetch_from_mirror(galaxy_context, stand_in, mirror):
+    artifact_info = stand_in.collections[('some_namespace', 'some_name')]['1.0.0']
+    mirror.add_artifact(artifact_info['path'])
+
+    context = mirror_context(galaxy_context, stand_in, '%s/download/' % mirror.url)
+
+    stand_in.reset_stats()
+
+    assert len(fetch_from_mirror(context, '1.0.0')) == artifact_info['size']
+
+    assert mirror.download_ranges == [None]
+    assert stand_in.download_ranges == []
+
+
+def test_galaxy_url_fetch_mirror_not_found(galaxy_context, stand_in, mirror):
+    # the mirror doesn't have it yet
+    context = mirror_context(galaxy_context, stand_in, '%s/download/' % mirror.url)
+
+    stand_in.reset_stats()
+
+    assert len(fetch_from_mirror(context, '1.1.0')) == \
+        stand_in.collections[('some_namespace', 'some_name')]['1.1.0']['size']
+
+    assert stand_in.download_ranges == [None]
+
+
+def test_galaxy_url_fetch_mirror_unreachable(galaxy_context, stand_in, mirror):
+    mirror_url = '%s/download/' % mirror.url
+    mirror.stop()
+
+    context = mirror_context(galaxy_context, stand_in, mirror_url)
+
+    stand_in.reset_stats()
+
+    assert len(fetch_from_mirror(context, '2.0.0')) == \
+        stand_in.collections[('some_namespace', 'some_name')]['2.0.0']['size']
+
+    assert stand_in.download_ranges == [None]
+
+
+def test_galaxy_url_fetch_mirror_bad_artifact(galaxy_context, stand_in, mirror):
+    # a different artifact with the same filename
+    artifact_path = galaxy_stand_in_py.make_artifact(mirror.artifacts_path,
+                                                     'some_namespace', 'some_name', '1.0.0',
+                                                     padding=100)
+    mirror.add_artifact(artifact_path)
+
+    context = mirror_context(galaxy_context, stand_in, '%s/download/' % mirror.url)
+
+    # a mirror serving the wrong thing is an error, not a reason to try somewhere else
+    with pytest.raises(exceptions.GalaxyDownloadError):
+        fetch_from_mirror(context, '1.0.0')
+
+
+def stream_from_mirror(context, version):
+    req = requirements.from_dependencies_dict({'some_namespace.some_name': '==%s' % version})[0]
+    install_plan = install_action.find_repository(context, req, display_callback=lambda *args, **kwargs: None)
+
+    fetch_results = install_action.fetch_repository(install_plan, context)
+
+    res = install_action.install_fetched_repository(context, install_plan, fetch_results,
+                                                    display_callback=lambda *args, **kwargs: None)
+
+    return res[0]
+
+
+def test_stream_downloads_from_mirror(galaxy_context, stand_in, mirror):
+    artifact_info = stand_in.collections[('some_namespace', 'some_name')]['1.0.0']
+    mirror.add_artifact(artifact_info['path'])
+
+    context = mirror_context(galaxy_context, stand_in, '%s/download/' % mirror.url, stream_downloads=True)
+
+    stand_in.reset_stats()
+
+    installed = stream_from_mirror(context, '1.0.0')
+
+    assert str(installed.repository_spec.version) == '1.0.0'
+    assert mirror.download_ranges == [None]
+    assert stand_in.download_ranges == []
+
+
+@pytest.mark.parametrize('mirror_up', [True, False])
+def test_stream_downloads_mirror_falls_back(galaxy_context, stand_in, mirror, mirror_up):
+    mirror_url = '%s/download/' % mirror.url
+
+    # the mirror doesn't have it, or is not there at all
+    if not mirror_up:
+        mirror.stop()
+
+    context = mirror_context(galaxy_context, stand_in, mirror_url, stream_downloads=True)
+
+    stand_in.reset_stats()
+
+    installed = stream_from_mirror(context, '1.1.0')
+
+    assert str(installed.repository_spec.version) == '1.1.0'
+    assert stand_in.download_ranges == [None]
+
+
+def test_install_installed_dep_conflict(galaxy_context, galaxy_stand_in):
+    for version in ('1.0.0', '2.0.0'):
+        galaxy_stand_in.add_artifact(galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path, 'ns', 'dep', version))
+    galaxy_stand_in.add_artifact(galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path, 'ns', 'top', '1.0.0',
+                                                                  dependencies={'ns.dep': '>=2.0.0'}))
+
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': galaxy_stand_in.url,
+                                    'ignore_certs': False})
+
+    messages = []
+
+    def display_callback(*args, **kwargs):
+        messages.append(args[0] if args else '')
+
+    install_action.install_repository_specs_loop(context, repository_spec_strings=['ns.dep,1.0.0'],
+                                                 display_callback=display_callback)
+
+    # ns.top can't be installed without replacing the installed ns.dep, so nothing is installed
+    with pytest.raises(exceptions.GalaxyError, match=r'ns.dep,1.0.0 is installed'):
+        install_action.install_repository_specs_loop(context, repository_spec_strings=['ns.top'],
+                                                     display_callback=display_callback)
+
+    collections_path = os.path.join(context.collections_path, 'ansible_collections', 'ns')
+    assert sorted(os.listdir(collections_path)) == ['dep']
+
+    # once the installed ns.dep is new enough, it is kept as is without even being looked up again
+    install_action.install_repository_specs_loop(context, repository_spec_strings=['ns.dep,2.0.0'],
+                                                 display_callback=display_callback, force_overwrite=True)
+    del messages[:]
+
+    install_action.install_repository_specs_loop(context, repository_spec_strings=['ns.top'],
+                                                 display_callback=display_callback)
+
+    assert sorted(os.listdir(collections_path)) == ['dep', 'top']
+    assert not [message for message in messages if 'ns.dep' in message]
@@ -0,0 +1,79 @@
+import logging
+import os
+
+import pytest
+
+from ansible_galaxy import http_cache
+from ansible_galaxy.models.context import GalaxyContext
+
+log = logging.getLogger(__name__)
+
+SOME_URL = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return http_cache.HttpCache(tmpdir.mkdir('http').strpath, ttl=60, stale_while_revalidate=60)
+
+
+def test_get_not_enabled(galaxy_context):
+    assert http_cache.get(galaxy_context) is None
+
+
+def test_get(tmpdir):
+    context = GalaxyContext(options={'cache_path': tmpdir.strpath,
+                                     'http_cache_ttl': 300})
+    res = http_cache.get(context)
+
+    assert isinstance(res, http_cache.HttpCache)
+    assert res.path == os.path.join(tmpdir.strpath, 'http')
+    assert res.ttl == 300
+    assert res.stale_while_revalidate == 0
+
+
+def test_load_miss(cache):
+    assert cache.load(SOME_URL) is None
+
+
+def test_save_load(cache):
+    cache.save(SOME_URL, {'name': 'some_name'},
+               headers={'ETag': '"abc123"',
+                        'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+
+    entry = cache.load(SOME_URL)
+
+    assert entry['data'] == {'name': 'some_name'}
+    assert cache.conditional_headers(entry) == {'If-None-Match': '"abc123"',
+                                                'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    assert cache.is_fresh(entry)
+
+
+def test_load_corrupt_entry(cache):
+    cache.save(SOME_URL, {'name': 'some_name'})
+
+    with open(cache.entry_path(SOME_URL), 'w') as entry_fd:
+        entry_fd.write('{not json')
+
+    assert cache.load(SOME_URL) is None
+
+
+def test_freshness(cache):
+    entry = {'stored_at': 0}
+
+    assert not cache.is_fresh(entry)
+    assert not cache.is_usable_while_revalidating(entry)
+
+    cache.refresh(SOME_URL, entry)
+    assert cache.is_fresh(entry)
+
+    entry['stored_at'] -= 90
+    assert not cache.is_fresh(entry)
+    assert cache.is_usable_while_revalidating(entry)
+
+
+def test_no_ttl_always_revalidates(tmpdir):
+    cache = http_cache.HttpCache(tmpdir.strpath)
+    entry = cache.save(SOME_URL, {})
+
+    assert not cache.is_fresh(entry)
+    assert not cache.is_usable_while_revalidating(entry)
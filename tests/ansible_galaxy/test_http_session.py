@@ -0,0 +1,67 @@
+import logging
+
+import pytest
+import requests
+
+from ansible_galaxy import download
+from ansible_galaxy import http_session
+from ansible_galaxy import rest_api
+
+log = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def no_sessions(mocker):
+    mocker.patch.dict('ansible_galaxy.http_session._sessions', clear=True)
+
+
+def test_get(no_sessions):
+    session = http_session.get('https://galaxy.example.invalid/api/', pool_size=3)
+
+    assert isinstance(session, requests.Session)
+
+    # every request to the same host shares the session
+    assert http_session.get('https://GALAXY.example.invalid/download/blip.tar.gz') is session
+    assert http_session.get('http://galaxy.example.invalid/api/') is not session
+    assert http_session.get('https://cdn.example.invalid/blip.tar.gz') is not session
+
+    adapter = session.get_adapter('https://galaxy.example.invalid/api/')
+    assert adapter._pool_maxsize == 3
+
+
+def test_pool_size(galaxy_context):
+    assert http_session.pool_size(galaxy_context) == http_session.defaults.DEFAULT_HTTP_POOL_SIZE
+
+    galaxy_context.options['http_pool_size'] = 2
+
+    assert http_session.pool_size(galaxy_context) == 2
+
+
+def test_close_all(no_sessions):
+    session = http_session.get('https://galaxy.example.invalid/api/')
+
+    http_session.close_all()
+
+    assert http_session.get('https://galaxy.example.invalid/api/') is not session
+
+
+def test_rest_clients_share_session(no_sessions):
+    http_context = {'server': {'url': 'http://bogus.invalid:9443', 'ignore_certs': False}}
+
+    rest_client = rest_api.RestClient(http_context=http_context)
+    other_rest_client = rest_api.RestClient(http_context=http_context)
+
+    assert rest_client.session is other_rest_client.session
+
+
+def test_open_url_uses_shared_session(no_sessions, requests_mock, mocker):
+    url = 'http://cdn.example.invalid/some_namespace-some_name-1.0.0.tar.gz'
+    requests_mock.get(url, content=b'not really a tar.gz')
+
+    session_request = mocker.spy(http_session.get(url), 'request')
+
+    resp = download.open_url(url)
+    resp.close()
+
+    assert session_request.call_count == 1
+    assert requests_mock.last_request.headers['User-Agent'].startswith('Mazer')
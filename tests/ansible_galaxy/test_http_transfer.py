@@ -0,0 +1,340 @@
+import logging
+
+import pytest
+import requests
+
+from ansible_galaxy import http_transfer
+from ansible_galaxy.models.context import GalaxyContext
+
+log = logging.getLogger(__name__)
+
+URL = 'http://galaxy.example.invalid/api/v2/collections/'
+
+
+class FakeClock(object):
+    '''A clock that only moves when something sleeps'''
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr('ansible_galaxy.http_transfer._now', fake_clock.time)
+    monkeypatch.setattr('ansible_galaxy.http_transfer._sleep', fake_clock.sleep)
+    return fake_clock
+
+
+@pytest.fixture
+def session():
+    return requests.Session()
+
+
+def test_policy_from_context(galaxy_context):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server=galaxy_context.server,
+                            options={'http_connect_timeout': 3,
+                                     'http_read_timeout': 7,
+                                     'http_retries': 0,
+                                     'api_rate_limit': 5})
+
+    res = http_transfer.policy(context)
+
+    assert res.timeout == (3, 7)
+    assert res.retries == 0
+    assert res.rate_limit == 5
+    # not set, so the default
+    assert res.deadline == http_transfer.TransferPolicy().deadline
+
+
+def test_policy_download_limits_from_context(galaxy_context):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server=galaxy_context.server,
+                            options={'download_rate_limit': 1000,
+                                     'download_max_connections': 2,
+                                     'download_hosts': {'cdn.example.invalid': {'rate_limit': 500}}})
+
+    res = http_transfer.policy(context)
+
+    assert res.download_rate_limit == 1000
+    assert res.host_download_limits('https://cdn.example.invalid/blip.tar.gz') == (500, 2)
+    assert res.host_download_limits('https://galaxy.example.invalid/blip.tar.gz') == (0, 2)
+
+
+def test_backoff_delay():
+    transfer_policy = http_transfer.TransferPolicy(backoff=1, max_backoff=5)
+
+    for attempt in range(10):
+        delay = transfer_policy.backoff_delay(attempt)
+        assert 0 <= delay <= min(5, 2 ** attempt)
+
+
+@pytest.mark.parametrize("retry_after,expected", [
+    (None, None),
+    ('', None),
+    ('3', 3.0),
+    ('-3', 0.0),
+    ('not a date', None),
+])
+def test_parse_retry_after(retry_after, expected):
+    assert http_transfer.parse_retry_after(retry_after) == expected
+
+
+def test_parse_retry_after_date(clock):
+    clock.now = 784111777.0
+    # 'Sun, 06 Nov 1994 08:49:37 GMT' is 784111777
+    assert http_transfer.parse_retry_after('Sun, 06 Nov 1994 08:50:37 GMT') == 60.0
+
+
+def test_request_sets_timeout(session, requests_mock):
+    requests_mock.get(URL, json={})
+
+    http_transfer.request(session, 'GET', URL,
+                          transfer_policy=http_transfer.TransferPolicy(connect_timeout=3, read_timeout=7))
+
+    assert requests_mock.last_request.timeout == (3, 7)
+
+
+def test_request_retries_server_errors(session, requests_mock, clock):
+    requests_mock.get(URL, [{'status_code': 503},
+                            {'status_code': 502},
+                            {'json': {'ok': True}}])
+
+    resp = http_transfer.request(session, 'GET', URL)
+
+    assert resp.status_code == 200
+    assert requests_mock.call_count == 3
+    assert len(clock.sleeps) == 2
+
+
+def test_request_retries_exhausted(session, requests_mock, clock):
+    requests_mock.get(URL, status_code=500)
+
+    resp = http_transfer.request(session, 'GET', URL,
+                                 transfer_policy=http_transfer.TransferPolicy(retries=2))
+
+    # the last response is returned for the usual error handling
+    assert resp.status_code == 500
+    assert requests_mock.call_count == 3
+
+
+def test_request_retries_connection_errors(session, requests_mock, clock):
+    requests_mock.get(URL, [{'exc': requests.exceptions.ConnectTimeout},
+                            {'exc': requests.exceptions.ConnectionError},
+                            {'json': {}}])
+
+    resp = http_transfer.request(session, 'GET', URL)
+
+    assert resp.status_code == 200
+
+
+def test_request_connection_error_retries_exhausted(session, requests_mock, clock):
+    requests_mock.get(URL, exc=requests.exceptions.ReadTimeout)
+
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        http_transfer.request(session, 'GET', URL,
+                              transfer_policy=http_transfer.TransferPolicy(retries=1))
+
+    assert requests_mock.call_count == 2
+
+
+def test_request_post_not_retried(session, requests_mock, clock):
+    requests_mock.post(URL, status_code=503)
+
+    resp = http_transfer.request(session, 'POST', URL)
+
+    assert resp.status_code == 503
+    assert requests_mock.call_count == 1
+
+
+def test_request_client_error_not_retried(session, requests_mock, clock):
+    requests_mock.get(URL, status_code=404)
+
+    resp = http_transfer.request(session, 'GET', URL)
+
+    assert resp.status_code == 404
+    assert requests_mock.call_count == 1
+
+
+def test_request_retry_after(session, requests_mock, clock):
+    requests_mock.get(URL, [{'status_code': 429, 'headers': {'Retry-After': '7'}},
+                            {'json': {}}])
+
+    limiter = http_transfer.RateLimiter()
+
+    resp = http_transfer.request(session, 'GET', URL, limiter=limiter)
+
+    assert resp.status_code == 200
+    # the Retry-After is used instead of the backoff
+    assert clock.sleeps == [7.0]
+
+
+def test_request_retry_after_pauses_limiter(session, requests_mock, clock):
+    requests_mock.get(URL, [{'status_code': 429, 'headers': {'Retry-After': '7'}},
+                            {'json': {}}])
+
+    limiter = http_transfer.RateLimiter()
+
+    # Don't actually wait, so the limiter is still paused after the request
+    http_transfer.request(session, 'GET', URL, limiter=limiter)
+
+    clock.now -= 7
+    clock.sleeps = []
+
+    # another worker has to wait out the Retry-After too
+    limiter.acquire()
+    assert clock.sleeps == [7.0]
+
+
+def test_request_deadline(session, requests_mock, clock):
+    requests_mock.get(URL, [{'status_code': 503, 'headers': {'Retry-After': '120'}},
+                            {'json': {}}])
+
+    resp = http_transfer.request(session, 'GET', URL,
+                                 transfer_policy=http_transfer.TransferPolicy(deadline=60))
+
+    # waiting would go past the deadline, so give up with the last response
+    assert resp.status_code == 503
+    assert requests_mock.call_count == 1
+    assert clock.sleeps == []
+
+
+def test_request_timeout_capped_at_deadline(session, requests_mock, clock):
+    requests_mock.get(URL, [{'status_code': 503, 'headers': {'Retry-After': '50'}},
+                            {'json': {}}])
+
+    http_transfer.request(session, 'GET', URL,
+                          transfer_policy=http_transfer.TransferPolicy(connect_timeout=5, read_timeout=30, deadline=60))
+
+    # only 10s of the deadline were left for the retry
+    assert [req.timeout for req in requests_mock.request_history] == [(5, 30), (5, 10)]
+
+
+def test_request_releases_slot_while_waiting(session, requests_mock, monkeypatch):
+    requests_mock.get(URL, [{'status_code': 503},
+                            {'json': {}}])
+
+    limits = http_transfer.DownloadLimits(max_connections=1)
+    slot = limits.connection()
+
+    free_while_waiting = []
+
+    def sleep(seconds):
+        # someone else can use the connection while the request waits to retry
+        free_while_waiting.append(limits._connections.acquire(False))
+        limits._connections.release()
+
+    monkeypatch.setattr('ansible_galaxy.http_transfer._sleep', sleep)
+
+    resp = http_transfer.request(session, 'GET', URL, slot=slot)
+
+    assert resp.status_code == 200
+    assert free_while_waiting == [True]
+
+    # and the request has it again after
+    assert not limits._connections.acquire(False)
+    slot.release()
+    assert limits._connections.acquire(False)
+
+
+def test_rate_limiter(clock):
+    limiter = http_transfer.RateLimiter(rate=2, burst=2)
+
+    # the burst doesn't wait
+    limiter.acquire()
+    limiter.acquire()
+    assert clock.sleeps == []
+
+    # then 2 per second
+    limiter.acquire()
+    limiter.acquire()
+    assert sum(clock.sleeps) == pytest.approx(1.0)
+
+
+def test_rate_limiter_unlimited(clock):
+    limiter = http_transfer.RateLimiter(rate=0)
+
+    for dummy in range(100):
+        limiter.acquire()
+
+    assert clock.sleeps == []
+
+
+def test_rate_limiter_shared_per_host():
+    limiter = http_transfer.rate_limiter('https://galaxy.example.invalid/api/', rate=5, burst=3)
+
+    assert http_transfer.rate_limiter('https://galaxy.example.invalid/download/blip.tar.gz') is limiter
+    assert limiter.rate == 5
+    assert http_transfer.rate_limiter('https://other.example.invalid/api/') is not limiter
+
+
+def test_rate_limiter_more_than_burst(clock):
+    limiter = http_transfer.RateLimiter(rate=100, burst=100)
+
+    # more than the bucket holds goes through when it is full, leaving it in debt
+    limiter.acquire(250)
+    assert clock.sleeps == []
+
+    limiter.acquire(100)
+    assert sum(clock.sleeps) == pytest.approx(2.5)
+
+
+def test_download_limits():
+    transfer_policy = http_transfer.TransferPolicy(download_rate_limit=1000,
+                                                   download_max_connections=3,
+                                                   download_hosts={'cdn.example.invalid': {'rate_limit': 500,
+                                                                                           'max_connections': 1}})
+
+    limits = http_transfer.download_limits('https://galaxy.example.invalid/download/blip.tar.gz', transfer_policy)
+
+    assert http_transfer.download_limits('https://galaxy.example.invalid/download/other.tar.gz') is limits
+    assert limits.max_connections == 3
+    assert [limiter.rate for limiter in limits.bandwidth_limiters] == [1000]
+
+    cdn_limits = http_transfer.download_limits('https://cdn.example.invalid/blip.tar.gz', transfer_policy)
+
+    assert cdn_limits.max_connections == 1
+    assert [limiter.rate for limiter in cdn_limits.bandwidth_limiters] == [1000, 500]
+
+    # the limit for all downloads is shared by every host
+    assert cdn_limits.bandwidth_limiters[0] is limits.bandwidth_limiters[0]
+
+
+def test_download_limits_connections():
+    limits = http_transfer.DownloadLimits(max_connections=1)
+
+    slot = limits.connection()
+
+    # no more connections until it is released
+    assert not limits._connections.acquire(False)
+
+    slot.release()
+    # releasing twice is harmless
+    slot.release()
+
+    with limits.connection():
+        assert not limits._connections.acquire(False)
+
+    # a released slot can be acquired again
+    slot.acquire()
+    assert not limits._connections.acquire(False)
+    slot.release()
+
+    assert limits._connections.acquire(False)
+
+
+def test_download_limits_throttle(clock):
+    limits = http_transfer.DownloadLimits(bandwidth_limiters=[http_transfer.RateLimiter(rate=1000, burst=1000)])
+
+    for dummy in range(5):
+        limits.throttle(1000)
+
+    assert sum(clock.sleeps) == pytest.approx(4.0)
@@ -63,6 +63,30 @@ def test_install(galaxy_context, mocker):
     assert galaxy_context.collections_path in res[0].path
 
 
+def test_install_failed_cleans_up(galaxy_context, mocker):
+    repo_spec = RepositorySpec(namespace='some_namespace',
+                               name='some_name',
+                               version='4.3.2')
+
+    mock_fetcher = mocker.MagicMock(name='MockFetch')
+    fetch_results = {'archive_path': '/dev/null/doesntexist'}
+
+    mocker.patch.object(install.repository_archive, 'load_archive',
+                        return_value=mocker.MagicMock(name='MockRepoArchive'))
+    mocker.patch.object(install.repository_archive, 'install',
+                        side_effect=exceptions.GalaxyClientError('The Galaxy content appears to already exist.'))
+
+    with pytest.raises(exceptions.GalaxyClientError, match='appears to already exist'):
+        install.install(galaxy_context,
+                        fetcher=mock_fetcher,
+                        fetch_results=fetch_results,
+                        repository_spec=repo_spec,
+                        display_callback=display_callback)
+
+    # the downloaded archive is still removed
+    mock_fetcher.cleanup.assert_called_once_with()
+
+
 def test_find(mocker):
     mock_fetcher = mocker.MagicMock(name='MockFetch')
     mock_fetcher.find.return_value = {}
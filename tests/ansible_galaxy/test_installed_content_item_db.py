@@ -49,7 +49,7 @@ def test_installed_content_item_iterator_empty(galaxy_context, mocker):
                  return_value=iter(['foo', 'blip']))
     mocker.patch('ansible_galaxy.repository.os.path.isdir',
                  return_value=True)
-    mocker.patch('ansible_galaxy.installed_repository_db.get_repository_paths',
+    mocker.patch('ansible_galaxy.repository.get_repository_paths',
                  return_value=iter(['bar', 'baz']))
 
     mocker.patch('ansible_galaxy.installed_content_item_db.python_content_path_iterator',
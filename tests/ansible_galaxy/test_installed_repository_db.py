@@ -3,6 +3,9 @@ import logging
 
 from ansible_galaxy import installed_repository_db
 from ansible_galaxy import matchers
+from ansible_galaxy.models.repository import Repository
+from ansible_galaxy.models.repository_spec import RepositorySpec
+from ansible_galaxy.models.requirement_spec import RequirementSpec
 
 log = logging.getLogger(__name__)
 
@@ -22,3 +25,39 @@ def test_installed_repository_db_match_names(galaxy_context):
     match_filter = matchers.MatchLabels(['foo.bar'])
     for x in icdb.select(match_filter):
         log.debug('x: %s', x)
+
+
+def test_installed_repository_index_empty(galaxy_context):
+    index = installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+
+    assert list(index.select()) == []
+    assert index.get('some_namespace', 'some_name') is None
+
+
+def test_installed_repository_index_add_remove(galaxy_context, mocker):
+    mock_select = mocker.patch('ansible_galaxy.installed_repository_db.InstalledRepositoryDatabase.select',
+                               return_value=iter([]))
+
+    repo_spec = RepositorySpec(namespace='some_namespace', name='some_name', version='1.2.3')
+    repo = Repository(repository_spec=repo_spec, installed=True)
+
+    index = installed_repository_db.InstalledRepositoryIndex(galaxy_context)
+    index.add(repo)
+
+    assert index.get('some_namespace', 'some_name') == repo
+    assert list(index.select()) == [repo]
+    assert list(index.by_repository_spec(repo_spec)) == [repo]
+
+    req_spec = RequirementSpec(namespace='some_namespace', name='some_name', version_spec='>=1.0.0')
+    assert list(index.by_requirement_spec(req_spec)) == [repo]
+
+    other_req_spec = RequirementSpec(namespace='some_namespace', name='some_name', version_spec='>=2.0.0')
+    assert list(index.by_requirement_spec(other_req_spec)) == []
+
+    index.remove(repo)
+
+    assert index.get('some_namespace', 'some_name') is None
+    assert list(index.select()) == []
+
+    # the collections_path is only scanned once
+    assert mock_select.call_count == 1
@@ -0,0 +1,134 @@
+import logging
+import os
+
+from ansible_galaxy import installed_repository_index_file
+
+log = logging.getLogger(__name__)
+
+GALAXY_YML = '''
+namespace: "some_namespace"
+name: "some_name"
+version: "1.2.3"
+authors: ["Cowboy King Buzzo Lightyear"]
+license: "GPL-3.0-or-later"
+dependencies:
+  some_other_namespace.some_other_name: ">=1.0.0"
+'''
+
+
+def _make_collection(galaxy_context, namespace, name):
+    collection_path = os.path.join(galaxy_context.collections_path, 'ansible_collections', namespace, name)
+    os.makedirs(collection_path)
+
+    with open(os.path.join(collection_path, 'galaxy.yml'), 'w') as galaxy_yml_fd:
+        galaxy_yml_fd.write(GALAXY_YML)
+
+    return collection_path
+
+
+def _set_mtime(path, mtime):
+    os.utime(path, (mtime, mtime))
+
+
+def test_installed_repository_iterator_empty(galaxy_context):
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert res == []
+
+
+def test_installed_repository_iterator(galaxy_context, mocker):
+    collection_path = _make_collection(galaxy_context, 'some_namespace', 'some_name')
+    _make_collection(galaxy_context, 'some_namespace', '.some_name.staging-blip')
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    log.debug('res: %s', res)
+
+    assert [x.label for x in res] == ['some_namespace.some_name']
+    assert os.path.isfile(installed_repository_index_file.index_path(galaxy_context.collections_path))
+
+    # nothing changed, so nothing is loaded from the collection dirs
+    mock_load_from_dir = mocker.patch('ansible_galaxy.installed_repository_index_file.repository.load_from_dir',
+                                      side_effect=AssertionError('load_from_dir should not be called'))
+
+    indexed_res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert indexed_res == res
+    assert indexed_res[0].requirements == res[0].requirements
+    assert mock_load_from_dir.call_count == 0
+
+    # the collection dir changed, so it is loaded again
+    mock_load_from_dir.side_effect = None
+    mock_load_from_dir.return_value = res[0]
+    _set_mtime(collection_path, os.stat(collection_path).st_mtime - 10)
+
+    list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert mock_load_from_dir.call_count == 1
+
+
+def test_installed_repository_iterator_file_changed(galaxy_context):
+    collection_path = _make_collection(galaxy_context, 'some_namespace', 'some_name')
+    galaxy_yml_path = os.path.join(collection_path, 'galaxy.yml')
+    collection_mtime = os.stat(collection_path).st_mtime
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+    assert str(res[0].repository_spec.version) == '1.2.3'
+
+    # edited in place, which doesn't change the mtime of the collection dir
+    with open(galaxy_yml_path, 'w') as galaxy_yml_fd:
+        galaxy_yml_fd.write(GALAXY_YML.replace('1.2.3', '1.2.30'))
+    _set_mtime(collection_path, collection_mtime)
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert str(res[0].repository_spec.version) == '1.2.30'
+
+
+def test_installed_repository_iterator_dir_replaced(galaxy_context):
+    collection_path = _make_collection(galaxy_context, 'some_namespace', 'some_name')
+    namespace_path = os.path.dirname(collection_path)
+    namespace_mtime = os.stat(namespace_path).st_mtime
+    collection_mtime = os.stat(collection_path).st_mtime
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+    assert str(res[0].repository_spec.version) == '1.2.3'
+
+    # an install swaps in a new collection dir, with the same mtimes as the old one
+    new_collection_path = _make_collection(galaxy_context, 'some_namespace', '.some_name.staging-blip')
+    with open(os.path.join(new_collection_path, 'galaxy.yml'), 'w') as galaxy_yml_fd:
+        galaxy_yml_fd.write(GALAXY_YML.replace('1.2.3', '2.0.0'))
+    os.rename(collection_path, os.path.join(namespace_path, '.some_name.old-blip'))
+    os.rename(new_collection_path, collection_path)
+
+    for path in (collection_path, os.path.join(collection_path, 'galaxy.yml')):
+        _set_mtime(path, collection_mtime)
+    _set_mtime(namespace_path, namespace_mtime)
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert str(res[0].repository_spec.version) == '2.0.0'
+
+
+def test_installed_repository_iterator_removed(galaxy_context):
+    collection_path = _make_collection(galaxy_context, 'some_namespace', 'some_name')
+    namespace_path = os.path.dirname(collection_path)
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+    assert len(res) == 1
+
+    os.rename(collection_path, os.path.join(namespace_path, 'some_other_name'))
+    _set_mtime(namespace_path, os.stat(namespace_path).st_mtime - 10)
+
+    res = list(installed_repository_index_file.installed_repository_iterator(galaxy_context))
+
+    assert [x.label for x in res] == ['some_namespace.some_other_name']
+
+
+def test_load_corrupt_index(galaxy_context):
+    with open(installed_repository_index_file.index_path(galaxy_context.collections_path), 'w') as index_fd:
+        index_fd.write('{"not json')
+
+    index_data = installed_repository_index_file.load(galaxy_context.collections_path)
+
+    assert index_data['namespaces'] == {}
@@ -1,10 +1,18 @@
 
 import datetime
+import io
 import logging
 import os
+import threading
+import time
 
+import attr
+import pytest
+from requests.packages.urllib3 import exceptions as urllib3_exceptions
 import semantic_version
 
+from ansible_galaxy import exceptions
+from ansible_galaxy import http_transfer
 from ansible_galaxy import repository_archive
 from ansible_galaxy.models.repository_spec import RepositorySpec
 from ansible_galaxy.models.install_destination import InstallDestinationInfo
@@ -14,6 +22,7 @@ from ansible_galaxy.models.collection_artifact_archive import CollectionArtifact
 from ansible_galaxy.models.collection_artifact_archive import CollectionArtifactArchive
 from ansible_galaxy.actions import build
 from ansible_galaxy.models.build_context import BuildContext
+from ansible_galaxy.utils import chksums
 
 log = logging.getLogger(__name__)
 
@@ -80,3 +89,260 @@ def test_load_from_archive(galaxy_context, tmpdir):
     assert res.info.archive_type == 'multi-content-artifact'
 
     assert res.info.top_dir == ''
+
+
+def test_load_from_archive_fileobj(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+
+    with open(built_res['build_results'].artifact_file_path, 'rb') as artifact_fo:
+        artifact_fileobj = io.BytesIO(artifact_fo.read())
+
+    res = repository_archive.load_archive(None, fileobj=artifact_fileobj)
+
+    assert isinstance(res, CollectionArtifactArchive)
+    assert 'MANIFEST.json' in res.tar_file.getnames()
+
+
+def _stream_destination_info(galaxy_context):
+    repo_spec = RepositorySpec(namespace='some_namespace',
+                               name='some_name',
+                               version='1.2.3')
+
+    destination_info = InstallDestinationInfo(collections_path=galaxy_context.collections_path,
+                                              repository_spec=repo_spec,
+                                              namespaced_repository_path='some_namespace/some_name',
+                                              force_overwrite=False,
+                                              editable=False)
+    return repo_spec, destination_info
+
+
+def test_install_from_url(galaxy_context, tmpdir, requests_mock):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    archive_path = built_res['build_results'].artifact_file_path
+
+    download_url = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+    with open(archive_path, 'rb') as archive_fd:
+        requests_mock.get(download_url, content=archive_fd.read())
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    res = repository_archive.install_from_url(download_url, repo_spec, destination_info,
+                                              display_callback=display_callback,
+                                              expected_sha256=chksums.sha256sum_from_path(archive_path))
+
+    log.debug('res: %s', res)
+
+    assert isinstance(res, InstallationResults)
+    assert os.path.join(destination_info.path, 'MANIFEST.json') in res.installed_files
+    assert os.path.isfile(os.path.join(destination_info.path, 'MANIFEST.json'))
+    assert os.path.isfile(destination_info.install_info_path)
+
+
+def test_install_from_url_sha256_mismatch(galaxy_context, tmpdir, requests_mock):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    archive_path = built_res['build_results'].artifact_file_path
+
+    download_url = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+    with open(archive_path, 'rb') as archive_fd:
+        requests_mock.get(download_url, content=archive_fd.read())
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyArtifactChksumError) as exc_info:
+        repository_archive.install_from_url(download_url, repo_spec, destination_info,
+                                            display_callback=display_callback,
+                                            expected_sha256='0' * 64)
+
+    assert exc_info.value.actual == chksums.sha256sum_from_path(archive_path)
+
+    # nothing is left behind
+    assert not os.path.exists(destination_info.path)
+
+
+def test_install_from_url_not_a_tar_file(galaxy_context, requests_mock):
+    download_url = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+    requests_mock.get(download_url, content=b'this is not a tar.gz')
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyDownloadError):
+        repository_archive.install_from_url(download_url, repo_spec, destination_info,
+                                            display_callback=display_callback)
+
+    assert not os.path.exists(destination_info.path)
+
+
+class DroppedConnection(object):
+    '''A response body that stops part way through'''
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def read(self, *args, **kwargs):
+        data = self.data.read(*args, **kwargs)
+        if not data:
+            raise urllib3_exceptions.ProtocolError('Connection broken: IncompleteRead')
+        return data
+
+
+def test_stage_from_url_starts_over(galaxy_context, tmpdir, requests_mock):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    archive_path = built_res['build_results'].artifact_file_path
+
+    download_url = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+    with open(archive_path, 'rb') as archive_fd:
+        archive_data = archive_fd.read()
+
+    requests_mock.get(download_url, [{'body': DroppedConnection(archive_data[:500])},
+                                     {'content': archive_data}])
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    staged = repository_archive.stage_from_url(download_url, repo_spec, destination_info,
+                                               expected_sha256=chksums.sha256sum_from_path(archive_path),
+                                               transfer_policy=http_transfer.TransferPolicy(retries=1))
+
+    assert requests_mock.call_count == 2
+    assert os.path.isfile(os.path.join(staged['staging_path'], 'MANIFEST.json'))
+
+    # the partly extracted first try was removed
+    assert os.listdir(os.path.dirname(destination_info.path)) == [os.path.basename(staged['staging_path'])]
+
+    res = repository_archive.install_staged(staged, repo_spec, destination_info)
+
+    assert os.path.isfile(os.path.join(destination_info.path, 'MANIFEST.json'))
+    assert res.install_info.artifact_sha256 == staged['artifact_sha256']
+    assert os.listdir(os.path.dirname(destination_info.path)) == ['some_name']
+
+
+def test_stage_from_url_gives_up(galaxy_context, tmpdir, requests_mock):
+    download_url = 'http://example.invalid/download/some_namespace-some_name-1.2.3.tar.gz'
+    requests_mock.get(download_url, body=DroppedConnection(b''))
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    with pytest.raises(exceptions.GalaxyDownloadError, match='Connection broken'):
+        repository_archive.stage_from_url(download_url, repo_spec, destination_info,
+                                          transfer_policy=http_transfer.TransferPolicy(retries=0))
+
+    assert os.listdir(os.path.dirname(destination_info.path)) == []
+
+
+def _wait_for_background_removes():
+    for thread in threading.enumerate():
+        if thread.name.startswith('remove-'):
+            thread.join()
+
+
+def test_install_replaces_existing(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    repo_archive = repository_archive.load_archive(built_res['build_results'].artifact_file_path)
+
+    repo_spec = RepositorySpec(namespace='some_namespace',
+                               name='some_name',
+                               version='1.2.3')
+
+    destination_info = InstallDestinationInfo(collections_path=galaxy_context.collections_path,
+                                              repository_spec=repo_spec,
+                                              namespaced_repository_path='some_namespace/some_name',
+                                              force_overwrite=True,
+                                              editable=False)
+
+    os.makedirs(destination_info.path)
+    old_file = os.path.join(destination_info.path, 'some_file_from_the_old_version')
+    with open(old_file, 'w') as old_fd:
+        old_fd.write('old')
+
+    res = repository_archive.install(repo_archive, repo_spec, destination_info, display_callback=display_callback)
+
+    _wait_for_background_removes()
+
+    assert os.path.isfile(os.path.join(destination_info.path, 'MANIFEST.json'))
+    assert os.path.join(destination_info.path, 'MANIFEST.json') in res.installed_files
+    assert os.path.isfile(res.install_info_path)
+    assert not os.path.exists(old_file)
+
+    # no staging or old dirs are left behind
+    assert os.listdir(os.path.dirname(destination_info.path)) == ['some_name']
+
+
+def _make_stale(path):
+    stale_mtime = time.time() - repository_archive.STALE_STAGING_SECONDS - 60
+    os.utime(path, (stale_mtime, stale_mtime))
+
+
+def test_install_removes_leftovers(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    repo_archive = repository_archive.load_archive(built_res['build_results'].artifact_file_path)
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+    namespace_path = os.path.dirname(destination_info.path)
+
+    # left behind by installs that were killed part way through
+    os.makedirs(os.path.join(namespace_path, '.some_name.staging-0123', 'roles'))
+    os.makedirs(os.path.join(namespace_path, '.some_name.old-4567'))
+    os.makedirs(destination_info.path)
+    # and something for another collection
+    os.makedirs(os.path.join(namespace_path, '.some_other_name.staging-89ab'))
+
+    _make_stale(os.path.join(namespace_path, '.some_name.staging-0123'))
+
+    destination_info = attr.evolve(destination_info, force_overwrite=True)
+
+    repository_archive.install(repo_archive, repo_spec, destination_info, display_callback=display_callback)
+
+    _wait_for_background_removes()
+
+    assert sorted(os.listdir(namespace_path)) == ['.some_other_name.staging-89ab', 'some_name']
+
+
+def test_install_keeps_recent_staging_dirs(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    repo_archive = repository_archive.load_archive(built_res['build_results'].artifact_file_path)
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+    namespace_path = os.path.dirname(destination_info.path)
+
+    # another mazer process is still extracting into this one
+    in_use_path = os.path.join(namespace_path, '.some_name.staging-0123')
+    os.makedirs(os.path.join(in_use_path, 'roles'))
+
+    repository_archive.install(repo_archive, repo_spec, destination_info, display_callback=display_callback)
+
+    assert sorted(os.listdir(namespace_path)) == ['.some_name.staging-0123', 'some_name']
+    assert os.listdir(in_use_path) == ['roles']
+
+
+def test_install_restores_interrupted_swap(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    repo_archive = repository_archive.load_archive(built_res['build_results'].artifact_file_path)
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+    namespace_path = os.path.dirname(destination_info.path)
+
+    # killed after the previous install was moved out of the way, but before the new one was moved in
+    old_path = os.path.join(namespace_path, '.some_name.old-0123')
+    os.makedirs(old_path)
+    with open(os.path.join(old_path, 'some_file_from_the_old_version'), 'w') as old_fd:
+        old_fd.write('old')
+
+    # so it is installed again
+    with pytest.raises(exceptions.GalaxyClientError, match='appears to already exist'):
+        repository_archive.install(repo_archive, repo_spec, destination_info, display_callback=display_callback)
+
+    assert os.listdir(namespace_path) == ['some_name']
+    assert os.listdir(destination_info.path) == ['some_file_from_the_old_version']
+
+
+def test_install_existing_no_force(galaxy_context, tmpdir):
+    built_res = build_repo_artifact(galaxy_context, tmpdir)
+    repo_archive = repository_archive.load_archive(built_res['build_results'].artifact_file_path)
+
+    repo_spec, destination_info = _stream_destination_info(galaxy_context)
+
+    os.makedirs(destination_info.path)
+
+    with pytest.raises(exceptions.GalaxyClientError, match='appears to already exist'):
+        repository_archive.install(repo_archive, repo_spec, destination_info, display_callback=display_callback)
+
+    assert os.listdir(destination_info.path) == []
+    assert os.listdir(os.path.dirname(destination_info.path)) == ['some_name']
@@ -0,0 +1,204 @@
+import logging
+
+import pytest
+import semantic_version
+
+from ansible_galaxy import exceptions
+from ansible_galaxy import requirements
+from ansible_galaxy import resolver
+from ansible_galaxy.models.context import GalaxyContext
+from ansible_galaxy.rest_api import GalaxyAPI
+from ansible_galaxy.utils.version import VersionIndex
+
+log = logging.getLogger(__name__)
+
+
+class FakeCandidates(object):
+    '''collection label -> {version string: dependencies dict}'''
+    def __init__(self, index):
+        self.index = index
+        self.dependencies_calls = []
+
+    def prefetch(self, keys):
+        pass
+
+    def version_index(self, namespace, name):
+        return VersionIndex(self.index.get('%s.%s' % (namespace, name), {}))
+
+    def dependencies(self, namespace, name, version):
+        self.dependencies_calls.append(('%s.%s' % (namespace, name), str(version)))
+        return self.index['%s.%s' % (namespace, name)][str(version)]
+
+
+def _versions(resolved):
+    return dict(('%s.%s' % key, str(resolution['version'])) for key, resolution in resolved.items())
+
+
+def test_resolve():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.b': '>=1.0.0'}},
+                                 'ns.b': {'1.0.0': {},
+                                          '1.1.0': {}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates)
+
+    assert _versions(res) == {'ns.a': '1.0.0', 'ns.b': '1.1.0'}
+    assert res[('ns', 'a')]['required_by'] == [None]
+    assert res[('ns', 'b')]['required_by'] == [('ns', 'a', semantic_version.Version('1.0.0'))]
+
+
+def test_resolve_intersects_constraints():
+    # a and c both need b, but the latest b only works for a
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.b': '>=1.0.0'}},
+                                 'ns.c': {'1.0.0': {'ns.b': '<2.0.0'}},
+                                 'ns.b': {'1.0.0': {},
+                                          '1.5.0': {},
+                                          '2.0.0': {}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*', 'ns.c': '*'}), candidates)
+
+    assert _versions(res) == {'ns.a': '1.0.0', 'ns.b': '1.5.0', 'ns.c': '1.0.0'}
+
+
+def test_resolve_backtracks():
+    # the latest a needs a d that does not exist, so the older a is used
+    candidates = FakeCandidates({'ns.a': {'2.0.0': {'ns.d': '>=3.0.0'},
+                                          '1.0.0': {'ns.d': '>=1.0.0'}},
+                                 'ns.d': {'1.0.0': {}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates)
+
+    assert _versions(res) == {'ns.a': '1.0.0', 'ns.d': '1.0.0'}
+
+
+def test_resolve_backtracks_decided_conflict():
+    # b is only available as 1.0.0, but the latest a needs b 2
+    candidates = FakeCandidates({'ns.a': {'2.0.0': {'ns.b': '>=2.0.0'},
+                                          '1.0.0': {'ns.b': '*'}},
+                                 'ns.b': {'1.0.0': {}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*', 'ns.b': '*'}), candidates)
+
+    assert _versions(res) == {'ns.a': '1.0.0', 'ns.b': '1.0.0'}
+
+
+def test_resolve_most_constrained_first():
+    candidates = FakeCandidates({'ns.many': {'1.0.0': {}, '1.1.0': {}, '1.2.0': {}},
+                                 'ns.one': {'1.0.0': {}}})
+
+    resolver.resolve(requirements.from_dependencies_dict({'ns.many': '*', 'ns.one': '*'}), candidates)
+
+    assert candidates.dependencies_calls[0] == ('ns.one', '1.0.0')
+
+
+def test_resolve_prefers_installed():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {}, '2.0.0': {}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates,
+                           preferred_versions={('ns', 'a'): semantic_version.Version('1.0.0')})
+
+    assert _versions(res) == {'ns.a': '1.0.0'}
+
+
+def test_resolve_provided():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.local': '>=1.0.0'}}})
+
+    res = resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates,
+                           provided=set([('ns', 'local')]))
+
+    assert _versions(res) == {'ns.a': '1.0.0'}
+
+
+def test_resolve_unsatisfiable():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.b': '>=2.0.0'}},
+                                 'ns.c': {'1.0.0': {'ns.b': '<2.0.0'}},
+                                 'ns.b': {'1.0.0': {},
+                                          '2.0.0': {}}})
+
+    with pytest.raises(exceptions.GalaxyResolutionError) as exc_info:
+        resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*', 'ns.c': '*'}), candidates)
+
+    log.debug('exc_info: %s', exc_info)
+
+    assert exc_info.value.conflicts
+    assert 'ns.b' in str(exc_info.value)
+    assert 'required by ns.a,1.0.0' in str(exc_info.value) or 'required by ns.c,1.0.0' in str(exc_info.value)
+
+
+def test_resolve_not_found():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.missing': '*'}}})
+
+    with pytest.raises(exceptions.GalaxyResolutionError,
+                       match='ns.missing was not found \\(required by ns.a,1.0.0\\)'):
+        resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates)
+
+
+def test_resolve_max_steps():
+    candidates = FakeCandidates({'ns.a': {'1.0.0': {'ns.b': '*'}},
+                                 'ns.b': {'1.0.0': {}}})
+
+    with pytest.raises(exceptions.GalaxyResolutionError, match='Gave up'):
+        resolver.resolve(requirements.from_dependencies_dict({'ns.a': '*'}), candidates, max_steps=1)
+
+
+@pytest.fixture
+def galaxy_api(galaxy_context, requests_mock):
+    context = GalaxyContext(collections_path=galaxy_context.collections_path,
+                            server={'url': 'http://example.invalid',
+                                    'ignore_certs': False})
+
+    requests_mock.get('http://example.invalid/api/',
+                      json={'current_version': 'v2'})
+
+    return GalaxyAPI(context)
+
+
+def test_galaxy_candidates(galaxy_api, requests_mock):
+    requests_mock.get('http://example.invalid/api/v2/collections/ns/a/versions/',
+                      json={'count': 2,
+                            'next': None,
+                            'results': [{'version': '1.0.0',
+                                         'href': 'http://example.invalid/api/v2/collections/ns/a/versions/1.0.0/'},
+                                        {'version': '2.0.0',
+                                         'href': 'http://example.invalid/api/v2/collections/ns/a/versions/2.0.0/',
+                                         'metadata': {'dependencies': {'ns.c': '*'}}}]})
+    version_detail = requests_mock.get('http://example.invalid/api/v2/collections/ns/a/versions/1.0.0/',
+                                       json={'version': '1.0.0',
+                                             'metadata': {'dependencies': {'ns.b': '>=1.0.0'}}})
+    requests_mock.get('http://example.invalid/api/v2/collections/ns/missing/versions/',
+                      status_code=404,
+                      json={'code': 'not_found', 'message': 'Not found.'})
+
+    candidates = resolver.GalaxyCandidates(galaxy_api)
+
+    assert list(candidates.version_index('ns', 'a')) == [semantic_version.Version('1.0.0'), semantic_version.Version('2.0.0')]
+    assert list(candidates.version_index('ns', 'missing')) == []
+
+    # the versions list included the metadata for 2.0.0
+    assert candidates.dependencies('ns', 'a', semantic_version.Version('2.0.0')) == {'ns.c': '*'}
+    assert not version_detail.called
+
+    assert candidates.dependencies('ns', 'a', semantic_version.Version('1.0.0')) == {'ns.b': '>=1.0.0'}
+    assert version_detail.called
+
+
+def test_galaxy_candidates_installed(galaxy_api, requests_mock):
+    requests_mock.get('http://example.invalid/api/v2/collections/ns/a/versions/',
+                      json={'count': 1,
+                            'next': None,
+                            'results': [{'version': '1.0.0',
+                                         'metadata': {'dependencies': {}}}]})
+    requests_mock.get('http://example.invalid/api/v2/collections/ns/missing/versions/',
+                      status_code=404,
+                      json={'code': 'not_found', 'message': 'Not found.'})
+
+    candidates = resolver.GalaxyCandidates(galaxy_api,
+                                           installed={('ns', 'a'): (semantic_version.Version('1.0.0'), {}),
+                                                      ('ns', 'missing'): (semantic_version.Version('0.1.0'), {'ns.a': '*'})})
+
+    assert list(candidates.version_index('ns', 'a')) == [semantic_version.Version('1.0.0')]
+    assert not candidates.installed_only('ns', 'a', semantic_version.Version('1.0.0'))
+
+    # not on Galaxy, but installed
+    assert list(candidates.version_index('ns', 'missing')) == [semantic_version.Version('0.1.0')]
+    assert candidates.installed_only('ns', 'missing', semantic_version.Version('0.1.0'))
+    assert candidates.dependencies('ns', 'missing', semantic_version.Version('0.1.0')) == {'ns.a': '*'}
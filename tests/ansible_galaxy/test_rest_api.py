@@ -1,11 +1,13 @@
 import io
 import logging
+import threading
 
 import pytest
 
 import requests
 from six import text_type
 
+from ansible_galaxy import api_version_cache
 from ansible_galaxy import exceptions
 from ansible_galaxy import multipart_form
 from ansible_galaxy.models.context import GalaxyContext
@@ -169,6 +171,51 @@ def test_galaxy_api_get_server_api_version_no_current_version(galaxy_context_exa
     log.debug('exc_info: %s', exc_info)
 
 
+def test_galaxy_api_server_api_version_cached(galaxy_context_example_invalid, requests_mock):
+    requests_mock.get('http://bogus.invalid:9443/api/',
+                      json={'current_version': 'v1'})
+    requests_mock.get('http://bogus.invalid:9443/api/v2/some_object/',
+                      json={'some': 'object'})
+
+    rest_api.GalaxyAPI(galaxy_context_example_invalid).get_object('http://bogus.invalid:9443/api/v2/some_object/')
+    rest_api.GalaxyAPI(galaxy_context_example_invalid).get_object('http://bogus.invalid:9443/api/v2/some_object/')
+
+    api_requests = [x for x in requests_mock.request_history if x.path == '/api/']
+    assert len(api_requests) == 1
+
+
+def test_galaxy_api_server_api_version_invalidated(galaxy_context_example_invalid, requests_mock):
+    requests_mock.get('http://bogus.invalid:9443/api/',
+                      json={'current_version': 'v1'})
+    requests_mock.get('http://bogus.invalid:9443/api/v2/some_object/',
+                      status_code=404,
+                      text='<html>Not here anymore</html>')
+
+    api = rest_api.GalaxyAPI(galaxy_context_example_invalid)
+
+    with pytest.raises(exceptions.GalaxyRestServerError):
+        api.get_object('http://bogus.invalid:9443/api/v2/some_object/')
+
+    assert api_version_cache.get(galaxy_context_example_invalid, 'http://bogus.invalid:9443') is None
+    assert api.initialized is False
+
+
+def test_galaxy_api_server_api_version_not_invalidated(galaxy_context_example_invalid, requests_mock):
+    requests_mock.get('http://bogus.invalid:9443/api/',
+                      json={'current_version': 'v1'})
+    requests_mock.get('http://bogus.invalid:9443/api/v2/collections/some_ns/not_a_collection/',
+                      status_code=404,
+                      json={'code': 'not_found', 'message': 'Not found.'})
+
+    api = rest_api.GalaxyAPI(galaxy_context_example_invalid)
+
+    with pytest.raises(exceptions.GalaxyRestAPIError):
+        api.get_object('http://bogus.invalid:9443/api/v2/collections/some_ns/not_a_collection/')
+
+    # a Galaxy API 404 is just a collection that doesn't exist
+    assert api_version_cache.get(galaxy_context_example_invalid, 'http://bogus.invalid:9443') == 'v1'
+
+
 def test_galaxy_api_properties(galaxy_api):
     log.debug('api_server: %s', galaxy_api.api_server)
     log.debug('validate_certs: %s', galaxy_api.rest_client.validate_certs)
@@ -548,6 +595,80 @@ def test_get_object_paginated_error_on_second_request(galaxy_api_mocked, request
     assert 'http://bogus.invalid:9443/api/v3/even_numbers/?page=2&page_size=2' in str(exc)
 
 
+def test_get_object_paginated_concurrently(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/versions/'
+    page_url = url + '?page={page}&page_size=2'
+
+    # 7 items, 2 per page, so 4 pages
+    for page in range(1, 5):
+        next_url = page_url.format(page=page + 1) if page < 4 else None
+        requests_mock.get(page_url.format(page=page) if page > 1 else url + '?page_size=2',
+                          json={'count': 7,
+                                'next': next_url,
+                                'results': [x for x in range((page - 1) * 2, min(page * 2, 7))]})
+
+    data = galaxy_api_mocked.get_object(href=url, page_size=2)
+
+    assert data == [0, 1, 2, 3, 4, 5, 6]
+
+    requested_urls = set([x.url for x in requests_mock.request_history])
+    assert page_url.format(page=3) in requested_urls
+    assert page_url.format(page=4) in requested_urls
+
+
+def test_get_object_paginated_more_pages_after_count(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v3/even_numbers/'
+
+    requests_mock.get(url, json={'count': 4,
+                                 'next': url + '?page=2',
+                                 'results': [2, 4]})
+    # more items were added after the first page was fetched
+    requests_mock.get(url + '?page=2', json={'count': 6,
+                                             'next': url + '?page=3',
+                                             'results': [6, 8]})
+    requests_mock.get(url + '?page=3', json={'count': 6,
+                                             'next': None,
+                                             'results': [10, 12]})
+
+    data = galaxy_api_mocked.get_object(href=url)
+
+    assert data == [2, 4, 6, 8, 10, 12]
+
+
+def test_get_object_paginated_cursor(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v3/even_numbers/'
+
+    # 'next' urls without a page number have to be followed one at a time
+    requests_mock.get(url, json={'count': 4,
+                                 'next': url + '?cursor=blip',
+                                 'results': [2, 4]})
+    requests_mock.get(url + '?cursor=blip', json={'count': 4,
+                                                  'next': None,
+                                                  'results': [6, 8]})
+
+    data = galaxy_api_mocked.get_object(href=url)
+
+    assert data == [2, 4, 6, 8]
+
+
+@pytest.mark.parametrize("next_url,count,page_length,expected", [
+    (None, 10, 2, None),
+    ('http://bogus.invalid/api/?page=2', None, 2, None),
+    ('http://bogus.invalid/api/?cursor=blip', 10, 2, None),
+    ('http://bogus.invalid/api/?page=2', 3, 2, ['http://bogus.invalid/api/?page=2']),
+    ('http://bogus.invalid/api/?page=2&page_size=2', 6, 2, ['http://bogus.invalid/api/?page=2&page_size=2',
+                                                            'http://bogus.invalid/api/?page=3&page_size=2']),
+])
+def test_page_urls_from_next(next_url, count, page_length, expected):
+    assert rest_api.page_urls_from_next(next_url, count, page_length) == expected
+
+
+def test_set_query_params():
+    res = rest_api.set_query_params('http://bogus.invalid/api/?page=2&blip=1', page=3, page_size=10)
+
+    assert res == 'http://bogus.invalid/api/?page=3&blip=1&page_size=10'
+
+
 def test_get_object_403(galaxy_api_mocked, requests_mock):
     url = 'http://bogus.invalid:9443/api/v3/invisible_unicorns/narnia/aurora/versions/51.51.51/'
 
@@ -736,3 +857,244 @@ def test_galaxy_api_get_collection_detail_SSLError(mocker, galaxy_api, requests_
         galaxy_api.get_collection_detail('some-test-namespace', 'some-test-name')
 
     log.debug('exc_info: %s', exc_info)
+
+
+def test_get_object_memoized(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+    requests_mock.get(url, json={'name': 'some_name'})
+
+    res = galaxy_api_mocked.get_object(url)
+    request_count = requests_mock.call_count
+
+    assert galaxy_api_mocked.get_object(url) == res
+    assert requests_mock.call_count == request_count
+
+
+def test_get_object_memoized_not_found(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/not_a_collection/'
+    requests_mock.get(url, status_code=404, json={'code': 'not_found', 'message': 'Not found.'})
+
+    with pytest.raises(exceptions.GalaxyRestAPIError):
+        galaxy_api_mocked.get_object(url)
+
+    request_count = requests_mock.call_count
+
+    with pytest.raises(exceptions.GalaxyRestAPIError):
+        galaxy_api_mocked.get_object(url)
+
+    assert requests_mock.call_count == request_count
+
+
+def test_get_object_memoized_other_errors_retried(galaxy_api_mocked, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+    requests_mock.get(url, [{'status_code': 400, 'json': {'code': 'error', 'message': 'Oops.'}},
+                            {'json': {'name': 'some_name'}}])
+
+    with pytest.raises(exceptions.GalaxyRestAPIError):
+        galaxy_api_mocked.get_object(url)
+
+    assert galaxy_api_mocked.get_object(url) == {'name': 'some_name'}
+
+
+def test_get_object_coalesced(galaxy_api_mocked, mocker):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    request_started = threading.Event()
+    release_request = threading.Event()
+
+    def get_object(href=None):
+        request_started.set()
+        assert release_request.wait(5)
+        return {'name': 'some_name'}
+
+    # skip the api version check, since it also uses _get_object
+    galaxy_api_mocked.initialized = True
+    mock_get_object = mocker.patch.object(galaxy_api_mocked, '_get_object', side_effect=get_object)
+
+    results = []
+    lookup_thread = threading.Thread(target=lambda: results.append(galaxy_api_mocked.get_object(url)))
+    lookup_thread.start()
+
+    assert request_started.wait(5)
+
+    # the url is already being requested, so this waits for that request instead of making another
+    threading.Timer(0.1, release_request.set).start()
+    res = galaxy_api_mocked.get_object(url)
+
+    lookup_thread.join(5)
+
+    assert res == {'name': 'some_name'}
+    assert results == [res]
+    assert mock_get_object.call_count == 1
+
+
+@pytest.fixture
+def galaxy_api_http_cache(galaxy_context_example_invalid, requests_mock, tmpdir):
+    galaxy_context_example_invalid.options['cache_path'] = tmpdir.mkdir('cache').strpath
+
+    requests_mock.get('http://bogus.invalid:9443/api/',
+                      json={'current_version': 'v1'})
+
+    api = rest_api.GalaxyAPI(galaxy_context_example_invalid)
+    return api
+
+
+def test_get_object_http_cache_not_modified(galaxy_api_http_cache, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    requests_mock.get(url, [{'json': {'name': 'some_name'},
+                             'headers': {'ETag': '"some_etag"'}},
+                            {'status_code': 304}])
+
+    res = galaxy_api_http_cache.get_object(url)
+    assert res == {'name': 'some_name'}
+
+    # a later run, since a GalaxyAPI only requests an url once
+    res2 = rest_api.GalaxyAPI(galaxy_api_http_cache.galaxy_context).get_object(url)
+    assert res2 == {'name': 'some_name'}
+
+    assert requests_mock.request_history[-1].headers['If-None-Match'] == '"some_etag"'
+
+
+def test_get_object_http_cache_modified(galaxy_api_http_cache, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    requests_mock.get(url, [{'json': {'name': 'some_name'},
+                             'headers': {'ETag': '"some_etag"'}},
+                            {'json': {'name': 'some_new_name'},
+                             'headers': {'ETag': '"some_new_etag"'}}])
+
+    galaxy_api_http_cache.get_object(url)
+    res = rest_api.GalaxyAPI(galaxy_api_http_cache.galaxy_context).get_object(url)
+
+    assert res == {'name': 'some_new_name'}
+    assert galaxy_api_http_cache.http_cache.load(url)['etag'] == '"some_new_etag"'
+
+
+def test_get_object_http_cache_ttl(galaxy_api_http_cache, requests_mock):
+    galaxy_api_http_cache.http_cache.ttl = 300
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    requests_mock.get(url, json={'name': 'some_name'})
+
+    galaxy_api_http_cache.get_object(url)
+    request_count = requests_mock.call_count
+
+    later_galaxy_api = rest_api.GalaxyAPI(galaxy_api_http_cache.galaxy_context)
+    later_galaxy_api.http_cache.ttl = 300
+    res = later_galaxy_api.get_object(url)
+
+    assert res == {'name': 'some_name'}
+    # the fresh entry was used without a request
+    assert requests_mock.call_count == request_count
+
+
+def test_get_object_http_cache_stale_while_revalidate(galaxy_api_http_cache, requests_mock, mocker):
+    galaxy_api_http_cache.http_cache.stale_while_revalidate = 300
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    galaxy_api_http_cache.http_cache.save(url, {'name': 'some_stale_name'})
+    requests_mock.get(url, json={'name': 'some_name'})
+
+    mock_thread = mocker.patch('ansible_galaxy.rest_api.threading.Thread')
+
+    res = galaxy_api_http_cache.get_object(url)
+
+    assert res == {'name': 'some_stale_name'}
+    assert mock_thread.return_value.start.call_count == 1
+    # doesn't keep mazer from exiting
+    assert mock_thread.return_value.daemon is True
+
+    # run the background revalidation now
+    galaxy_api_http_cache._revalidate(*mock_thread.call_args[1]['args'])
+
+    assert galaxy_api_http_cache.http_cache.load(url)['data'] == {'name': 'some_name'}
+
+
+def test_get_object_http_cache_stale_while_revalidate_once(galaxy_api_http_cache, requests_mock, mocker):
+    galaxy_api_http_cache.http_cache.stale_while_revalidate = 300
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    galaxy_api_http_cache.http_cache.save(url, {'name': 'some_stale_name'})
+    requests_mock.get(url, json={'name': 'some_name'})
+
+    mock_thread = mocker.patch('ansible_galaxy.rest_api.threading.Thread')
+
+    # each GalaxyAPI looks it up, but only one revalidation is started
+    for dummy in range(3):
+        later_galaxy_api = rest_api.GalaxyAPI(galaxy_api_http_cache.galaxy_context)
+        later_galaxy_api.http_cache.stale_while_revalidate = 300
+
+        assert later_galaxy_api.get_object(url) == {'name': 'some_stale_name'}
+
+    assert mock_thread.return_value.start.call_count == 1
+
+    # once it is done, the next stale response can be revalidated again
+    later_galaxy_api._revalidate(*mock_thread.call_args[1]['args'])
+    galaxy_api_http_cache.http_cache.save(url, {'name': 'some_stale_name'})
+
+    assert galaxy_api_http_cache.get_object(url) == {'name': 'some_stale_name'}
+    assert mock_thread.return_value.start.call_count == 2
+
+
+def test_get_object_http_cache_errors_not_cached(galaxy_api_http_cache, requests_mock):
+    url = 'http://bogus.invalid:9443/api/v2/collections/some_ns/some_name/'
+
+    requests_mock.get(url, status_code=404, json={'code': 'not_found', 'message': 'Not found.'})
+
+    with pytest.raises(exceptions.GalaxyRestAPIError):
+        galaxy_api_http_cache.get_object(url)
+
+    assert galaxy_api_http_cache.http_cache.load(url) is None
+
+
+def test_server_semaphore(mocker):
+    mocker.patch.dict('ansible_galaxy.rest_api._server_semaphores', clear=True)
+
+    semaphore = rest_api.server_semaphore('http://some.invalid', max_concurrency=2)
+
+    # every client for the same server shares the semaphore
+    assert rest_api.server_semaphore('http://some.invalid', max_concurrency=10) is semaphore
+    assert rest_api.server_semaphore('http://other.invalid') is not semaphore
+
+    assert semaphore.acquire(False)
+    assert semaphore.acquire(False)
+    assert not semaphore.acquire(False)
+
+
+def test_rest_client_uses_server_semaphore(galaxy_api_mocked, requests_mock, mocker):
+    requests_mock.get('http://bogus.invalid:9443/api/v2/some_object/',
+                      json={'some': 'object'})
+
+    mock_semaphore = mocker.MagicMock(name='mock_semaphore')
+    galaxy_api_mocked.rest_client.semaphore = mock_semaphore
+
+    galaxy_api_mocked.get_object('http://bogus.invalid:9443/api/v2/some_object/')
+
+    # every request (including the api version check) is made while holding the semaphore
+    assert mock_semaphore.acquire.call_count == requests_mock.call_count
+    assert mock_semaphore.release.call_count == requests_mock.call_count
+
+
+def test_rest_client_releases_server_semaphore_while_waiting(galaxy_api_mocked, requests_mock, monkeypatch):
+    url = 'http://bogus.invalid:9443/api/v2/some_object/'
+    requests_mock.get(url, [{'status_code': 503, 'headers': {'Retry-After': '5'}},
+                            {'json': {'some': 'object'}}])
+
+    semaphore = threading.BoundedSemaphore(1)
+    galaxy_api_mocked.rest_client.semaphore = semaphore
+
+    free_while_waiting = []
+
+    def sleep(seconds):
+        # another request to the server can be made while this one waits to retry
+        free_while_waiting.append(semaphore.acquire(False))
+        semaphore.release()
+
+    monkeypatch.setattr('ansible_galaxy.http_transfer._sleep', sleep)
+
+    assert galaxy_api_mocked.get_object(url) == {'some': 'object'}
+
+    assert free_while_waiting == [True]
+    # and it is released when done
+    assert semaphore.acquire(False)
@@ -1,7 +1,9 @@
 import logging
 
 import pytest
+import semantic_version
 
+from ansible_galaxy.utils import version
 from ansible_galaxy.utils.version import normalize_version_string
 
 
@@ -56,3 +58,98 @@ def test_normalize_version_string_unmodified(version_string_unmodified):
     res = normalize_version_string(version_string_unmodified)
     log.debug('res: %s version_string: %s', res, version_string_unmodified)
     assert res == version_string_unmodified
+
+
+def test_convert_string_to_version_spec_memoized():
+    assert version.convert_string_to_version_spec('>=1.0.0') is version.convert_string_to_version_spec('>=1.0.0')
+
+
+def test_convert_string_to_semver_memoized():
+    assert version.convert_string_to_semver('1.2.3') is version.convert_string_to_semver('1.2.3')
+
+
+@pytest.mark.parametrize("version_spec,expected", [
+    ('*', (None, None)),
+    ('==1.2.3', ('1.2.3', '1.2.3')),
+    ('1.2.3', ('1.2.3', '1.2.3')),
+    ('>=1.0.0,<2.0.0', ('1.0.0', '2.0.0')),
+    ('>1.0.0,!=1.5.0', ('1.0.0', None)),
+    ('<=3.0.0,<2.0.0', (None, '2.0.0')),
+    # partial versions and other operators don't narrow the range
+    ('==1.2', (None, None)),
+    ('~1.2.0', (None, None)),
+    ('^1.2.0', (None, None)),
+])
+def test_version_spec_bounds(version_spec, expected):
+    lowest, highest = version.version_spec_bounds(semantic_version.Spec(version_spec))
+
+    assert (lowest and str(lowest), highest and str(highest)) == expected
+
+
+@pytest.fixture
+def version_index():
+    return version.VersionIndex(['2.0.0', '1.0.0', '1.5.0', '1.5.1-beta', '0.9.0', '1.2.0'])
+
+
+def test_version_index_sorted(version_index):
+    assert [str(ver) for ver in version_index] == ['0.9.0', '1.0.0', '1.2.0', '1.5.0', '1.5.1-beta', '2.0.0']
+    assert len(version_index) == 6
+    assert '1.2.0' in version_index
+    assert '1.2.1' not in version_index
+
+
+@pytest.mark.parametrize("version_specs", [
+    ['*'],
+    ['==1.2.0'],
+    ['>=1.0.0,<2.0.0'],
+    ['>1.0.0', '!=1.5.0'],
+    ['==1.5'],
+    ['~1.5.0'],
+    ['>=1.0.0', '<1.5.0'],
+    ['>=3.0.0'],
+    ['<2.0.0', '>=2.0.0'],
+])
+def test_version_index_filter(version_index, version_specs):
+    specs = [semantic_version.Spec(version_spec) for version_spec in version_specs]
+
+    # the same answer as checking every version
+    expected = [ver for ver in version_index if all(spec.match(ver) for spec in specs)]
+
+    assert version_index.filter(*specs) == expected
+
+    expected_best = max(expected) if expected else None
+    assert version_index.select(*specs) == expected_best
+
+
+@pytest.mark.parametrize("versions", [
+    ['1.0.0', '1.0.0+b1', '1.0.0+b2', '0.9.0', '1.0.1'],
+    ['1.0.0+b2', '1.0.1', '1.0.0+b1', '0.9.0', '1.0.0'],
+])
+@pytest.mark.parametrize("version_spec", ['==1.0.0', '<=1.0.0', '<1.0.1', '==1.0.0+b1', '!=1.0.0+b2', '>0.9.0,<=1.0.0'])
+def test_version_index_build_metadata(versions, version_spec):
+    version_index = version.VersionIndex(versions)
+    spec = semantic_version.Spec(version_spec)
+
+    # builds of the same version are in the same order, whatever order they were added in
+    assert [str(ver) for ver in version_index] == ['0.9.0', '1.0.0', '1.0.0+b1', '1.0.0+b2', '1.0.1']
+
+    # the same answer as checking every version
+    expected = sorted([semantic_version.Version(ver) for ver in versions if spec.match(semantic_version.Version(ver))],
+                      key=version.version_sort_key)
+
+    assert version_index.filter(spec) == expected
+    assert version_index.select(spec) == expected[-1]
+
+
+def test_version_index_data():
+    version_index = version.VersionIndex()
+    version_index.add('1.0.0', data={'href': '/1.0.0/'})
+
+    assert version_index.data(semantic_version.Version('1.0.0')) == {'href': '/1.0.0/'}
+    assert version_index.data('2.0.0') is None
+    assert version_index.data(None) is None
+
+
+def test_version_index_invalid():
+    with pytest.raises(ValueError):
+        version.VersionIndex(['not_a_version'])
@@ -1,7 +1,9 @@
+import logging
 import os
-import pytest
+import shutil
 
-import logging
+import pytest
+import yaml
 
 log = logging.getLogger(__name__)
 
@@ -12,14 +14,46 @@ def mazer_args_for_test(tmpdir_factory):
 
 
 @pytest.fixture(autouse=True)
-def inject_mazer_home(monkeypatch):
-    _mazer_home = os.path.join(os.path.dirname(__file__), '_mazer_home')
+def inject_mazer_home(monkeypatch, tmpdir_factory):
+    # A copy of _mazer_home and _mazer_work_dir, so the logs and installed indexes
+    # written while running the tests do not end up in the source tree
+    tests_path = os.path.dirname(__file__)
+    work_dir = tmpdir_factory.mktemp('_mazer_work_dir')
+    _mazer_home = tmpdir_factory.mktemp('_mazer_home')
+
+    for collections_dir in ('user_collections', 'global_collections'):
+        shutil.copytree(os.path.join(tests_path, '_mazer_work_dir', collections_dir),
+                        work_dir.join(collections_dir).strpath,
+                        symlinks=True)
+
+    with open(os.path.join(tests_path, '_mazer_home', 'mazer.yml'), 'r') as config_fd:
+        config_data = yaml.safe_load(config_fd)
+
+    config_data['collections_path'] = work_dir.join('user_collections').strpath
+    config_data['global_collections_path'] = work_dir.join('global_collections').strpath
+
+    _mazer_home.join('mazer.yml').write(yaml.safe_dump(config_data, default_flow_style=False))
 
     monkeypatch.setattr("ansible_galaxy.config.defaults.MAZER_HOME",
-                        _mazer_home)
+                        _mazer_home.strpath)
     # log.debug('monkeypatched MAZER_HOME to %s', _mazer_home)
 
 
+@pytest.fixture(autouse=True)
+def no_cached_api_versions(monkeypatch):
+    # the Galaxy server API versions are cached for the life of the process
+    monkeypatch.setattr("ansible_galaxy.api_version_cache._versions", {})
+
+
+@pytest.fixture(autouse=True)
+def no_http_retry_waits(monkeypatch):
+    # failed requests are retried right away, and rate limiters are not shared between tests
+    monkeypatch.setattr("ansible_galaxy.http_transfer._sleep", lambda seconds: None)
+    monkeypatch.setattr("ansible_galaxy.http_transfer._rate_limiters", {})
+    monkeypatch.setattr("ansible_galaxy.http_transfer._download_limits", {})
+    monkeypatch.setattr("ansible_galaxy.rest_api._revalidations", {})
+
+
 @pytest.fixture
 def galaxy_context(tmpdir):
     # FIXME: mock
@@ -32,3 +66,19 @@ def galaxy_context(tmpdir):
     from ansible_galaxy.models.context import GalaxyContext
 
     return GalaxyContext(server=server, collections_path=collections_path.strpath)
+
+
+@pytest.fixture
+def galaxy_stand_in(tmpdir):
+    '''A local Galaxy API server serving the artifacts in its artifacts_path (empty to start with)
+
+    Use galaxy_stand_in_py.make_artifact(galaxy_stand_in.artifacts_path, ...) and
+    galaxy_stand_in.add_artifact() to add collections.'''
+    import galaxy_stand_in as galaxy_stand_in_py
+
+    server = galaxy_stand_in_py.GalaxyStandIn(tmpdir.mkdir('galaxy_stand_in_artifacts').strpath, seed=0)
+    server.start()
+
+    yield server
+
+    server.stop()
@@ -0,0 +1,449 @@
+'''A local stand-in for a Galaxy API server, serving collection artifacts from a directory
+
+It implements just enough of the Galaxy API for mazer to find, download and install
+collections without a live Galaxy:
+
+    GET /api/
+    GET /api/v2/collections/{namespace}/{name}/
+    GET /api/v2/collections/{namespace}/{name}/versions/            (paginated)
+    GET /api/v2/collections/{namespace}/{name}/versions/{version}/
+    GET /download/{namespace}-{name}-{version}.tar.gz
+
+The collections are the '{namespace}-{name}-{version}.tar.gz' artifacts (ie, from
+'mazer build') in artifacts_path. Their dependencies are read from their MANIFEST.json.
+
+Latency, bandwidth caps and errors can be injected to measure and regression test the
+install pipeline, the caches and the retry logic offline:
+
+    latency       seconds to wait before answering each request
+    bandwidth     max bytes per second for each artifact download (0 for no limit)
+    error_rate    fraction (0.0 - 1.0) of requests answered with error_status instead
+    error_status  the http status of injected errors (default 503)
+    retry_after   if set, the Retry-After header of injected errors
+    drop_after    close the connection after sending this many bytes of each artifact
+                  download (0 to send all of it), to test resuming downloads
+    ranges        whether artifact downloads support Range requests (default True)
+
+In tests, use the 'galaxy_stand_in' fixture from conftest.py. To run it by hand:
+
+    $ python tests/galaxy_stand_in.py --artifacts ~/artifacts --port 8000 --latency 0.2
+    $ mazer install --server http://127.0.0.1:8000 some_namespace.some_name
+'''
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib.parse import parse_qs, quote as urlquote, urlparse
+
+from ansible_galaxy.actions import build
+from ansible_galaxy.models.build_context import BuildContext
+from ansible_galaxy.models.context import GalaxyContext
+from ansible_galaxy.utils import chksums
+
+log = logging.getLogger(__name__)
+
+ARTIFACT_FILENAME_RE = re.compile(r'^(?P<namespace>[^-]+)-(?P<name>[^-]+)-(?P<version>.+)\.tar\.gz$')
+
+COLLECTION_RE = re.compile(r'^/api/v2/collections/(?P<namespace>[^/]+)/(?P<name>[^/]+)/$')
+VERSIONS_RE = re.compile(r'^/api/v2/collections/(?P<namespace>[^/]+)/(?P<name>[^/]+)/versions/$')
+VERSION_RE = re.compile(r'^/api/v2/collections/(?P<namespace>[^/]+)/(?P<name>[^/]+)/versions/(?P<version>[^/]+)/$')
+DOWNLOAD_RE = re.compile(r'^/download/(?P<filename>[^/]+)$')
+
+# Only single ranges ('bytes=100-' or 'bytes=100-199') are supported
+RANGE_RE = re.compile(r'^bytes=(?P<start>\d+)-(?P<end>\d*)$')
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+# How much of an artifact is sent at a time when the bandwidth is capped
+BANDWIDTH_CHUNKS_PER_SECOND = 20
+
+
+def make_artifact(artifacts_path, namespace, name, version, dependencies=None, padding=0):
+    '''Build a collection artifact with 'mazer build' into artifacts_path and return its path
+
+    padding is the size of an extra (random, so incompressible) file to include, for
+    artifacts of a useful size for bandwidth tests.'''
+    collection_path = tempfile.mkdtemp(prefix='tmp-galaxy-stand-in-')
+
+    galaxy_yml = {'namespace': namespace,
+                  'name': name,
+                  'version': version,
+                  'description': 'A collection served by the galaxy stand-in',
+                  'authors': ['Galaxy Stand-In'],
+                  'license': 'GPL-3.0-or-later',
+                  'dependencies': dependencies or {}}
+
+    # json is valid yaml
+    with open(os.path.join(collection_path, 'galaxy.yml'), 'w') as galaxy_yml_fo:
+        json.dump(galaxy_yml, galaxy_yml_fo)
+
+    if padding:
+        with open(os.path.join(collection_path, 'padding.bin'), 'wb') as padding_fo:
+            padding_fo.write(os.urandom(padding))
+
+    try:
+        build_context = BuildContext(collection_path, output_path=artifacts_path)
+        results = build._build(GalaxyContext(), build_context, lambda *args, **kwargs: None)
+    finally:
+        shutil.rmtree(collection_path)
+
+    return results['build_results'].artifact_file_path
+
+
+def _load_manifest(artifact_path):
+    with tarfile.open(artifact_path, 'r:gz') as artifact_tar:
+        for member in artifact_tar.getmembers():
+            if os.path.basename(member.name) == 'MANIFEST.json':
+                return json.loads(artifact_tar.extractfile(member).read().decode('utf-8'))
+
+    return {}
+
+
+class GalaxyStandIn(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''The stand-in server. start() serves requests from a background thread.'''
+
+    daemon_threads = True
+
+    def __init__(self, artifacts_path, host='127.0.0.1', port=0,
+                 latency=0, bandwidth=0, error_rate=0, error_status=503, retry_after=None,
+                 drop_after=0, ranges=True, seed=None):
+        BaseHTTPServer.HTTPServer.__init__(self, (host, port), GalaxyStandInHandler)
+
+        self.artifacts_path = artifacts_path
+
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.drop_after = drop_after
+        self.ranges = ranges
+
+        self._random = random.Random(seed)
+
+        # (namespace, name) -> {version: artifact info}
+        self.collections = {}
+
+        # The paths requested, in order, and the Range header of each artifact download
+        self.requests = []
+        self.download_ranges = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+        self._thread = None
+
+        self.load_artifacts()
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address[:2]
+
+    def load_artifacts(self):
+        if not os.path.isdir(self.artifacts_path):
+            return
+
+        for filename in sorted(os.listdir(self.artifacts_path)):
+            if ARTIFACT_FILENAME_RE.match(filename):
+                self.add_artifact(os.path.join(self.artifacts_path, filename))
+
+    def add_artifact(self, artifact_path):
+        '''Serve the artifact at artifact_path'''
+        collection_info = _load_manifest(artifact_path).get('collection_info', {})
+
+        artifact_info = {'path': artifact_path,
+                         'filename': os.path.basename(artifact_path),
+                         'size': os.path.getsize(artifact_path),
+                         'sha256': chksums.sha256sum_from_path(artifact_path),
+                         'dependencies': collection_info.get('dependencies', None) or {}}
+
+        key = (collection_info['namespace'], collection_info['name'])
+        self.collections.setdefault(key, {})[collection_info['version']] = artifact_info
+
+        return artifact_info
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='galaxy-stand-in')
+        self._thread.daemon = True
+        self._thread.start()
+
+        log.debug('Galaxy stand-in serving %s at %s', self.artifacts_path, self.url)
+
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+        if self._thread:
+            self._thread.join()
+
+    def reset_stats(self):
+        with self._lock:
+            self.requests = []
+            self.download_ranges = []
+            self.max_in_flight = 0
+
+    def request_started(self, path):
+        with self._lock:
+            self.requests.append(path)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+            return self._random.random() < self.error_rate
+
+    def request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    # The API documents
+
+    def collection_url(self, namespace, name):
+        return '%s/api/v2/collections/%s/%s/' % (self.url, urlquote(namespace), urlquote(name))
+
+    def version_summary(self, namespace, name, version):
+        return {'version': version,
+                'href': '%sversions/%s/' % (self.collection_url(namespace, name), urlquote(version))}
+
+    def collection_detail(self, namespace, name):
+        versions = self.collections.get((namespace, name), None)
+        if not versions:
+            return None
+
+        return {'href': self.collection_url(namespace, name),
+                'name': name,
+                'namespace': {'name': namespace},
+                'versions_url': '%sversions/' % self.collection_url(namespace, name),
+                'deprecated': False}
+
+    def versions_page(self, namespace, name, page, page_size):
+        versions = self.collections.get((namespace, name), None)
+        if not versions:
+            return None
+
+        version_list = sorted(versions)
+        page_versions = version_list[(page - 1) * page_size:page * page_size]
+
+        page_url = '%sversions/?page=%%s&page_size=%s' % (self.collection_url(namespace, name), page_size)
+
+        return {'count': len(version_list),
+                'next': page_url % (page + 1) if page * page_size < len(version_list) else None,
+                'previous': page_url % (page - 1) if page > 1 else None,
+                'results': [self.version_summary(namespace, name, version) for version in page_versions]}
+
+    def version_detail(self, namespace, name, version):
+        artifact_info = self.collections.get((namespace, name), {}).get(version, None)
+        if not artifact_info:
+            return None
+
+        detail = self.version_summary(namespace, name, version)
+        detail.update({'download_url': '%s/download/%s' % (self.url, artifact_info['filename']),
+                       'artifact': {'filename': artifact_info['filename'],
+                                    'size': artifact_info['size'],
+                                    'sha256': artifact_info['sha256']},
+                       'namespace': {'name': namespace},
+                       'collection': {'name': name},
+                       'metadata': {'namespace': namespace,
+                                    'name': name,
+                                    'version': version,
+                                    'dependencies': artifact_info['dependencies']}})
+        return detail
+
+    def artifact_info(self, filename):
+        for versions in self.collections.values():
+            for artifact_info in versions.values():
+                if artifact_info['filename'] == filename:
+                    return artifact_info
+
+        return None
+
+
+class GalaxyStandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        log.debug('%s - %s', self.address_string(), format % args)
+
+    def send_json(self, data, status=200, headers=None):
+        body = json.dumps(data).encode('utf-8')
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
+        self.end_headers()
+
+        self.wfile.write(body)
+
+    def send_not_found(self):
+        self.send_json({'code': 'not_found', 'message': 'Not found.'}, status=404)
+
+    def _requested_range(self, artifact_info):
+        '''The (start, end) of the requested range of the artifact, or None for all of it'''
+        range_header = self.headers.get('Range', None)
+        if not self.server.ranges or not range_header:
+            return None
+
+        # If-Range with an old ETag means the client has the wrong artifact, so send all of it
+        if_range = self.headers.get('If-Range', None)
+        if if_range and if_range != '"%s"' % artifact_info['sha256']:
+            return None
+
+        matches = RANGE_RE.match(range_header.strip())
+        if not matches:
+            return None
+
+        size = artifact_info['size']
+        start = int(matches.group('start'))
+        end = min(size - 1, int(matches.group('end') or size - 1))
+
+        if start > end:
+            return None
+
+        return (start, end)
+
+    def send_artifact(self, artifact_info):
+        size = artifact_info['size']
+
+        self.server.download_ranges.append(self.headers.get('Range', None))
+
+        requested_range = self._requested_range(artifact_info)
+        start, end = requested_range or (0, size - 1)
+
+        self.send_response(206 if requested_range else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end + 1 - start))
+        self.send_header('ETag', '"%s"' % artifact_info['sha256'])
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if requested_range:
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (start, end, size))
+        self.end_headers()
+
+        bandwidth = self.server.bandwidth
+        chunk_size = max(1, int(bandwidth / BANDWIDTH_CHUNKS_PER_SECOND)) if bandwidth else 64 * 1024
+
+        remaining = end + 1 - start
+        if self.server.drop_after:
+            remaining = min(remaining, self.server.drop_after)
+
+            # the client sees a short read
+            self.close_connection = True
+
+        with open(artifact_info['path'], 'rb') as artifact_fo:
+            artifact_fo.seek(start)
+
+            while remaining > 0:
+                chunk = artifact_fo.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+                if bandwidth:
+                    time.sleep(float(len(chunk)) / bandwidth)
+
+    def do_GET(self):
+        inject_error = self.server.request_started(self.path)
+
+        try:
+            if self.server.latency:
+                time.sleep(self.server.latency)
+
+            if inject_error:
+                headers = {}
+                if self.server.retry_after is not None:
+                    headers['Retry-After'] = str(self.server.retry_after)
+
+                self.send_json({'code': 'injected_error', 'message': 'An injected error.'},
+                               status=self.server.error_status,
+                               headers=headers)
+                return
+
+            self.route()
+        finally:
+            self.server.request_finished()
+
+    def route(self):
+        parsed_url = urlparse(self.path)
+        path = parsed_url.path
+        query = parse_qs(parsed_url.query)
+
+        if path == '/api/':
+            self.send_json({'current_version': 'v2',
+                            'available_versions': {'v1': 'v1/', 'v2': 'v2/'}})
+            return
+
+        matches = COLLECTION_RE.match(path)
+        if matches:
+            data = self.server.collection_detail(matches.group('namespace'), matches.group('name'))
+            return self.send_json(data) if data else self.send_not_found()
+
+        matches = VERSIONS_RE.match(path)
+        if matches:
+            page = int(query.get('page', ['1'])[0])
+            page_size = min(MAX_PAGE_SIZE, int(query.get('page_size', [DEFAULT_PAGE_SIZE])[0]))
+
+            data = self.server.versions_page(matches.group('namespace'), matches.group('name'), page, page_size)
+            return self.send_json(data) if data else self.send_not_found()
+
+        matches = VERSION_RE.match(path)
+        if matches:
+            data = self.server.version_detail(matches.group('namespace'), matches.group('name'), matches.group('version'))
+            return self.send_json(data) if data else self.send_not_found()
+
+        matches = DOWNLOAD_RE.match(path)
+        if matches:
+            artifact_info = self.server.artifact_info(matches.group('filename'))
+            return self.send_artifact(artifact_info) if artifact_info else self.send_not_found()
+
+        self.send_not_found()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A local stand-in for a Galaxy API server')
+    parser.add_argument('--artifacts', required=True, help='The directory of collection artifacts to serve')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0, help='Seconds to wait before answering each request')
+    parser.add_argument('--bandwidth', type=int, default=0, help='Max bytes per second for each download')
+    parser.add_argument('--error-rate', type=float, default=0, help='The fraction of requests to answer with an error')
+    parser.add_argument('--error-status', type=int, default=503)
+    parser.add_argument('--retry-after', type=int, default=None)
+    parser.add_argument('--drop-after', type=int, default=0, help='Drop downloads after sending this many bytes')
+    parser.add_argument('--no-ranges', action='store_true', help='Do not support Range requests')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+
+    server = GalaxyStandIn(args.artifacts, host=args.host, port=args.port,
+                           latency=args.latency, bandwidth=args.bandwidth,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           retry_after=args.retry_after,
+                           drop_after=args.drop_after, ranges=not args.no_ranges)
+
+    print('Serving %s at %s' % (args.artifacts, server.url))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()